@@ -1,67 +1,61 @@
 # SimFinFund.py
-import simfin as sf
-import pandas as pd
+import time
+MODULE_IMPORT_STARTED = time.perf_counter()
+
 import os
-import json
-import yfinance as yf
+import sys
+import threading
 
-from flask import Flask, render_template, request, url_for, redirect, flash, session
-import plotly.express as px
-import plotly.graph_objects as go
-import plotly.utils
+from flask import Flask, current_app, render_template, request, url_for, redirect, flash, session, make_response, jsonify
 
-from downloader import download_financial_statements, download_price_history_with_mavg
+from frame_cache import DEFAULT_FRAME_CACHE_MAX_BYTES, frame_cache, frame_cache_key
+from lazy_imports import lazy_from, lazy_module, loaded_lazy_modules
+from request_timing import (DEFAULT_SLOW_REQUEST_SECONDS, STAGE_FIGURE, STAGE_LOAD, STAGE_SERIALIZE,
+                            STAGE_TRANSFORM, init_request_timing, request_metrics, stage, timed_stage)
+from simfin_setup import API_KEY_FILE, ensure_simfin_configured
 
-# --- הגדרות API ---
-API_KEY_FILE = 'simfin_api_key.txt' # נשאר כפי שהוא, לניהול מפתח SimFin
+# ספריות כבדות (simfin, pandas, plotly, yfinance דרך price_store) ומודולי הנתונים נטענים בשימוש הראשון -
+# בבקשה הראשונה שצריכה אותם או בחימום המטמונים - ולא בייבוא האפליקציה
+sf = lazy_module('simfin')
+pd = lazy_module('pandas')
+px = lazy_module('plotly.express')
+go = lazy_module('plotly.graph_objects')
+derived_metrics = lazy_module('derived_metrics')
+downsample = lazy_module('downsample')
+peer_comparison = lazy_module('peer_comparison')
+screener = lazy_module('screener')
+valuation = lazy_module('valuation')
 
-def load_simfin_api_key():
-    api_key = 'free'
-    if os.path.exists(API_KEY_FILE):
-        try:
-            with open(API_KEY_FILE, 'r') as f:
-                read_key = f.read().strip()
-            if read_key:
-                api_key = read_key
-        except IOError:
-            print(f"SimFinFund.py: Could not read API key file '{API_KEY_FILE}'. Using 'free'.")
-    return api_key
-
-api_key_to_set = load_simfin_api_key()
-sf.set_api_key(api_key_to_set)
-
-simfin_data_directory = os.path.join(os.path.expanduser('~'), 'simfin_data')
-os.makedirs(simfin_data_directory, exist_ok=True)
-sf.set_data_dir(simfin_data_directory)
-
-script_dir = os.path.dirname(os.path.abspath(__file__))
-PROCESSED_DATA_BASE_DIR = os.path.join(script_dir, 'Data')
-os.makedirs(PROCESSED_DATA_BASE_DIR, exist_ok=True)
-
-app = Flask(__name__)
-
-# --- טעינת SECRET_KEY מקובץ secrets.py ---
-try:
-    from secrets import FLASK_SECRET_KEY
-    app.config['SECRET_KEY'] = FLASK_SECRET_KEY
-except ImportError:
-    # הדפס אזהרה רק בתהליך הראשי של שרת הפיתוח של Flask
-    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
-        print("-" * 80)
-        print("אזהרה: קובץ secrets.py עם FLASK_SECRET_KEY לא נמצא.")
-        print("משתמש במפתח ברירת מחדל המיועד לפיתוח בלבד (לא מאובטח).")
-        print("בסביבת ייצור, חובה ליצור קובץ secrets.py עם מפתח אקראי וחזק,")
-        print(f"ולהוסיף את secrets.py לקובץ .gitignore. הקובץ צריך להכיל: FLASK_SECRET_KEY = 'your_strong_random_key'")
-        print("ניתן לייצר מפתח לדוגמה עם: python -c \"import os; print(os.urandom(24).hex())\"")
-        print("-" * 80)
-    app.config['SECRET_KEY'] = 'a_very_default_and_insecure_secret_key_CHANGE_THIS_IF_NO_SECRETS_FILE'
-except AttributeError: # אם הקובץ קיים אבל המשתנה לא מוגדר בו
-    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
-        print("-" * 80)
-        print("אזהרה: המשתנה FLASK_SECRET_KEY אינו מוגדר בקובץ secrets.py.")
-        print("משתמש במפתח ברירת מחדל המיועד לפיתוח בלבד (לא מאובטח).")
-        print("-" * 80)
-    app.config['SECRET_KEY'] = 'another_default_and_insecure_secret_key_CHANGE_THIS'
+chart_payload_cache, make_etag = lazy_from('chart_cache', 'chart_payload_cache', 'make_etag')
+derived_metrics_store, resolve_column = lazy_from('derived_metrics', 'derived_metrics_store', 'resolve_column')
+download_price_history_with_mavg = lazy_from('downloader', 'download_price_history_with_mavg')
+ingest_jobs = lazy_module('ingest_jobs')
+ingest_job_queue = lazy_from('ingest_jobs', 'ingest_job_queue')
+downsample_prices, price_payload_to_json = lazy_from('downsample', 'downsample_prices', 'price_payload_to_json')
+compact_frame = lazy_from('frame_compaction', 'compact_frame')
+get_period_days, price_store = lazy_from('price_store', 'get_period_days', 'price_store')
+parse_condition, screen_records, screener_engine = lazy_from('screener', 'parse_condition', 'screen_records', 'screener_engine')
+get_statement_file_path, get_statement_file_version, get_ticker_store_path, load_ticker_statements, read_statement_csv = lazy_from(
+    'statement_files', 'get_statement_file_path', 'get_statement_file_version', 'get_ticker_store_path',
+    'load_ticker_statements', 'read_statement_csv')
+sort_valuations, valuation_engine, valuation_records = lazy_from(
+    'valuation', 'sort_valuations', 'valuation_engine', 'valuation_records')
+valuation_history = lazy_module('valuation_history')
+valuation_history_payload, valuation_history_store = lazy_from(
+    'valuation_history', 'valuation_history_payload', 'valuation_history_store')
+
+# רשימת הנתיבים; create_app רושם אותם על כל אפליקציה שהוא בונה
+VIEW_ROUTES = []
+
+def route(rule, **options):
+    """Like @app.route, for the app(s) built by create_app()."""
+    def decorator(view_func):
+        VIEW_ROUTES.append((rule, view_func, options))
+        return view_func
+    return decorator
+
+# מספר הנקודות בגרף הנרות שמוטמע בדף הבית (הגרף מתעדן בזום דרך /api/prices)
+HOME_CHART_TARGET_POINTS = 600
 
 
 # ... (שאר הקוד שלך, כולל פונקציות עזר, פונקציות גרפים, ונתיבים - ללא שינוי מהגרסה הקודמת שהצגתי, אלא אם יש תיקונים ספציפיים שנעשה בהמשך) ...
@@ -69,15 +63,6 @@ except AttributeError: # אם הקובץ קיים אבל המשתנה לא מו
 
 
 # --- פונקציות עזר ---
-def get_statement_file_path(ticker, statement_type_key, variant):
-    human_readable_names = {
-        'income': 'Income_Statement', 'balance': 'Balance_Sheet', 'cashflow': 'Cash_Flow_Statement'
-    }
-    file_statement_name = human_readable_names.get(statement_type_key, f"Unknown_{statement_type_key}")
-    file_name = f"{ticker}_{file_statement_name}_{variant}.csv"
-    ticker_save_dir = os.path.join(PROCESSED_DATA_BASE_DIR, ticker)
-    return os.path.join(ticker_save_dir, file_name)
-
 def get_api_key_status_for_display():
     # זו אותה פונקציה מהקוד הקודם
     if os.path.exists(API_KEY_FILE) and os.path.getsize(API_KEY_FILE) > 0:
@@ -86,8 +71,41 @@ def get_api_key_status_for_display():
         return "מפתח API מותאם אישית נטען מהקובץ." if key_in_file.lower() != 'free' else "משתמש במפתח 'free' מהקובץ."
     return "קובץ מפתח לא קיים או ריק, משתמש ב-'free' כברירת מחדל."
 
+# --- ETag / 304 לדפים שהתוכן שלהם נגזר מגרסת הנתונים ---
+def make_page_etag(page_name, current_ticker, *data_versions):
+    """ETag for a page built from the given data versions; None if it must not be cached."""
+    if any(version is None for version in data_versions) or '_flashes' in session:
+        return None
+    return make_etag(page_name, current_ticker, data_versions, get_api_key_status_for_display(),
+                     session.get('data_download_status'), session.get('ingest_job_id'))
+
+def not_modified_response(page_etag, last_modified=None):
+    """Returns a 304 response if the client already has this version of the page, else None."""
+    if page_etag is None:
+        return None
+    if request.if_none_match:
+        is_match = request.if_none_match.contains(page_etag)
+    else:
+        is_match = (last_modified is not None and request.if_modified_since is not None
+                    and last_modified.replace(microsecond=0) <= request.if_modified_since)
+    if not is_match:
+        return None
+    response = make_response('', 304)
+    response.set_etag(page_etag)
+    return response
+
+def with_validators(html, page_etag, last_modified=None):
+    response = make_response(html)
+    if page_etag is not None:
+        response.set_etag(page_etag)
+        if last_modified is not None:
+            response.last_modified = last_modified
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
 # --- פונקציות ליצירת גרפים ---
 # create_timeseries_chart - ללא שינוי מהגרסה הקודמת שהצגתי
+@timed_stage(STAGE_FIGURE)
 def create_timeseries_chart(df, y_column, title, x_column_name_in_df=None, y_axis_title=None, chart_type='bar'):
     if df is None or df.empty:
         return {"error": f"No data available to create chart: {title} (DataFrame is None or empty)."}
@@ -167,8 +185,9 @@ def create_timeseries_chart(df, y_column, title, x_column_name_in_df=None, y_axi
         print(f"Chart '{title}': Error creating Plotly figure object: {e}")
         return {"error": f"Error generating chart '{title}'. Details: {e}"}
 
-# create_candlestick_chart_with_mavg - ללא שינוי מהגרסה הקודמת שהצגתי
-def create_candlestick_chart_with_mavg(df_prices, ticker_symbol, moving_averages_to_plot=None):
+# create_candlestick_chart_with_mavg - moving_average_series (אופציונלי) מאפשר קווי ממוצע מדוללים (LTTB) עם צירי x משלהם
+@timed_stage(STAGE_FIGURE)
+def create_candlestick_chart_with_mavg(df_prices, ticker_symbol, moving_averages_to_plot=None, moving_average_series=None):
     if df_prices is None or df_prices.empty:
         return {"error": "No price data available for candlestick chart."}
     try:
@@ -177,7 +196,10 @@ def create_candlestick_chart_with_mavg(df_prices, ticker_symbol, moving_averages
                                      low=df_prices['Low'], close=df_prices['Close'], name=f'{ticker_symbol}'))
         if moving_averages_to_plot:
             for ma_col in moving_averages_to_plot:
-                if ma_col in df_prices.columns: 
+                if moving_average_series is not None and ma_col in moving_average_series:
+                    ma_series = moving_average_series[ma_col]
+                    fig.add_trace(go.Scatter(x=ma_series.index, y=ma_series, mode='lines', name=ma_col, line=dict(width=1.5)))
+                elif ma_col in df_prices.columns: 
                     fig.add_trace(go.Scatter(x=df_prices.index, y=df_prices[ma_col], mode='lines', name=ma_col, line=dict(width=1.5)))
         fig.update_layout(title=f'גרף נרות יומי וממוצעים נעים - {ticker_symbol}', xaxis_title='תאריך', yaxis_title='מחיר',
                           xaxis_rangeslider_visible=False, height=600, legend_title_text='מקרא')
@@ -186,243 +208,672 @@ def create_candlestick_chart_with_mavg(df_prices, ticker_symbol, moving_averages
         print(f"Error creating candlestick chart for {ticker_symbol}: {e}")
         return {"error": f"Error generating candlestick chart: {e}"}
 
+# create_valuation_history_chart - קו לכל מכפיל (P/E, P/S, P/B), מדולל ב-LTTB; תקופות בלי מכפיל (הפסד) נשארות רווח בקו
+@timed_stage(STAGE_FIGURE)
+def create_valuation_history_chart(df_history, ticker_symbol, target_points=HOME_CHART_TARGET_POINTS):
+    if df_history is None or df_history.empty:
+        return {"error": "No valuation history available."}
+    try:
+        fig = go.Figure()
+        for ratio_col in valuation_history.VALUATION_RATIO_COLUMNS:
+            ratio_series = df_history[ratio_col]
+            if ratio_series.notna().any():
+                gap_starts = ratio_series.index[ratio_series.isna() & ratio_series.shift(1).notna()]
+                reduced = pd.concat([downsample.lttb_series(ratio_series, target_points),
+                                     pd.Series(float('nan'), index=gap_starts)]).sort_index()
+                fig.add_trace(go.Scatter(x=reduced.index, y=reduced, mode='lines', name=ratio_col,
+                                         line=dict(width=1.5), connectgaps=False))
+        if not fig.data:
+            return {"error": "No valuation ratios could be computed (missing earnings, revenue or equity data)."}
+        fig.update_layout(title=f'מכפילים יומיים (לפי דוחות שפורסמו) - {ticker_symbol}', xaxis_title='תאריך',
+                          yaxis_title='מכפיל', height=450, legend_title_text='מקרא', margin=dict(l=40, r=20, t=60, b=40))
+        return {"data": fig.data, "layout": fig.layout}
+    except Exception as e:
+        print(f"Error creating valuation history chart for {ticker_symbol}: {e}")
+        return {"error": f"Error generating valuation history chart: {e}"}
+
+# create_peer_comparison_chart - קו לכל טיקר על ציר תקופות קלנדריות משותף; בריחוף מוצג סוף התקופה הפיסקלית
+@timed_stage(STAGE_FIGURE)
+def create_peer_comparison_chart(values, report_dates, title, y_axis_title, percent=False):
+    if values is None or values.empty or not len(values.columns):
+        return {"error": "No data available for the requested tickers."}
+    try:
+        fig = go.Figure()
+        periods = [str(period) for period in values.index]
+        value_format = '.1%' if percent else ',.0f'
+        for ticker in values.columns:
+            fiscal_ends = pd.to_datetime(report_dates[ticker]).dt.strftime('%Y-%m-%d').fillna('')
+            fig.add_trace(go.Scatter(x=periods, y=values[ticker].to_numpy(), mode='lines+markers', name=ticker,
+                                     customdata=fiscal_ends.to_numpy(), connectgaps=False,
+                                     hovertemplate=f'{ticker}: %{{y:{value_format}}}<br>סוף תקופה: %{{customdata}}<extra></extra>'))
+        fig.update_layout(title=title, xaxis_title='תקופה קלנדרית', yaxis_title=y_axis_title,
+                          yaxis_tickformat='.0%' if percent else ',.0f', xaxis_type='category',
+                          height=550, legend_title_text='מקרא', margin=dict(l=40, r=20, t=60, b=40))
+        return {"data": fig.data, "layout": fig.layout}
+    except Exception as e:
+        print(f"Error creating peer comparison chart: {e}")
+        return {"error": f"Error generating peer comparison chart: {e}"}
+
 # --- Flask Routes ---
-# route_home - ללא שינוי מהגרסה הקודמת שהצגתי
-@app.route('/')
+# route_home - הגרף עצמו נטען מ-/charts/candlestick אחרי הציור הראשון, כך שהדף לא מחכה להורדת המחירים
+@route('/')
 def route_home():
     current_ticker = session.get('current_ticker', '')
     api_key_status = get_api_key_status_for_display()
-    chart_json = None
-    price_error = None
-
-    if current_ticker:
-        moving_averages_config = [20, 50, 100, 150, 200]
-        df_prices = download_price_history_with_mavg(current_ticker, period="10y", interval="1d", moving_averages=moving_averages_config)
-
-        if df_prices is not None and not df_prices.empty:
-            ma_cols_to_plot = [f'MA{ma}' for ma in moving_averages_config if f'MA{ma}' in df_prices.columns]
-            chart_data = create_candlestick_chart_with_mavg(df_prices, current_ticker, ma_cols_to_plot)
-            if chart_data and "error" not in chart_data:
-                chart_json = json.dumps(chart_data, cls=plotly.utils.PlotlyJSONEncoder)
-            elif chart_data and "error" in chart_data:
-                price_error = chart_data["error"]
-        else:
-            price_error = f"לא נמצאו נתוני מחירים עבור {current_ticker} או שגיאה בהורדה."
+    ingest_job = collect_finished_ingest_job()
+    if ingest_job is not None and ingest_job['finished_at'] is not None:
+        ingest_job = None # התוצאות כבר עברו ל-data_download_status
 
-    return render_template('base_layout.html', 
+    page_etag = make_page_etag('home', current_ticker)
+    not_modified = not_modified_response(page_etag)
+    if not_modified is not None:
+        return not_modified
+
+    html = render_template('base_layout.html', 
                            page_title='ניתוח מניות - דף הבית', 
                            current_ticker=current_ticker,
                            content_template='content_home.html',
-                           candlestick_chart_json=chart_json, 
-                           price_data_error=price_error,
+                           ingest_job=ingest_job,
                            api_key_status_display=api_key_status)
+    return with_validators(html, page_etag)
+
+# api_prices - נתוני מחיר וממוצעים לטווח תאריכים, מדוללים למספר נקודות חסום
+@route('/api/prices')
+def route_api_prices():
+    ticker = request.args.get('ticker', session.get('current_ticker', '')).upper().strip()
+    if not ticker:
+        return jsonify({"error": "No ticker given."}), 400
+    period = request.args.get('period', '10y')
+    try:
+        get_period_days(period)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        target_points = int(request.args.get('points', downsample.DEFAULT_TARGET_POINTS))
+    except ValueError:
+        return jsonify({"error": "points must be an integer."}), 400
+    moving_averages = [int(ma) for ma in request.args.get('ma', '20,50,100,150,200').split(',') if ma.strip().isdigit()]
 
-# route_set_ticker - ללא שינוי מהגרסה הקודמת שהצגתי
-@app.route('/set_ticker', methods=['POST'])
+    df_prices = download_price_history_with_mavg(ticker, period=period, interval="1d", moving_averages=moving_averages)
+    if df_prices is None or df_prices.empty:
+        return jsonify({"error": f"No price data for {ticker}."}), 404
+
+    try:
+        with stage(STAGE_TRANSFORM):
+            reduced = downsample_prices(df_prices, target_points, [f'MA{ma}' for ma in moving_averages],
+                                        start=request.args.get('start') or None, end=request.args.get('end') or None)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid date range: {e}"}), 400
+
+    with stage(STAGE_SERIALIZE):
+        response = jsonify({"ticker": ticker, "period": period, **price_payload_to_json(reduced)})
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.add_etag()
+    return response.make_conditional(request)
+
+# route_set_ticker - ההורדה והכתיבה רצות כעבודת רקע; הבקשה רק מכניסה אותה לתור (או מצטרפת לעבודה קיימת לאותו טיקר)
+@route('/set_ticker', methods=['POST'])
 def route_set_ticker():
     if request.method == 'POST':
         ticker = request.form.get('ticker_input', '').upper().strip() 
         if ticker: 
             session['current_ticker'] = ticker
-            download_results = download_financial_statements(ticker_symbol=ticker)
-            session_data_status = {} 
-            any_success = False
-
-            for stmt_key_for_session in ['income']: 
+            for stmt_key_for_session in ['income', 'balance', 'cashflow']: 
                  for variant_for_session in ['annual', 'quarterly']:
-                    session.pop(f'{stmt_key_for_session}_{variant_for_session}_df_json', None)
-
-            for variant in ['annual', 'quarterly']:
-                for stmt_key in ['income', 'balance', 'cashflow']:
-                    result_key = f"{stmt_key}_{variant}"
-                    data_item = download_results.get(result_key)
-
-                    if isinstance(data_item, pd.DataFrame) and not data_item.empty:
-                        human_readable_names = {'income': 'Income_Statement', 'balance': 'Balance_Sheet', 'cashflow': 'Cash_Flow_Statement'}
-                        file_name = f"{ticker}_{human_readable_names[stmt_key]}_{variant}.csv"
-                        ticker_save_dir = os.path.join(PROCESSED_DATA_BASE_DIR, ticker)
-                        os.makedirs(ticker_save_dir, exist_ok=True)
-                        save_path = os.path.join(ticker_save_dir, file_name)
-                        try:
-                            if isinstance(data_item.index, pd.DatetimeIndex) and data_item.index.name is None:
-                                 data_item.index.name = 'Report Date'
-                            data_item.to_csv(save_path, index=True)
-                            session_data_status[result_key] = f"Saved: {os.path.basename(save_path)}"
-                            any_success = True
-                            if stmt_key == 'income': 
-                                session[f'{result_key}_df_json'] = data_item.to_json(orient='split', date_format='iso')
-                        except Exception as e:
-                            session_data_status[result_key] = f"Error saving CSV for {result_key}: {e}"
-                            print(f"Error saving {result_key} for {ticker} to CSV: {e}")
-                    elif isinstance(data_item, dict) and "Error" in data_item:
-                        session_data_status[result_key] = f"Download Error for {result_key}: {data_item['Details']}"
-                    else: 
-                        session_data_status[result_key] = f"No data or empty data for {result_key}."
-
-            session['data_download_status'] = session_data_status
-            flash(f"Data for {ticker} processed." if any_success else f"Failed to process or no data found for {ticker}.", "success" if any_success else "danger")
+                    session.pop(f'{stmt_key_for_session}_{variant_for_session}_df_json', None) # פורמט ישן - JSON מלא בעוגייה
+                    session.pop(f'{stmt_key_for_session}_{variant_for_session}_df_key', None)
+            session.pop('data_download_status', None)
+
+            job = ingest_job_queue.submit(ticker)
+            session['ingest_job_id'] = job.job_id
+            # המתנה קצרה אופציונלית: עבודה שמסתיימת מהר מוצגת מיד, בלי סבב בדיקת סטטוס
+            wait_seconds = current_app.config.get('INGEST_WAIT_SECONDS') or 0
+            if wait_seconds > 0 and job.wait(wait_seconds):
+                collect_finished_ingest_job(flash_result=True)
+            else:
+                flash(f"הנתונים עבור {ticker} נטענים ברקע...", "info")
             return redirect(url_for('route_home')) 
         else:
             flash("לא הוזן טיקר או שהטיקר מכיל רק רווחים.", "warning")
     return redirect(url_for('route_home'))
 
-# get_dataframe_from_session_or_csv - ללא שינוי מהגרסה הקודמת שהצגתי
+def collect_finished_ingest_job(flash_result=False):
+    """
+    Returns the status of the session's ingest job. Once the job has finished,
+    its per-statement results move to session['data_download_status'] and the
+    job is dropped from the session. None if the session has no job.
+    """
+    job_id = session.get('ingest_job_id')
+    if not job_id:
+        return None
+    job = ingest_job_queue.get(job_id)
+    if job is None: # העבודה כבר לא מוכרת (למשל אחרי הפעלה מחדש)
+        session.pop('ingest_job_id', None)
+        return None
+    if job['finished_at'] is not None:
+        session.pop('ingest_job_id', None)
+        session['data_download_status'] = job['results'] or {'ingest': f"Error: {job['error']}"}
+        if flash_result:
+            ticker = job['ticker']
+            flash(f"Data for {ticker} processed." if job['any_success'] else f"Failed to process or no data found for {ticker}.",
+                  "success" if job['any_success'] else "danger")
+    return job
+
+# api_ingest_job - בדיקת סטטוס של עבודת טעינה (דף הבית בודק כך עד שהעבודה מסתיימת)
+@route('/api/ingest_jobs/<job_id>')
+def route_api_ingest_job(job_id):
+    if job_id == session.get('ingest_job_id'):
+        job = collect_finished_ingest_job()
+    else:
+        job = ingest_job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown ingest job {job_id}."}), 404
+    response = jsonify(job)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+# get_dataframe_from_session_or_csv - ה-session שומר רק מפתח; ה-DataFrame עצמו נשמר ב-frame_cache בצד השרת,
+# ובהחטאה נטען מקובץ הדוחות הבינארי של הטיקר (או מקובצי CSV ישנים)
+@timed_stage(STAGE_LOAD)
 def get_dataframe_from_session_or_csv(ticker, variant, statement_key):
-    session_key = f"{statement_key}_{variant}_df_json"
+    session_key = f"{statement_key}_{variant}_df_key"
+    cache_key = frame_cache_key(ticker, statement_key, variant)
     df = None
     error_message = None
     info_message = None
 
-    if session_key in session:
-        try:
-            df_json_str = session.get(session_key)
-            if df_json_str: 
-                df = pd.read_json(df_json_str, orient='split', convert_dates=['index'])
-                if not isinstance(df.index, pd.DatetimeIndex): 
-                    df.index = pd.to_datetime(df.index, errors='coerce')
-                df = df.sort_index() 
-                if not df.empty:
-                    info_message = f"Data for {statement_key} ({variant}) loaded from session."
-                else: 
-                    df = None 
-                    info_message = f"Data for {statement_key} ({variant}) from session is empty. Trying CSV."
-            else: 
-                 session.pop(session_key, None) 
-                 info_message = f"Invalid data in session for {statement_key} ({variant}). Trying CSV."
-        except Exception as e:
-            error_message = f"Error loading {statement_key} ({variant}) from session: {e}. Trying CSV."
-            session.pop(session_key, None) 
-            df = None 
+    session.pop(f"{statement_key}_{variant}_df_json", None) # פורמט ישן - JSON מלא בעוגייה
+    df = frame_cache.get(cache_key)
+    if df is not None and not df.empty:
+        info_message = f"Data for {statement_key} ({variant}) loaded from server cache."
+        if session.get(session_key) != list(cache_key):
+            session[session_key] = list(cache_key)
+    else:
+        df = None
+        if session.pop(session_key, None) is not None:
+            info_message = f"Data for {statement_key} ({variant}) is no longer in the server cache. Reading the ticker's files."
 
     if df is None:
-        file_path = get_statement_file_path(ticker, statement_key, variant)
-        if os.path.exists(file_path):
-            try:
-                df = pd.read_csv(file_path, index_col=0)
-                if not isinstance(df.index, pd.DatetimeIndex):
-                    df.index = pd.to_datetime(df.index, errors='coerce')
-                df = df[df.index.notna()] 
-                df = df.sort_index()
-
-                if not df.empty: 
-                    loaded_from_csv_msg = f"Data for {statement_key} ({variant}) loaded from CSV: {os.path.basename(file_path)}"
-                    info_message = f"{info_message} {loaded_from_csv_msg}".strip() if info_message else loaded_from_csv_msg
-                    if statement_key == 'income':
-                        session[session_key] = df.to_json(orient='split', date_format='iso')
-                else:
-                    empty_csv_msg = f"CSV file for {statement_key} ({variant}) is empty."
-                    info_message = f"{info_message} {empty_csv_msg}".strip() if info_message else empty_csv_msg
-                    df = None 
-            except Exception as e:
-                csv_error_msg = f"Error reading CSV {os.path.basename(file_path)} for {statement_key} ({variant}): {e}"
-                error_message = f"{error_message} {csv_error_msg}".strip() if error_message else csv_error_msg
+        # קובץ הדוחות של הטיקר: בינארי, ממוין, עם תאריכים ו-dtypes חסכוניים מוכנים - רק הדוח המבוקש מפוענח
+        ticker_frames = load_ticker_statements(ticker, frame_keys=[(statement_key, variant)])
+        if ticker_frames is not None:
+            store_file_name = os.path.basename(get_ticker_store_path(ticker))
+            df = ticker_frames.get((statement_key, variant))
+            if df is not None and not df.empty:
+                if frame_cache.put(cache_key, df):
+                    session[session_key] = list(cache_key)
+                loaded_msg = f"Data for {statement_key} ({variant}) loaded from {store_file_name}"
+                info_message = f"{info_message} {loaded_msg}".strip() if info_message else loaded_msg
+            else:
+                df = None
+                error_message = f"No {statement_key} ({variant}) data in {store_file_name} for {ticker}."
+        else:
+            df, error_message, info_message = read_legacy_statement_csv(ticker, variant, statement_key, info_message)
+    return df, error_message, info_message
+
+def read_legacy_statement_csv(ticker, variant, statement_key, info_message=None):
+    """Fallback for tickers saved as CSV files only (older versions, --csv exports without pyarrow)."""
+    cache_key = frame_cache_key(ticker, statement_key, variant)
+    file_path = get_statement_file_path(ticker, statement_key, variant)
+    df = None
+    error_message = None
+    if os.path.exists(file_path):
+        try:
+            df = compact_frame(read_statement_csv(ticker, statement_key, variant), sparse=False) # dtypes חסכוניים - כך נכנסים יותר טיקרים לתקציב של frame_cache
+
+            if not df.empty: 
+                loaded_from_csv_msg = f"Data for {statement_key} ({variant}) loaded from CSV: {os.path.basename(file_path)}"
+                info_message = f"{info_message} {loaded_from_csv_msg}".strip() if info_message else loaded_from_csv_msg
+                if frame_cache.put(cache_key, df):
+                    session[f"{statement_key}_{variant}_df_key"] = list(cache_key)
+            else:
+                empty_csv_msg = f"CSV file for {statement_key} ({variant}) is empty."
+                info_message = f"{info_message} {empty_csv_msg}".strip() if info_message else empty_csv_msg
                 df = None 
-        elif not error_message: 
-            file_not_found_msg = f"CSV file for {statement_key} ({variant}) not found for {ticker}."
-            error_message = file_not_found_msg
+        except Exception as e:
+            error_message = f"Error reading CSV {os.path.basename(file_path)} for {statement_key} ({variant}): {e}"
+            df = None 
+    else:
+        error_message = f"Statement files for {statement_key} ({variant}) not found for {ticker}."
     return df, error_message, info_message
 
-# route_graphs_annual - ללא שינוי מהגרסה הקודמת שהצגתי
-@app.route('/graphs/annual')
-def route_graphs_annual():
-    current_ticker = session.get('current_ticker')
-    api_key_status = get_api_key_status_for_display()
-    if not current_ticker: 
-        flash("אנא בחר טיקר תחילה.", "warning")
-        return redirect(url_for('route_home'))
+# --- נתיבי נתוני גרפים: כל גרף נטען בבקשה נפרדת, במקביל, אחרי שהדף כבר הוצג ---
+HOME_CHART_MOVING_AVERAGES = [20, 50, 100, 150, 200]
 
-    df_income, error_data, info_data = get_dataframe_from_session_or_csv(current_ticker, 'annual', 'income')
-    graph_revenue_json, graph_net_income_json = None, None
+# chart_name -> (variant, עמודה בטבלת המדדים הנגזרים, שם לתצוגה, כותרת הגרף)
+# בקובץ ה-CSV של הטיקר העמודה נבחרת לפי derived_metrics.BASE_METRIC_SOURCES של אותו מדד
+STATEMENT_CHARTS = {
+    'annual_revenue': ('annual', 'revenue', 'Revenue', 'הכנסות - שנתי'),
+    'annual_net_income': ('annual', 'net_income', 'Net income', 'רווח נקי - שנתי'),
+    'quarterly_revenue': ('quarterly', 'revenue', 'Revenue', 'הכנסות - רבעוני'),
+    'quarterly_net_income': ('quarterly', 'net_income', 'Net income', 'רווח נקי - רבעוני'),
+}
 
-    if df_income is not None and not df_income.empty:
-        revenue_col = next((col for col in ['Revenue', 'Total Revenue', 'Sales'] if col in df_income.columns), None)
-        net_income_col_options = ['Net Income (Common)', 'Net Income', 'Net Income Available to Common Shareholders']
-        net_income_col = next((col for col in net_income_col_options if col in df_income.columns), None)
+def make_chart_etag(chart_name, ticker, data_version):
+    return make_etag('chart', chart_name, ticker, data_version) if data_version is not None else None
 
-        if revenue_col:
-            chart_rev = create_timeseries_chart(df_income, revenue_col, f'הכנסות ({revenue_col}) - שנתי', y_axis_title='סכום')
-            if chart_rev and "error" not in chart_rev: 
-                graph_revenue_json = json.dumps(chart_rev, cls=plotly.utils.PlotlyJSONEncoder)
-            elif chart_rev and "error" in chart_rev : 
-                error_data = (error_data + "; " if error_data else "") + f"Revenue chart error: {chart_rev['error']}"
-        else:
-            error_data = (error_data + "; " if error_data else "") + "Revenue column not found in annual income data."
-
-        if net_income_col:
-            chart_ni = create_timeseries_chart(df_income, net_income_col, f'רווח נקי ({net_income_col}) - שנתי', y_axis_title='סכום')
-            if chart_ni and "error" not in chart_ni: 
-                graph_net_income_json = json.dumps(chart_ni, cls=plotly.utils.PlotlyJSONEncoder)
-            elif chart_ni and "error" in chart_ni:
-                error_data = (error_data + "; " if error_data else "") + f"Net income chart error: {chart_ni['error']}"
-        else:
-            error_data = (error_data + "; " if error_data else "") + "Net income column not found in annual income data."
+def chart_response(chart_payload, chart_etag, chart_error=None):
+    if chart_payload is None:
+        return jsonify({"error": chart_error or "Chart not available."}), 404
+    response = make_response(chart_payload.json)
+    response.mimetype = 'application/json'
+    return with_validators(response, chart_etag, chart_payload.last_modified)
+
+def candlestick_chart_response(ticker):
+    price_version, last_modified = price_store.get_version(ticker, interval="1d")
+    not_modified = not_modified_response(make_chart_etag('candlestick', ticker, price_version), last_modified)
+    if not_modified is not None:
+        return not_modified
 
-    elif df_income is None: 
-        no_data_msg = "No annual income data available to generate graphs."
-        error_data = (error_data + "; " if error_data else "") + no_data_msg
+    df_prices = download_price_history_with_mavg(ticker, period="10y", interval="1d", moving_averages=HOME_CHART_MOVING_AVERAGES)
+    if df_prices is None or df_prices.empty:
+        return jsonify({"error": f"לא נמצאו נתוני מחירים עבור {ticker} או שגיאה בהורדה."}), 404
 
-    return render_template('base_layout.html', page_title=f'גרפים שנתיים - {current_ticker}', current_ticker=current_ticker,
-                           content_template='content_graphs.html', graph_type='Annual',
-                           graph_revenue_json=graph_revenue_json, graph_net_income_json=graph_net_income_json,
-                           data_error_message=error_data, data_info_message=info_data, api_key_status_display=api_key_status)
+    price_version, last_modified = price_store.get_version(ticker, interval="1d")
+    ma_cols_to_plot = [f'MA{ma}' for ma in HOME_CHART_MOVING_AVERAGES if f'MA{ma}' in df_prices.columns]
 
-# route_graphs_quarterly - ללא שינוי מהגרסה הקודמת שהצגתי
-@app.route('/graphs/quarterly')
-def route_graphs_quarterly():
+    def build_candlestick_chart():
+        # תצוגה ראשונית גסה עם מספר נקודות חסום; זום מבקש פירוט מ-/api/prices
+        with stage(STAGE_TRANSFORM):
+            reduced = downsample_prices(df_prices, HOME_CHART_TARGET_POINTS, ma_cols_to_plot)
+        return create_candlestick_chart_with_mavg(reduced['candles'], ticker, ma_cols_to_plot,
+                                                  moving_average_series=reduced['moving_averages'])
+
+    chart_payload, chart_error = chart_payload_cache.get_or_build(
+        ticker, f'candlestick_10y_1d:{HOME_CHART_TARGET_POINTS}', price_version,
+        build_candlestick_chart, last_modified)
+    return chart_response(chart_payload, make_chart_etag('candlestick', ticker, price_version), chart_error)
+
+def valuation_history_chart_response(ticker):
+    # הגרסה: גרסת המחירים השמורים + גרסת הדוחות; הסדרה עצמה מתעדכנת בהדרגה ב-valuation_history_store
+    price_version, last_modified = price_store.get_version(ticker, interval="1d")
+    fundamentals_version = valuation_history_store.fundamentals_version()
+    data_version = make_etag(price_version, *fundamentals_version) if price_version and None not in fundamentals_version else None
+    not_modified = not_modified_response(make_chart_etag('valuation_history', ticker, data_version), last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    try:
+        with stage(STAGE_LOAD):
+            df_history = valuation_history_store.get_history(ticker)
+    except Exception as e:
+        print(f"Error computing valuation history for {ticker}: {e}")
+        return jsonify({"error": f"Could not compute the valuation history: {e}"}), 500
+    if df_history is None:
+        return jsonify({"error": f"אין דוחות רבעוניים עבור {ticker} בנתוני SimFin של השוק."}), 404
+    if df_history.empty:
+        return jsonify({"error": f"לא נמצאו נתוני מחירים עבור {ticker} או שגיאה בהורדה."}), 404
+
+    price_version, last_modified = price_store.get_version(ticker, interval="1d")
+    data_version = make_etag(price_version, *fundamentals_version) if price_version and None not in fundamentals_version else None
+    chart_payload, chart_error = chart_payload_cache.get_or_build(
+        ticker, 'valuation_history_10y_1d', data_version,
+        lambda: create_valuation_history_chart(df_history, ticker), last_modified)
+    return chart_response(chart_payload, make_chart_etag('valuation_history', ticker, data_version), chart_error)
+
+def statement_chart_response(ticker, chart_name):
+    # הסדרות מגיעות מוכנות מטבלת המדדים הנגזרים של כל השוק; קובץ ה-CSV של הטיקר הוא גיבוי בלבד
+    variant, metric, chart_label, title = STATEMENT_CHARTS[chart_name]
+    metrics_version = derived_metrics_store.version(variant)
+    data_version = make_etag(*metrics_version) if None not in metrics_version else None
+    chart_etag = make_chart_etag(chart_name, ticker, data_version)
+    not_modified = not_modified_response(chart_etag)
+    if not_modified is not None:
+        return not_modified
+
+    # הטעינה רצה רק כשאין גרף שמור לגרסה הזו
+    use_csv_fallback = []
+    def build_statement_chart():
+        with stage(STAGE_LOAD):
+            df_metrics = derived_metrics_store.get_ticker_metrics(ticker, variant)
+        if df_metrics is None or df_metrics.empty or df_metrics[metric].isna().all():
+            use_csv_fallback.append(True)
+            return None # לא נשמר במטמון
+        chart = create_timeseries_chart(df_metrics, metric, title, y_axis_title='סכום')
+        return {"error": f"{chart_label} chart error: {chart['error']}"} if "error" in chart else chart
+
+    chart_payload, chart_error = chart_payload_cache.get_or_build(
+        ticker, f'{chart_name}:derived', data_version, build_statement_chart)
+    if use_csv_fallback:
+        return statement_csv_chart_response(ticker, chart_name)
+    return chart_response(chart_payload, chart_etag, chart_error)
+
+def statement_csv_chart_response(ticker, chart_name):
+    variant, metric, chart_label, title = STATEMENT_CHARTS[chart_name]
+    income_version, last_modified = get_statement_file_version(ticker, 'income', variant)
+    chart_etag = make_chart_etag(chart_name, ticker, income_version)
+    not_modified = not_modified_response(chart_etag, last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    # העמודה נקבעת מתוכן הקובץ, ולכן גרסת הקובץ מספיקה כמפתח; הקריאה רצה רק בהחטאה
+    def build_statement_csv_chart():
+        with stage(STAGE_LOAD):
+            df_income, error_data, _ = get_dataframe_from_session_or_csv(ticker, variant, 'income')
+        if df_income is None or df_income.empty:
+            no_data_msg = f"No {variant} income data available to generate graphs."
+            return {"error": (error_data + "; " if error_data else "") + no_data_msg}
+        column = resolve_column(df_income, derived_metrics.BASE_METRIC_SOURCES[metric][1])
+        if column is None:
+            return {"error": f"{chart_label} column not found in {variant} income data."}
+        chart = create_timeseries_chart(df_income, column, f'{title} ({column})', y_axis_title='סכום')
+        return {"error": f"{chart_label} chart error: {chart['error']}"} if "error" in chart else chart
+
+    chart_payload, chart_error = chart_payload_cache.get_or_build(
+        ticker, f'{chart_name}:csv', income_version, build_statement_csv_chart, last_modified)
+    return chart_response(chart_payload, chart_etag, chart_error)
+
+def read_peer_query_args():
+    """(tickers, metric, variant) from the query string; raises ValueError on bad input."""
+    tickers = peer_comparison.parse_peer_tickers(request.args.get('tickers', ''))
+    metric = request.args.get('metric', 'revenue')
+    variant = request.args.get('variant', 'quarterly')
+    peer_comparison.validate_peer_metric(metric, variant)
+    return tickers, metric, variant
+
+def peer_chart_response():
+    # כל הטיקרים בשליפה אחת מטבלת המדדים הנגזרים, ובניית גרף אחת; בפגיעה במטמון אין שליפה בכלל
+    try:
+        tickers, metric, variant = read_peer_query_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    metrics_version = derived_metrics_store.version(variant)
+    data_version = make_etag(*metrics_version) if None not in metrics_version else None
+    chart_etag = make_chart_etag(f'peers_{variant}_{metric}', ','.join(tickers), data_version)
+    not_modified = not_modified_response(chart_etag)
+    if not_modified is not None:
+        return not_modified
+
+    def build_peer_chart():
+        with stage(STAGE_LOAD):
+            values, report_dates, missing = peer_comparison.build_peer_comparison(tickers, metric, variant)
+        if values is None:
+            return {"error": "Market statement data is not available."}
+        metric_label, percent = peer_comparison.PEER_METRICS[metric]
+        variant_label = 'רבעוני' if variant == 'quarterly' else 'שנתי'
+        title = f'השוואת {metric_label} - {variant_label}' + (f" (אין נתונים: {', '.join(missing)})" if missing else '')
+        return create_peer_comparison_chart(values, report_dates, title, metric_label, percent)
+
+    try:
+        chart_payload, chart_error = chart_payload_cache.get_or_build(
+            ','.join(tickers), f'peers:{variant}:{metric}', data_version, build_peer_chart)
+    except Exception as e:
+        print(f"Error loading peer comparison data: {e}")
+        return jsonify({"error": f"Could not load the peer comparison data: {e}"}), 500
+    return chart_response(chart_payload, chart_etag, chart_error)
+
+# route_chart - JSON של גרף יחיד עבור הטיקר הנוכחי (מערכים מספריים כ-typed arrays ב-base64); peers - לפי tickers בבקשה
+@route('/charts/<chart_name>')
+def route_chart(chart_name):
+    if chart_name == 'peers':
+        return peer_chart_response()
+    current_ticker = session.get('current_ticker')
+    if not current_ticker:
+        return jsonify({"error": "No ticker selected."}), 400
+    if chart_name == 'candlestick':
+        return candlestick_chart_response(current_ticker)
+    if chart_name == 'valuation_history':
+        return valuation_history_chart_response(current_ticker)
+    if chart_name in STATEMENT_CHARTS:
+        return statement_chart_response(current_ticker, chart_name)
+    return jsonify({"error": f"Unknown chart '{chart_name}'."}), 404
+
+def get_graphs_data_messages(ticker, variant):
+    """
+    (error, info) messages about the data behind a graphs page, from file and
+    dataset versions only - the data itself is loaded by the chart endpoints.
+    """
+    if None not in derived_metrics_store.version(variant):
+        return None, None
+    income_version, _ = get_statement_file_version(ticker, 'income', variant)
+    if income_version is None:
+        return f"No {variant} income data available to generate graphs.", None
+    return None, f"Market {variant} statements are not available; the graphs use the files saved for {ticker}."
+
+def render_graphs_page(page_name, graph_type, page_title, chart_prefix):
     current_ticker = session.get('current_ticker')
-    api_key_status = get_api_key_status_for_display()
     if not current_ticker: 
         flash("אנא בחר טיקר תחילה.", "warning")
         return redirect(url_for('route_home'))
 
-    df_income_q, error_data_q, info_data_q = get_dataframe_from_session_or_csv(current_ticker, 'quarterly', 'income')
-    graph_revenue_json_q, graph_net_income_json_q = None, None
+    # שגיאות של גרף מסוים (עמודה חסרה וכו') מגיעות מנקודת הקצה שלו ומתווספות להודעות בדפדפן
+    data_error_message, data_info_message = get_graphs_data_messages(current_ticker, chart_prefix)
+    page_etag = make_page_etag(page_name, current_ticker, (data_error_message, data_info_message))
+    not_modified = not_modified_response(page_etag)
+    if not_modified is not None:
+        return not_modified
 
-    if df_income_q is not None and not df_income_q.empty:
-        revenue_col = next((col for col in ['Revenue', 'Total Revenue', 'Sales'] if col in df_income_q.columns), None)
-        net_income_col_options = ['Net Income (Common)', 'Net Income', 'Net Income Available to Common Shareholders']
-        net_income_col = next((col for col in net_income_col_options if col in df_income_q.columns), None)
+    html = render_template('base_layout.html', page_title=f'{page_title} - {current_ticker}', current_ticker=current_ticker,
+                           content_template='content_graphs.html', graph_type=graph_type,
+                           data_error_message=data_error_message, data_info_message=data_info_message,
+                           revenue_chart_url=url_for('route_chart', chart_name=f'{chart_prefix}_revenue'),
+                           net_income_chart_url=url_for('route_chart', chart_name=f'{chart_prefix}_net_income'),
+                           api_key_status_display=get_api_key_status_for_display())
+    return with_validators(html, page_etag)
 
-        if revenue_col:
-            chart_rev_q = create_timeseries_chart(df_income_q, revenue_col, f'הכנסות ({revenue_col}) - רבעוני', y_axis_title='סכום')
-            if chart_rev_q and "error" not in chart_rev_q: 
-                graph_revenue_json_q = json.dumps(chart_rev_q, cls=plotly.utils.PlotlyJSONEncoder)
-            elif chart_rev_q and "error" in chart_rev_q :
-                 error_data_q = (error_data_q + "; " if error_data_q else "") + f"Quarterly revenue chart error: {chart_rev_q['error']}"
-        else:
-            error_data_q = (error_data_q + "; " if error_data_q else "") + "Revenue column not found in quarterly income data."
-
-        if net_income_col:
-            chart_ni_q = create_timeseries_chart(df_income_q, net_income_col, f'רווח נקי ({net_income_col}) - רבעוני', y_axis_title='סכום')
-            if chart_ni_q and "error" not in chart_ni_q: 
-                graph_net_income_json_q = json.dumps(chart_ni_q, cls=plotly.utils.PlotlyJSONEncoder)
-            elif chart_ni_q and "error" in chart_ni_q:
-                error_data_q = (error_data_q + "; " if error_data_q else "") + f"Quarterly net income chart error: {chart_ni_q['error']}"
-        else:
-             error_data_q = (error_data_q + "; " if error_data_q else "") + "Net income column not found in quarterly income data."
+# route_graphs_annual - הדף נשלח מיד; הגרפים נטענים מ-/charts/annual_*
+@route('/graphs/annual')
+def route_graphs_annual():
+    return render_graphs_page('graphs_annual', 'Annual', 'גרפים שנתיים', 'annual')
 
-    elif df_income_q is None:
-        no_data_msg_q = "No quarterly income data available to generate graphs."
-        error_data_q = (error_data_q + "; " if error_data_q else "") + no_data_msg_q
+# route_graphs_quarterly - הדף נשלח מיד; הגרפים נטענים מ-/charts/quarterly_*
+@route('/graphs/quarterly')
+def route_graphs_quarterly():
+    return render_graphs_page('graphs_quarterly', 'Quarterly', 'גרפים רבעוניים', 'quarterly')
 
-    return render_template('base_layout.html', page_title=f'גרפים רבעוניים - {current_ticker}', current_ticker=current_ticker,
-                           content_template='content_graphs.html', graph_type='Quarterly',
-                           graph_revenue_json=graph_revenue_json_q, graph_net_income_json=graph_net_income_json_q,
-                           data_error_message=error_data_q, data_info_message=info_data_q, api_key_status_display=api_key_status)
+# route_peers - השוואת מדד אחד בין עד 20 טיקרים; הגרף נטען מ-/charts/peers
+@route('/peers')
+def route_peers():
+    current_ticker = session.get('current_ticker', '')
+    tickers_text = request.args.get('tickers', current_ticker)
+    metric = request.args.get('metric', 'revenue')
+    variant = request.args.get('variant', 'quarterly')
+    peer_error, chart_url = None, None
+    if tickers_text.strip():
+        try:
+            tickers = peer_comparison.parse_peer_tickers(tickers_text)
+            peer_comparison.validate_peer_metric(metric, variant)
+            tickers_text = ', '.join(tickers)
+            chart_url = url_for('route_chart', chart_name='peers', tickers=','.join(tickers), metric=metric, variant=variant)
+        except ValueError as e:
+            peer_error = str(e)
+
+    return render_template('base_layout.html',
+                           page_title='השוואת חברות',
+                           current_ticker=current_ticker,
+                           content_template='content_peers.html',
+                           tickers_text=tickers_text, peer_metric=metric, peer_variant=variant,
+                           peer_metrics=peer_comparison.PEER_METRICS, max_peer_tickers=peer_comparison.MAX_PEER_TICKERS,
+                           peer_chart_url=chart_url, peer_error=peer_error,
+                           api_key_status_display=get_api_key_status_for_display())
+
+# --- הערכות שווי לכל השוק (valuation_engine מחשב פעם אחת לכל גרסת dataset) ---
+VALUATION_TABLE_DEFAULT_LIMIT = 50
+VALUATION_TABLE_MAX_LIMIT = 500
+VALUATION_TABLE_COLUMNS = ['Price', 'Market Cap', 'P/E', 'P/S', 'EV/EBITDA', 'FCF TTM', 'DCF Value per Share', 'DCF Upside']
 
-# route_valuations - ללא שינוי מהגרסה הקודמת שהצגתי
-@app.route('/valuations')
+def get_valuation_sortable_columns():
+    return [col for col in valuation.VALUATION_COLUMNS if col not in ('Currency', 'Report Date', 'Price Date')]
+
+def format_valuation_value(column, value):
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return '—'
+    if column in ('Report Date', 'Price Date'):
+        return pd.Timestamp(value).strftime('%Y-%m-%d')
+    if column == 'Currency':
+        return str(value)
+    if column == 'DCF Upside':
+        return f"{value:+.0%}"
+    if column in ('Price', 'DCF Value per Share'):
+        return f"{value:,.2f}"
+    if column in ('P/E', 'P/S', 'EV/EBITDA'):
+        return f"{value:,.1f}"
+    return f"{value / 1e6:,.1f}M"
+
+def read_valuation_query_args():
+    """(sort column, ascending, limit) from the query string; raises ValueError on bad input."""
+    sort_column = request.args.get('sort', 'Market Cap')
+    if sort_column not in get_valuation_sortable_columns():
+        raise ValueError(f"Unsupported sort column '{sort_column}'.")
+    ascending = request.args.get('order', 'desc') == 'asc'
+    limit = int(request.args.get('limit', VALUATION_TABLE_DEFAULT_LIMIT))
+    return sort_column, ascending, max(1, min(limit, VALUATION_TABLE_MAX_LIMIT))
+
+# route_valuations - P/E, P/S, EV/EBITDA ו-DCF לכל הטיקרים בשוק, עם פירוט לטיקר הנוכחי
+@route('/valuations')
 def route_valuations():
     current_ticker = session.get('current_ticker', None)
     api_key_status = get_api_key_status_for_display()
+    valuation_error, ticker_rows, market_rows, market_size = None, None, [], 0
+    sort_column, ascending, limit = 'Market Cap', False, VALUATION_TABLE_DEFAULT_LIMIT
+
+    try:
+        sort_column, ascending, limit = read_valuation_query_args()
+        with stage(STAGE_TRANSFORM):
+            valuations, _ = valuation_engine.get_valuations()
+        market_size = len(valuations)
+        if current_ticker:
+            ticker_valuation = valuation_engine.get_ticker_valuation(current_ticker)
+            if ticker_valuation is not None:
+                ticker_rows = [(col, format_valuation_value(col, ticker_valuation[col])) for col in valuation.VALUATION_COLUMNS]
+        for ticker, row in sort_valuations(valuations, sort_column, ascending, limit).iterrows():
+            market_rows.append((ticker, [format_valuation_value(col, row[col]) for col in VALUATION_TABLE_COLUMNS]))
+    except ValueError as e:
+        valuation_error = str(e)
+    except Exception as e:
+        print(f"Error computing market valuations: {e}")
+        valuation_error = f"שגיאה בחישוב הערכות השווי: {e}"
+
     return render_template('base_layout.html', 
                            page_title='הערכות שווי',
                            current_ticker=current_ticker,
                            content_template='content_valuations.html',
+                           valuation_error=valuation_error, ticker_valuation_rows=ticker_rows,
+                           market_valuation_rows=market_rows, market_size=market_size,
+                           table_columns=VALUATION_TABLE_COLUMNS, sortable_columns=get_valuation_sortable_columns(),
+                           sort_column=sort_column, sort_ascending=ascending, table_limit=limit,
+                           compute_seconds=valuation_engine.last_compute_seconds,
+                           valuation_history_chart_url=url_for('route_chart', chart_name='valuation_history'),
                            api_key_status_display=api_key_status)
 
+# api_valuations - JSON: ticker=... לטיקר יחיד, אחרת טבלת השוק ממוינת (sort, order, limit)
+@route('/api/valuations')
+def route_api_valuations():
+    try:
+        with stage(STAGE_TRANSFORM):
+            valuations, _ = valuation_engine.get_valuations()
+        ticker = request.args.get('ticker', '').upper().strip()
+        if ticker:
+            if ticker not in valuations.index:
+                return jsonify({"error": f"No valuation data for {ticker}."}), 404
+            return jsonify(valuation_records(valuations.loc[[ticker]])[0])
+        sort_column, ascending, limit = read_valuation_query_args()
+        return jsonify({"market_size": len(valuations), "sort": sort_column,
+                        "valuations": valuation_records(sort_valuations(valuations, sort_column, ascending, limit))})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Error computing market valuations: {e}")
+        return jsonify({"error": f"Could not compute valuations: {e}"}), 500
+
+# api_valuation_history - JSON: מכפילים יומיים של טיקר (ticker, period), כל יום לפי הדוחות שכבר פורסמו עד אליו
+@route('/api/valuation_history')
+def route_api_valuation_history():
+    ticker = request.args.get('ticker', session.get('current_ticker', '')).upper().strip()
+    if not ticker:
+        return jsonify({"error": "No ticker given."}), 400
+    period = request.args.get('period', valuation_history.VALUATION_HISTORY_PERIOD)
+    try:
+        get_period_days(period)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        with stage(STAGE_LOAD):
+            df_history = valuation_history_store.get_history(ticker, period=period)
+    except Exception as e:
+        print(f"Error computing valuation history for {ticker}: {e}")
+        return jsonify({"error": f"Could not compute the valuation history: {e}"}), 500
+    if df_history is None:
+        return jsonify({"error": f"No quarterly statements for {ticker}."}), 404
+    if df_history.empty:
+        return jsonify({"error": f"No price data for {ticker}."}), 404
+
+    with stage(STAGE_SERIALIZE):
+        response = jsonify({"ticker": ticker, "period": period, **valuation_history_payload(df_history)})
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.add_etag()
+    return response.make_conditional(request)
+
+# api_peers - JSON: tickers=AAPL,MSFT,... metric=... variant=quarterly|annual, מיושר לתקופות קלנדריות
+@route('/api/peers')
+def route_api_peers():
+    try:
+        tickers, metric, variant = read_peer_query_args()
+        with stage(STAGE_LOAD):
+            values, report_dates, missing = peer_comparison.build_peer_comparison(tickers, metric, variant)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Error loading peer comparison data: {e}")
+        return jsonify({"error": f"Could not load the peer comparison data: {e}"}), 500
+    if values is None:
+        return jsonify({"error": "Market statement data is not available."}), 404
+
+    with stage(STAGE_SERIALIZE):
+        response = jsonify({"metric": metric, "variant": variant, "missing": missing,
+                            **peer_comparison.peer_comparison_payload(values, report_dates)})
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.add_etag()
+    return response.make_conditional(request)
+
+# api_screener - סינון ודירוג כל השוק: where=revenue_growth_yoy>0.1 (אפשר כמה), sort=net_margin, order, top
+@route('/api/screener')
+def route_api_screener():
+    started = time.perf_counter()
+    try:
+        conditions = [parse_condition(text) for text in request.args.getlist('where')]
+        sort_metric = request.args.get('sort') or None
+        descending = request.args.get('order', 'desc') != 'asc'
+        top = max(1, min(int(request.args.get('top', 50)), screener.SCREENER_MAX_RESULTS))
+        with stage(STAGE_TRANSFORM):
+            screener_index = screener_engine.get_index()
+            screened, match_count = screener_index.screen(conditions, sort_metric, descending, top)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Error running screener: {e}")
+        return jsonify({"error": f"Could not run the screen: {e}"}), 500
+
+    return jsonify({"market_size": len(screener_index.metrics), "match_count": match_count,
+                    "results": screen_records(screened),
+                    "elapsed_ms": round((time.perf_counter() - started) * 1000, 2)})
+
+# metrics - היסטוגרמות זמני הבקשות והשלבים בפורמט הטקסט של Prometheus
+@route('/metrics')
+def route_metrics():
+    for name, value in frame_cache.stats().items():
+        request_metrics.set_gauge(f'simfin_frame_cache_{name}', f'Server-side DataFrame cache: {name}.', value)
+    if ingest_jobs.is_loaded:
+        for name, value in ingest_job_queue.stats().items():
+            request_metrics.set_gauge(f'simfin_ingest_jobs_{name}', f'Ticker ingest job queue: {name}.', value)
+    # statement_store מיובא גם ישירות ממודולי הנתונים, ולכן נבדק ב-sys.modules; אם לא יובא אין datasets בזיכרון
+    statement_store_module = sys.modules.get('statement_store')
+    if statement_store_module is not None:
+        # גודל ה-datasets שהתהליך מחזיק; ב-arrow-mmap הדפים משותפים לכל התהליכים ב-page cache
+        memory_report = statement_store_module.statement_store.memory_report()
+        for dataset_name, dataset_report in memory_report.items():
+            request_metrics.set_gauge(f"simfin_dataset_bytes_{dataset_name.replace('-', '_')}",
+                                      f"Bytes of the {dataset_name} dataset held by this process ({dataset_report['backing']}).",
+                                      dataset_report['bytes'])
+        request_metrics.set_gauge('simfin_datasets_bytes', 'Bytes of all bulk datasets held by this process.',
+                                  sum(dataset_report['bytes'] for dataset_report in memory_report.values()))
+    response = make_response(request_metrics.render_prometheus())
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
 # route_update_api_key_action - ללא שינוי מהגרסה הקודמת שהצגתי
-@app.route('/update_api_key_action', methods=['POST'])
+@route('/update_api_key_action', methods=['POST'])
 def route_update_api_key_action():
     if request.method == 'POST':
         new_api_key = request.form.get('api_key_input_modal', '').strip()
@@ -458,5 +909,185 @@ def route_update_api_key_action():
 
     return redirect(url_for('route_home'))
 
+# --- חימום מטמונים ברקע (אופציונלי): ייבוא הספריות הכבדות וטעינת ה-datasets שכבר בדיסק ---
+PREWARM_MODULES = ['pandas', 'plotly.express', 'plotly.graph_objects', 'chart_cache', 'derived_metrics',
+                   'downloader', 'downsample', 'price_store', 'screener', 'statement_files', 'valuation']
+
+def prewarm_caches(market='us'):
+    """
+    Imports the heavy modules and loads every bulk dataset that is already on
+    disk, then builds the derived-metrics tables, so the first requests do not
+    pay for it. Datasets that would need a SimFin download are skipped - a
+    worker booting should not hit the network; the ingest job refreshes them.
+
+    Returns:
+        dict: Seconds spent on imports and on datasets, and the datasets that were loaded / skipped.
+    """
+    report = {'loaded': [], 'skipped': []}
+    started = time.perf_counter()
+    for module_name in PREWARM_MODULES:
+        lazy_module(module_name).load()
+    report['import_seconds'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    ensure_simfin_configured()
+    store = lazy_from('statement_store', 'statement_store').resolve()
+    downloader = lazy_module('downloader')
+    for variant in downloader.STATEMENT_VARIANTS:
+        for stmt_key in downloader.STATEMENT_TYPES:
+            dataset_name = f"{market}-{stmt_key}-{variant}"
+            if store.requires_download(stmt_key, variant, market):
+                report['skipped'].append(dataset_name)
+                continue
+            if store.get_dataset(stmt_key, variant, market) is not None:
+                report['loaded'].append(dataset_name)
+    if not report['skipped']:
+        derived_metrics_store.refresh(market)
+    report['data_seconds'] = time.perf_counter() - started
+    return report
+
+def start_cache_prewarm(market='us'):
+    """Runs prewarm_caches() in a daemon thread and reports how long it took."""
+    def run_prewarm():
+        started = time.perf_counter()
+        try:
+            report = prewarm_caches(market)
+        except Exception as e:
+            print(f"SimFinFund.py: Cache pre-warm failed: {e}")
+            return
+        total_seconds = time.perf_counter() - started
+        request_metrics.set_gauge('simfin_cache_prewarm_seconds', 'Duration of the background cache pre-warm.', total_seconds)
+        skipped = f", skipped (need download): {', '.join(report['skipped'])}" if report['skipped'] else ''
+        print(f"SimFinFund.py: Cache pre-warm done in {total_seconds:.2f}s (imports {report['import_seconds']:.2f}s, "
+              f"data {report['data_seconds']:.2f}s, {len(report['loaded'])} datasets loaded{skipped}).")
+
+    thread = threading.Thread(target=run_prewarm, name='cache-prewarm', daemon=True)
+    thread.start()
+    return thread
+
+# --- רענון מתוזמן של קבצי ה-bulk, מחוץ למסלול הבקשות ---
+DEFAULT_BULK_REFRESH_INTERVAL_SECONDS = 24 * 3600
+
+def start_bulk_refresh(interval_seconds, refresh_days, market='us'):
+    """
+    Re-pulls the bulk datasets older than `refresh_days` every `interval_seconds`
+    in a daemon thread (first run after one interval). ingest_jobs - and with it
+    pandas and SimFin - is imported only when the first run is due. A run is
+    skipped while another process on the machine is refreshing.
+    """
+    def run_refresh_loop():
+        while True:
+            time.sleep(interval_seconds)
+            try:
+                report = ingest_jobs.refresh_bulk_datasets(market, refresh_days)
+            except Exception as e:
+                print(f"SimFinFund.py: Scheduled bulk refresh failed: {e}")
+                continue
+            if report is None: # תהליך אחר מרענן
+                continue
+            request_metrics.set_gauge('simfin_bulk_refresh_seconds', 'Duration of the last scheduled bulk-dataset refresh.',
+                                      report['total_seconds'])
+            request_metrics.set_gauge('simfin_bulk_refresh_last_run_timestamp_seconds',
+                                      'Unix time of the last scheduled bulk-dataset refresh.', time.time())
+            print(f"SimFinFund.py: Scheduled bulk refresh done in {report['total_seconds']}s "
+                  f"(refreshed: {', '.join(report['refreshed']) or 'none'}"
+                  f"{', errors: ' + ', '.join(report['errors']) if report['errors'] else ''}).")
+
+    thread = threading.Thread(target=run_refresh_loop, name='bulk-refresh', daemon=True)
+    thread.start()
+    return thread
+
+#---------------------------------------------------------------------------------------------
+
+def load_secret_key(app):
+    # --- טעינת SECRET_KEY מקובץ secrets.py ---
+    try:
+        from secrets import FLASK_SECRET_KEY
+        app.config['SECRET_KEY'] = FLASK_SECRET_KEY
+    except ImportError:
+        # הדפס אזהרה רק בתהליך הראשי של שרת הפיתוח של Flask
+        if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            print("-" * 80)
+            print("אזהרה: קובץ secrets.py עם FLASK_SECRET_KEY לא נמצא.")
+            print("משתמש במפתח ברירת מחדל המיועד לפיתוח בלבד (לא מאובטח).")
+            print("בסביבת ייצור, חובה ליצור קובץ secrets.py עם מפתח אקראי וחזק,")
+            print(f"ולהוסיף את secrets.py לקובץ .gitignore. הקובץ צריך להכיל: FLASK_SECRET_KEY = 'your_strong_random_key'")
+            print("ניתן לייצר מפתח לדוגמה עם: python -c \"import os; print(os.urandom(24).hex())\"")
+            print("-" * 80)
+        app.config['SECRET_KEY'] = 'a_very_default_and_insecure_secret_key_CHANGE_THIS_IF_NO_SECRETS_FILE'
+    except AttributeError: # אם הקובץ קיים אבל המשתנה לא מוגדר בו
+        if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            print("-" * 80)
+            print("אזהרה: המשתנה FLASK_SECRET_KEY אינו מוגדר בקובץ secrets.py.")
+            print("משתמש במפתח ברירת מחדל המיועד לפיתוח בלבד (לא מאובטח).")
+            print("-" * 80)
+        app.config['SECRET_KEY'] = 'another_default_and_insecure_secret_key_CHANGE_THIS'
+
+def create_app(config=None):
+    """
+    Application factory. Builds the Flask app without importing simfin, pandas
+    or plotly and without configuring SimFin - those happen on first use, or in
+    the background when PREWARM_CACHES is set.
+
+    Args:
+        config (dict, optional): Overrides for app.config (e.g. {'PREWARM_CACHES': True}).
+
+    Returns:
+        Flask: The app. app.config['STARTUP_SECONDS'] holds the module import plus factory time.
+    """
+    started = time.perf_counter()
+    app = Flask(__name__)
+    load_secret_key(app)
+
+    # תקציב הזיכרון של מטמון ה-DataFrames בצד השרת (בבתים)
+    app.config['FRAME_CACHE_MAX_BYTES'] = int(os.environ.get('FRAME_CACHE_MAX_BYTES', DEFAULT_FRAME_CACHE_MAX_BYTES))
+    # בקשה איטית מסף זה (בשניות) נרשמת ללוג עם פירוק לפי שלבים; 0 מכבה את הלוג
+    app.config['SLOW_REQUEST_SECONDS'] = float(os.environ.get('SLOW_REQUEST_SECONDS', DEFAULT_SLOW_REQUEST_SECONDS))
+    # חימום המטמונים ברקע מיד אחרי העלייה (PREWARM_CACHES=1)
+    app.config['PREWARM_CACHES'] = os.environ.get('PREWARM_CACHES', '').lower() in ('1', 'true', 'yes')
+    # כמה שניות /set_ticker מחכה לעבודת הטעינה לפני שהוא חוזר (0 = לא מחכה; הדף בודק סטטוס)
+    app.config['INGEST_WAIT_SECONDS'] = float(os.environ.get('INGEST_WAIT_SECONDS', 0))
+    # רענון קבצי ה-bulk כל BULK_REFRESH_INTERVAL_SECONDS (0 מכבה; תמיד כבוי ב-TESTING), לקבצים בני BULK_REFRESH_DAYS ימים ומעלה
+    app.config['BULK_REFRESH_INTERVAL_SECONDS'] = float(os.environ.get('BULK_REFRESH_INTERVAL_SECONDS',
+                                                                       DEFAULT_BULK_REFRESH_INTERVAL_SECONDS))
+    app.config['BULK_REFRESH_DAYS'] = float(os.environ.get('BULK_REFRESH_DAYS', 1))
+    if config:
+        app.config.update(config)
+
+    frame_cache.set_max_bytes(app.config['FRAME_CACHE_MAX_BYTES'])
+    init_request_timing(app)
+    for rule, view_func, options in VIEW_ROUTES:
+        app.add_url_rule(rule, view_func=view_func, **options)
+
+    factory_seconds = time.perf_counter() - started
+    app.config['STARTUP_SECONDS'] = MODULE_IMPORT_SECONDS + factory_seconds
+    request_metrics.set_gauge('simfin_app_startup_seconds', 'Module import plus create_app() time of this process.',
+                              app.config['STARTUP_SECONDS'])
+    loaded = loaded_lazy_modules()
+    print(f"SimFinFund.py: App created in {app.config['STARTUP_SECONDS'] * 1000:.0f}ms "
+          f"(module import {MODULE_IMPORT_SECONDS * 1000:.0f}ms, create_app {factory_seconds * 1000:.0f}ms"
+          f"{', eagerly loaded: ' + ', '.join(loaded) if loaded else ''}).")
+
+    if app.config['PREWARM_CACHES']:
+        start_cache_prewarm()
+    if app.config['BULK_REFRESH_INTERVAL_SECONDS'] > 0 and not app.config.get('TESTING'):
+        start_bulk_refresh(app.config['BULK_REFRESH_INTERVAL_SECONDS'], app.config['BULK_REFRESH_DAYS'])
+    return app
+
+_default_app = None
+_default_app_lock = threading.Lock()
+
+def __getattr__(name):
+    # `SimFinFund.app` (flask run, gunicorn SimFinFund:app, הסקריפטים) נבנה רק כשניגשים אליו
+    global _default_app
+    if name != 'app':
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _default_app_lock:
+        if _default_app is None:
+            _default_app = create_app()
+        return _default_app
+
+MODULE_IMPORT_SECONDS = time.perf_counter() - MODULE_IMPORT_STARTED
+
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    create_app().run(debug=True)
\ No newline at end of file
@@ -0,0 +1,59 @@
+# benchmarks/bench_moving_averages.py
+"""
+Compares the per-window `rolling().mean()` approach that download_price_history_with_mavg
+used to take against moving_averages.compute_moving_averages / update_moving_averages.
+
+Run from the repository root:
+    python benchmarks/bench_moving_averages.py
+"""
+import os
+import sys
+import timeit
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from moving_averages import compute_moving_averages, update_moving_averages
+
+WINDOWS = [20, 50, 100, 150, 200] # כמו בדף הבית
+SIZES = {'10y': 2520, 'max': 11000} # בערך מספר ימי מסחר ב-10 שנים / מאז שנות ה-80
+REPEATS = 20
+
+#---------------------------------------------------------------------------------------------
+
+def make_close_series(n_bars, seed=0):
+    rng = np.random.default_rng(seed)
+    index = pd.bdate_range(end='2025-05-01', periods=n_bars)
+    return pd.Series(100 * np.exp(np.cumsum(rng.normal(0, 0.01, n_bars))), index=index, name='Close')
+
+def rolling_per_window(close):
+    return pd.DataFrame({f'MA{w}': close.rolling(window=w).mean() for w in WINDOWS})
+
+def best_of(func):
+    return min(timeit.repeat(func, number=1, repeat=REPEATS)) * 1000
+
+def main():
+    print(f"{'size':>5} {'bars':>6} {'rolling/window ms':>18} {'single pass ms':>15} "
+          f"{'append 1 bar ms':>16}")
+    for label, n_bars in SIZES.items():
+        close = make_close_series(n_bars)
+        expected = rolling_per_window(close)
+        engine_result = compute_moving_averages(close, sma_windows=WINDOWS)
+        assert np.allclose(expected.to_numpy(), engine_result[expected.columns].to_numpy(), equal_nan=True)
+
+        rolling_ms = best_of(lambda: rolling_per_window(close))
+        engine_ms = best_of(lambda: compute_moving_averages(close, sma_windows=WINDOWS))
+
+        # עדכון אינקרמנטלי: בר אחד חדש מתווסף להיסטוריה שכבר מחושבת
+        prices = pd.concat([close.to_frame(), engine_result], axis=1)
+        def append_one_bar():
+            update_moving_averages(prices, n_bars - 1, sma_windows=WINDOWS)
+        append_ms = best_of(append_one_bar)
+
+        print(f"{label:>5} {n_bars:>6} {rolling_ms:>18.3f} {engine_ms:>15.3f} {append_ms:>16.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,309 @@
+# benchmarks/bench_suite.py
+"""
+Offline benchmark suite for the request hot paths: statement download/lookup,
+statement loading, chart building and the Flask routes themselves.
+
+Everything runs against synthetic data (see synthetic_data.py) written to a
+temporary SimFin data directory, and prices come from a StaticPriceSource, so
+no network access or SimFin API key is needed. Results are written as JSON and
+can be compared with an earlier run to catch regressions.
+
+Run from the repository root:
+    python benchmarks/bench_suite.py
+    python benchmarks/bench_suite.py --sizes small --price-sizes 10y --repeats 5
+    python benchmarks/bench_suite.py --compare benchmarks/results/<baseline>.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, REPO_ROOT)
+
+import SimFinFund
+import columnar_cache
+import statement_files
+from chart_cache import chart_payload_cache, serialize_chart
+from derived_metrics import derived_metrics_store
+from downloader import download_financial_statements
+from downsample import downsample_prices
+from frame_cache import frame_cache
+from moving_averages import compute_moving_averages
+from price_store import StaticPriceSource, price_store
+from simfin_setup import configure_simfin
+from statement_store import statement_store
+from synthetic_data import BULK_SIZES, PRICE_SIZES, make_price_history, write_simfin_bulk_files
+
+DEFAULT_RESULTS_DIR = os.path.join(BENCHMARKS_DIR, 'results')
+DEFAULT_REPEATS = 10
+# מדידות "קרות" (טעינה מ-CSV, אחרי ניקוי מטמונים) איטיות - מספר חזרות קטן יותר
+DEFAULT_COLD_REPEATS = 3
+# האטה של יותר מפי 1.25 (וגם יותר ממילישנייה אחת) נחשבת רגרסיה
+DEFAULT_REGRESSION_THRESHOLD = 1.25
+DEFAULT_MIN_DELTA_MS = 1.0
+
+BENCH_TICKER = 'T00000'
+ROUTE_PRICE_SIZE = '10y'
+MOVING_AVERAGES = SimFinFund.HOME_CHART_MOVING_AVERAGES
+MA_COLUMNS = [f'MA{ma}' for ma in MOVING_AVERAGES]
+# השוואת 20 חברות: שליפה אחת מטבלת המדדים הנגזרים ובניית גרף אחת
+PEER_TICKERS = [f'T{i:05d}' for i in range(20)]
+CHART_ROUTES = (['/charts/candlestick'] + [f'/charts/{chart_name}' for chart_name in SimFinFund.STATEMENT_CHARTS]
+                + [f"/charts/peers?tickers={','.join(PEER_TICKERS)}&metric=revenue&variant=quarterly"])
+PAGE_ROUTES = ['/', '/graphs/annual', '/graphs/quarterly']
+
+#---------------------------------------------------------------------------------------------
+
+def summarize(timings_ms):
+    return {'median_ms': statistics.median(timings_ms), 'min_ms': min(timings_ms),
+            'max_ms': max(timings_ms), 'runs': len(timings_ms)}
+
+def measure(func, repeats, setup=None):
+    """Runs `func` `repeats` times (calling `setup` untimed before each run) and summarizes the timings."""
+    timings = []
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return summarize(timings)
+
+def drop_statement_caches():
+    """Forgets every loaded bulk dataset and its columnar copy, so the next load parses the CSV."""
+    statement_store.invalidate()
+    shutil.rmtree(columnar_cache.get_columnar_cache_dir(), ignore_errors=True)
+
+#---------------------------------------------------------------------------------------------
+
+def bench_download(results, size, repeats, cold_repeats):
+    # csv: טעינה ראשונה מקבצי SimFin; columnar: תהליך חדש שקורא את העותק העמודתי; memory: הכל כבר בזיכרון
+    name = 'download_financial_statements'
+    results[f'{name}/csv/{size}'] = measure(lambda: download_financial_statements(BENCH_TICKER), cold_repeats,
+                                            setup=drop_statement_caches)
+    results[f'{name}/columnar/{size}'] = measure(lambda: download_financial_statements(BENCH_TICKER), cold_repeats,
+                                                 setup=statement_store.invalidate)
+    results[f'{name}/memory/{size}'] = measure(lambda: download_financial_statements(BENCH_TICKER), repeats)
+
+def bench_load_and_timeseries(results, size, repeats):
+    download_results = download_financial_statements(BENCH_TICKER)
+    statement_files.save_ticker_statements(
+        {(stmt_key, variant): download_results[f'{stmt_key}_{variant}'] for variant in ('annual', 'quarterly')
+         for stmt_key in ('income', 'balance', 'cashflow')}, BENCH_TICKER, export_csv=True)
+
+    with SimFinFund.app.test_request_context('/'):
+        for variant in ('annual', 'quarterly'):
+            def load():
+                df, error, _ = SimFinFund.get_dataframe_from_session_or_csv(BENCH_TICKER, variant, 'income')
+                if df is None:
+                    raise RuntimeError(f"get_dataframe_from_session_or_csv failed: {error}")
+                return df
+
+            def load_csv():
+                return SimFinFund.read_legacy_statement_csv(BENCH_TICKER, variant, 'income')[0]
+
+            # store: קובץ הדוחות הבינארי של הטיקר; csv: המסלול הישן של קובצי CSV, לשם השוואה
+            name = f'get_dataframe_from_session_or_csv/{variant}'
+            results[f'{name}/store/{size}'] = measure(load, repeats, setup=lambda: frame_cache.invalidate(BENCH_TICKER))
+            results[f'{name}/csv/{size}'] = measure(load_csv, repeats, setup=lambda: frame_cache.invalidate(BENCH_TICKER))
+            results[f'{name}/frame_cache/{size}'] = measure(load, repeats)
+
+            df_income = load()
+            def chart():
+                return SimFinFund.create_timeseries_chart(df_income, 'Revenue', 'Revenue', y_axis_title='Amount')
+            results[f'create_timeseries_chart/{variant}/{size}'] = measure(chart, repeats)
+            results[f'create_timeseries_chart+serialize/{variant}/{size}'] = measure(lambda: serialize_chart(chart()), repeats)
+
+def bench_candlestick(results, price_size, n_bars, repeats):
+    bars = make_price_history(n_bars)
+    df_prices = pd.concat([bars, compute_moving_averages(bars['Close'], sma_windows=MOVING_AVERAGES)], axis=1)
+
+    name = 'create_candlestick_chart_with_mavg'
+    def full_chart():
+        return SimFinFund.create_candlestick_chart_with_mavg(df_prices, BENCH_TICKER, MA_COLUMNS)
+    results[f'{name}/full/{price_size}'] = measure(full_chart, repeats)
+    results[f'{name}+serialize/full/{price_size}'] = measure(lambda: serialize_chart(full_chart()), repeats)
+
+    # המסלול של /charts/candlestick: דילול ל-HOME_CHART_TARGET_POINTS ואז בניית הגרף
+    def downsampled_chart():
+        reduced = downsample_prices(df_prices, SimFinFund.HOME_CHART_TARGET_POINTS, MA_COLUMNS)
+        chart = SimFinFund.create_candlestick_chart_with_mavg(reduced['candles'], BENCH_TICKER, MA_COLUMNS,
+                                                              moving_average_series=reduced['moving_averages'])
+        return serialize_chart(chart)
+    results[f'{name}+serialize/downsampled/{price_size}'] = measure(downsampled_chart, repeats)
+
+def bench_routes(results, size, repeats, cold_repeats):
+    # /set_ticker מחכה לעבודת הטעינה שברקע, כך שהמדידה כוללת את כל הטעינה והכתיבה כמו קודם
+    SimFinFund.app.config['INGEST_WAIT_SECONDS'] = 60
+    client = SimFinFund.app.test_client()
+
+    def request(method, path, expected_status=200, **kwargs):
+        started = time.perf_counter()
+        response = client.open(path, method=method, **kwargs)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if response.status_code != expected_status:
+            raise RuntimeError(f"{method} {path} returned {response.status_code}, expected {expected_status}: "
+                               f"{response.get_data(as_text=True)[:200]}")
+        return elapsed_ms
+
+    def set_ticker():
+        return request('POST', '/set_ticker', expected_status=302, data={'ticker_input': BENCH_TICKER})
+
+    # סבב חימום שלא נמדד: בניית טבלת המדדים הנגזרים והורדת המחירים הראשונה
+    set_ticker()
+    for path in PAGE_ROUTES + CHART_ROUTES:
+        request('GET', path)
+
+    # cold: מיד אחרי /set_ticker, שמרוקן את המטמונים של הטיקר (גרפים ו-DataFrames)
+    timings = {path: [] for path in ['POST /set_ticker'] + PAGE_ROUTES + CHART_ROUTES}
+    for _ in range(cold_repeats):
+        timings['POST /set_ticker'].append(set_ticker())
+        for path in PAGE_ROUTES + CHART_ROUTES:
+            timings[path].append(request('GET', path))
+    for path, path_timings in timings.items():
+        label = path if path.startswith('POST') else f'GET {path}'
+        results[f'route/{label}/cold/{size}'] = summarize(path_timings)
+
+    # warm: אותן בקשות שוב, כשהמטמונים בצד השרת מלאים
+    for path in PAGE_ROUTES + CHART_ROUTES:
+        results[f'route/GET {path}/warm/{size}'] = summarize([request('GET', path) for _ in range(repeats)])
+
+#---------------------------------------------------------------------------------------------
+
+def get_git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_suite(sizes, price_sizes, repeats, cold_repeats, work_dir):
+    results = {}
+    price_dir = os.path.join(work_dir, 'Data')
+    statement_files.PROCESSED_DATA_BASE_DIR = price_dir
+    price_store.base_dir = price_dir
+    price_store.source = StaticPriceSource({BENCH_TICKER: make_price_history(PRICE_SIZES[ROUTE_PRICE_SIZE])})
+
+    for price_size in price_sizes:
+        print(f"candlestick charts: {price_size} ({PRICE_SIZES[price_size]} bars)")
+        bench_candlestick(results, price_size, PRICE_SIZES[price_size], repeats)
+
+    for size in sizes:
+        print(f"bulk datasets: {size} ({BULK_SIZES[size]} tickers)")
+        simfin_dir = os.path.join(work_dir, f'simfin_{size}')
+        write_simfin_bulk_files(simfin_dir, BULK_SIZES[size])
+        configure_simfin(simfin_dir)
+        statement_store.invalidate()
+        derived_metrics_store.invalidate()
+        frame_cache.invalidate()
+        chart_payload_cache.invalidate()
+
+        bench_download(results, size, repeats, cold_repeats)
+        bench_load_and_timeseries(results, size, repeats)
+        bench_routes(results, size, repeats, cold_repeats)
+    return results
+
+def compare_results(results, baseline, threshold, min_delta_ms):
+    """
+    Compares median timings with a baseline run.
+
+    Returns:
+        list of tuple: (benchmark, baseline_ms, current_ms, ratio) for every regression.
+    """
+    regressions = []
+    print(f"\n{'benchmark':<72} {'baseline ms':>12} {'current ms':>11} {'ratio':>7}")
+    for key in sorted(results):
+        if key not in baseline:
+            continue
+        baseline_ms, current_ms = baseline[key]['median_ms'], results[key]['median_ms']
+        ratio = current_ms / baseline_ms if baseline_ms > 0 else float('inf')
+        regressed = ratio > threshold and current_ms - baseline_ms > min_delta_ms
+        if regressed:
+            regressions.append((key, baseline_ms, current_ms, ratio))
+        print(f"{key:<72} {baseline_ms:>12.2f} {current_ms:>11.2f} {ratio:>7.2f}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+def print_results(results):
+    print(f"\n{'benchmark':<72} {'median ms':>10} {'min ms':>9} {'runs':>5}")
+    for key in sorted(results):
+        entry = results[key]
+        print(f"{key:<72} {entry['median_ms']:>10.2f} {entry['min_ms']:>9.2f} {entry['runs']:>5}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', default=','.join(BULK_SIZES),
+                        help=f"Bulk dataset sizes to run ({', '.join(f'{k}={v} tickers' for k, v in BULK_SIZES.items())}).")
+    parser.add_argument('--price-sizes', default=','.join(PRICE_SIZES),
+                        help=f"Price history sizes to run ({', '.join(f'{k}={v} bars' for k, v in PRICE_SIZES.items())}).")
+    parser.add_argument('--repeats', type=int, default=DEFAULT_REPEATS)
+    parser.add_argument('--cold-repeats', type=int, default=DEFAULT_COLD_REPEATS)
+    parser.add_argument('--output', help="Results file (default: benchmarks/results/<timestamp>.json).")
+    parser.add_argument('--compare', help="Results file of an earlier run to compare against.")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_REGRESSION_THRESHOLD,
+                        help="Slowdown ratio counted as a regression.")
+    parser.add_argument('--min-delta-ms', type=float, default=DEFAULT_MIN_DELTA_MS,
+                        help="Ignore slowdowns smaller than this many milliseconds.")
+    args = parser.parse_args()
+
+    args.sizes = [size for size in args.sizes.split(',') if size]
+    args.price_sizes = [size for size in args.price_sizes.split(',') if size]
+    unknown = [size for size in args.sizes if size not in BULK_SIZES] + \
+              [size for size in args.price_sizes if size not in PRICE_SIZES]
+    if unknown:
+        parser.error(f"Unknown sizes: {', '.join(unknown)}")
+    return args
+
+def main():
+    args = parse_args()
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)['results']
+
+    started_at = datetime.now()
+    work_dir = tempfile.mkdtemp(prefix='simfin_bench_')
+    try:
+        results = run_suite(args.sizes, args.price_sizes, args.repeats, args.cold_repeats, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print_results(results)
+
+    output_path = args.output or os.path.join(DEFAULT_RESULTS_DIR, f"{started_at:%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    report = {
+        'meta': {
+            'created': started_at.isoformat(timespec='seconds'), 'git_revision': get_git_revision(),
+            'python': platform.python_version(), 'platform': platform.platform(),
+            'pandas': pd.__version__, 'numpy': np.__version__, 'pyarrow': columnar_cache.is_available(),
+            'sizes': {size: BULK_SIZES[size] for size in args.sizes},
+            'price_sizes': {size: PRICE_SIZES[size] for size in args.price_sizes},
+            'repeats': args.repeats, 'cold_repeats': args.cold_repeats
+        },
+        'results': results
+    }
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults saved to {output_path}")
+
+    if baseline is not None:
+        regressions = compare_results(results, baseline, args.threshold, args.min_delta_ms)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) above x{args.threshold}.")
+            sys.exit(1)
+        print("\nNo regressions.")
+
+
+if __name__ == '__main__':
+    main()
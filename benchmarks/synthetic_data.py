@@ -0,0 +1,149 @@
+# benchmarks/synthetic_data.py
+"""
+Offline test data for the benchmarks: SimFin-shaped bulk CSV files and
+yfinance-shaped price histories, generated with a fixed seed so every run
+measures the same data.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+# מספר הטיקרים בכל גודל של dataset (השוק האמריקאי המלא בנתוני SimFin הוא כ-4,000-5,000 טיקרים)
+BULK_SIZES = {'small': 250, 'medium': 1500, 'large': 5000}
+# מספר הברים היומיים בכל גודל של היסטוריית מחירים
+PRICE_SIZES = {'1y': 252, '10y': 2520, 'max': 11000}
+
+ANNUAL_YEARS = 10
+QUARTERLY_PERIODS = 40
+LAST_FISCAL_YEAR = 2024
+LAST_PRICE_DATE = '2025-05-01'
+
+# עמודה -> (מקדם ביחס להכנסות, סטיית תקן יחסית); ערכים שליליים כמו בקבצי SimFin
+INCOME_COLUMNS = {
+    'Revenue': (1.0, 0.0), 'Cost of Revenue': (-0.6, 0.05), 'Gross Profit': (0.4, 0.05),
+    'Operating Expenses': (-0.25, 0.03), 'Selling, General & Administrative': (-0.18, 0.02),
+    'Research & Development': (-0.07, 0.02), 'Depreciation & Amortization': (-0.04, 0.01),
+    'Operating Income (Loss)': (0.15, 0.08), 'Non-Operating Income (Loss)': (-0.01, 0.01),
+    'Interest Expense, Net': (-0.01, 0.005), 'Pretax Income (Loss), Adj.': (0.13, 0.08),
+    'Pretax Income (Loss)': (0.13, 0.08), 'Income Tax (Expense) Benefit, Net': (-0.03, 0.01),
+    'Income (Loss) from Continuing Operations': (0.1, 0.08), 'Net Income': (0.1, 0.08),
+    'Net Income (Common)': (0.1, 0.08)
+}
+BALANCE_COLUMNS = {
+    'Cash, Cash Equivalents & Short Term Investments': (0.3, 0.1), 'Accounts & Notes Receivable': (0.15, 0.05),
+    'Inventories': (0.1, 0.05), 'Total Current Assets': (0.6, 0.1), 'Property, Plant & Equipment, Net': (0.5, 0.2),
+    'Long Term Investments & Receivables': (0.1, 0.05), 'Other Long Term Assets': (0.2, 0.1),
+    'Total Noncurrent Assets': (0.8, 0.2), 'Total Assets': (1.4, 0.3), 'Payables & Accruals': (0.15, 0.05),
+    'Short Term Debt': (0.05, 0.03), 'Total Current Liabilities': (0.3, 0.1), 'Long Term Debt': (0.3, 0.15),
+    'Total Noncurrent Liabilities': (0.4, 0.15), 'Total Liabilities': (0.7, 0.2), 'Share Capital & Additional Paid-In Capital': (0.3, 0.1),
+    'Retained Earnings': (0.4, 0.2), 'Total Equity': (0.7, 0.2), 'Total Liabilities & Equity': (1.4, 0.3)
+}
+CASHFLOW_COLUMNS = {
+    'Net Income/Starting Line': (0.1, 0.08), 'Depreciation & Amortization': (0.04, 0.01), 'Non-Cash Items': (0.01, 0.01),
+    'Change in Working Capital': (-0.01, 0.03), 'Net Cash from Operating Activities': (0.14, 0.08),
+    'Change in Fixed Assets & Intangibles': (-0.05, 0.02), 'Net Cash from Investing Activities': (-0.07, 0.04),
+    'Dividends Paid': (-0.02, 0.01), 'Cash from (Repayment of) Debt': (0.0, 0.03),
+    'Net Cash from Financing Activities': (-0.04, 0.04), 'Net Change in Cash': (0.03, 0.06)
+}
+STATEMENT_COLUMNS = {'income': INCOME_COLUMNS, 'balance': BALANCE_COLUMNS, 'cashflow': CASHFLOW_COLUMNS}
+# חלק מהתאים ריקים, כמו בנתונים האמיתיים
+MISSING_FRACTION = 0.03
+
+#---------------------------------------------------------------------------------------------
+
+def make_tickers(n_tickers):
+    return [f'T{i:05d}' for i in range(n_tickers)]
+
+def make_period_frame(tickers, variant):
+    """The meta columns (one row per ticker and period) of an annual or quarterly statement file."""
+    n_tickers = len(tickers)
+    if variant == 'annual':
+        report_dates = pd.to_datetime([f'{year}-12-31' for year in range(LAST_FISCAL_YEAR - ANNUAL_YEARS + 1, LAST_FISCAL_YEAR + 1)])
+        fiscal_periods = ['FY'] * len(report_dates)
+        publish_lag = pd.Timedelta(days=60)
+    else:
+        report_dates = pd.date_range(end=f'{LAST_FISCAL_YEAR}-12-31', periods=QUARTERLY_PERIODS, freq='QE')
+        fiscal_periods = [f'Q{date.quarter}' for date in report_dates]
+        publish_lag = pd.Timedelta(days=40)
+    n_periods = len(report_dates)
+
+    frame = pd.DataFrame({
+        'Ticker': np.repeat(tickers, n_periods),
+        'SimFinId': np.repeat(np.arange(1000, 1000 + n_tickers), n_periods),
+        'Currency': 'USD',
+        'Fiscal Year': np.tile(report_dates.year, n_tickers),
+        'Fiscal Period': np.tile(fiscal_periods, n_tickers),
+        'Report Date': np.tile(report_dates, n_tickers),
+    })
+    frame['Publish Date'] = frame['Report Date'] + publish_lag
+    frame['Restated Date'] = frame['Publish Date']
+    return frame
+
+def make_statement_frame(tickers, stmt_key, variant, seed=0):
+    """A whole-market statement (rows sorted by Ticker and Report Date) with plausible magnitudes."""
+    rng = np.random.default_rng([seed, len(tickers), ['income', 'balance', 'cashflow'].index(stmt_key), int(variant == 'annual')])
+    frame = make_period_frame(tickers, variant)
+    n_periods = len(frame) // len(tickers)
+
+    # הכנסות: גודל בסיס לכל חברה (לוג-נורמלי) וצמיחה אקראית לאורך התקופות
+    base_revenue = np.exp(rng.normal(np.log(5e8), 1.5, len(tickers)))
+    growth = np.cumsum(rng.normal(0.01, 0.05, (len(tickers), n_periods)), axis=1)
+    revenue = (base_revenue[:, None] * np.exp(growth)).ravel()
+    if variant == 'annual':
+        revenue *= 4
+
+    shares = np.repeat(np.exp(rng.normal(np.log(2e8), 1.0, len(tickers))), n_periods)
+    frame['Shares (Basic)'] = shares.round()
+    frame['Shares (Diluted)'] = (shares * 1.01).round()
+    for column, (ratio, spread) in STATEMENT_COLUMNS[stmt_key].items():
+        values = revenue * (ratio + rng.normal(0, spread, len(revenue)))
+        values[rng.random(len(values)) < MISSING_FRACTION] = np.nan
+        frame[column] = values.round(-3)
+    if stmt_key == 'income':
+        frame['Revenue'] = revenue.round(-3) # הכנסות תמיד קיימות
+    return frame
+
+def make_shareprices_latest_frame(tickers, seed=0):
+    rng = np.random.default_rng([seed, len(tickers), 9])
+    close = np.exp(rng.normal(np.log(40), 1.0, len(tickers))).round(2)
+    return pd.DataFrame({
+        'Ticker': tickers, 'SimFinId': np.arange(1000, 1000 + len(tickers)), 'Date': pd.Timestamp(LAST_PRICE_DATE),
+        'Open': close, 'High': (close * 1.01).round(2), 'Low': (close * 0.99).round(2), 'Close': close,
+        'Adj. Close': close, 'Volume': rng.integers(10_000, 5_000_000, len(tickers)),
+        'Dividend': np.nan, 'Shares Outstanding': np.exp(rng.normal(np.log(2e8), 1.0, len(tickers))).round()
+    })
+
+def write_simfin_bulk_files(data_dir, n_tickers, market='us', seed=0):
+    """
+    Writes {market}-{income,balance,cashflow}-{annual,quarterly}.csv and
+    {market}-shareprices-latest.csv in SimFin's bulk format (';'-separated)
+    into `data_dir`. The files are new, so sf.load_* reads them without downloading.
+
+    Returns:
+        list of str: The tickers in the files.
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    tickers = make_tickers(n_tickers)
+    for stmt_key in STATEMENT_COLUMNS:
+        for variant in ('annual', 'quarterly'):
+            frame = make_statement_frame(tickers, stmt_key, variant, seed)
+            frame.to_csv(os.path.join(data_dir, f'{market}-{stmt_key}-{variant}.csv'), sep=';', index=False,
+                         date_format='%Y-%m-%d')
+    make_shareprices_latest_frame(tickers, seed).to_csv(
+        os.path.join(data_dir, f'{market}-shareprices-latest.csv'), sep=';', index=False, date_format='%Y-%m-%d')
+    return tickers
+
+#---------------------------------------------------------------------------------------------
+
+def make_price_history(n_bars, seed=0, end=LAST_PRICE_DATE):
+    """Daily bars shaped like yfinance's Ticker.history() (tz-aware index, OHLCV, Dividends, Stock Splits)."""
+    rng = np.random.default_rng([seed, n_bars])
+    index = pd.bdate_range(end=end, periods=n_bars, tz='America/New_York', name='Date')
+    close = 100 * np.exp(np.cumsum(rng.normal(0.0003, 0.015, n_bars)))
+    open_ = close * np.exp(rng.normal(0, 0.005, n_bars))
+    spread = np.abs(rng.normal(0, 0.01, n_bars))
+    return pd.DataFrame({
+        'Open': open_, 'High': np.maximum(open_, close) * (1 + spread), 'Low': np.minimum(open_, close) * (1 - spread),
+        'Close': close, 'Volume': rng.integers(100_000, 10_000_000, n_bars), 'Dividends': 0.0, 'Stock Splits': 0.0
+    }, index=index)
@@ -0,0 +1,128 @@
+# chart_cache.py
+import base64
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import plotly.utils
+
+from request_timing import STAGE_SERIALIZE, timed_stage
+
+DEFAULT_CHART_CACHE_MAX_ENTRIES = 512
+
+#---------------------------------------------------------------------------------------------
+
+def make_etag(*parts):
+    """Stable hash of JSON-serializable parts, used as an HTTP entity tag."""
+    serialized = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha1(serialized.encode('utf-8')).hexdigest()
+
+def _compact_array(value):
+    """
+    Compact JSON form of one trace array: numeric arrays become plotly.js typed
+    arrays ({"dtype", "bdata"} - base64 of the raw little-endian values), date
+    arrays become plain date strings. Anything else is returned unchanged.
+    """
+    if not isinstance(value, np.ndarray) or value.ndim != 1 or value.size == 0:
+        return value
+    if value.dtype.kind == 'f' or (value.dtype.kind in 'iu' and np.abs(value).max() < 2 ** 53):
+        return {'dtype': 'f8', 'bdata': base64.b64encode(value.astype('<f8').tobytes()).decode('ascii')}
+    if value.dtype.kind == 'M' or (value.dtype.kind == 'O' and isinstance(value[0], pd.Timestamp)):
+        try:
+            dates = pd.DatetimeIndex(value)
+        except (TypeError, ValueError):
+            return value
+        date_format = '%Y-%m-%d' if (dates == dates.normalize()).all() else '%Y-%m-%dT%H:%M:%S'
+        return dates.strftime(date_format).tolist()
+    return value
+
+@timed_stage(STAGE_SERIALIZE)
+def serialize_chart(chart):
+    """
+    Serializes a {"data": traces, "layout": layout} chart dict to JSON, sending
+    the trace arrays as typed arrays instead of PlotlyJSONEncoder number lists.
+    """
+    data = []
+    for trace in chart['data']:
+        trace_json = trace.to_plotly_json() if hasattr(trace, 'to_plotly_json') else dict(trace)
+        data.append({key: _compact_array(value) for key, value in trace_json.items()})
+    return json.dumps({'data': data, 'layout': chart['layout']}, cls=plotly.utils.PlotlyJSONEncoder)
+
+
+class ChartPayload:
+    """A serialized Plotly figure plus the validators sent with it."""
+
+    __slots__ = ('json', 'etag', 'last_modified')
+
+    def __init__(self, json_str, last_modified=None):
+        self.json = json_str
+        self.etag = hashlib.sha1(json_str.encode('utf-8')).hexdigest()
+        self.last_modified = last_modified
+
+
+class ChartPayloadCache:
+    """
+    LRU cache of serialized chart payloads keyed by (ticker, chart kind, data version).
+
+    The data version changes whenever a ticker's statements or prices are
+    refreshed, so stale payloads are never served; they just age out of the LRU.
+    """
+
+    def __init__(self, max_entries=DEFAULT_CHART_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._payloads = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_build(self, ticker, chart_kind, data_version, build_chart, last_modified=None):
+        """
+        Returns the cached payload, or builds it with `build_chart()` (which returns
+        a chart dict or {"error": ...}) and caches it. Errors are not cached, and
+        nothing is cached when `data_version` is None.
+
+        Returns:
+            tuple: (ChartPayload or None, error message or None)
+        """
+        key = (ticker.upper(), chart_kind, data_version)
+        if data_version is not None:
+            with self._lock:
+                payload = self._payloads.get(key)
+                if payload is not None:
+                    self._payloads.move_to_end(key)
+                    self.hits += 1
+                    return payload, None
+                self.misses += 1
+
+        chart = build_chart()
+        if not chart:
+            return None, None
+        if "error" in chart:
+            return None, chart["error"]
+
+        payload = ChartPayload(serialize_chart(chart), last_modified)
+        if data_version is not None:
+            with self._lock:
+                self._payloads[key] = payload
+                self._payloads.move_to_end(key)
+                while len(self._payloads) > self.max_entries:
+                    self._payloads.popitem(last=False)
+        return payload, None
+
+    def invalidate(self, ticker=None):
+        """Drops the cached payloads of `ticker` (all payloads if None)."""
+        with self._lock:
+            for key in list(self._payloads.keys()):
+                if ticker is None or key[0] == ticker.upper():
+                    del self._payloads[key]
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._payloads), 'max_entries': self.max_entries,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+chart_payload_cache = ChartPayloadCache()
@@ -0,0 +1,322 @@
+# columnar_cache.py
+"""
+Columnar (Arrow IPC) copies of the SimFin bulk datasets and of the tables
+derived from them, shared by every process on the machine.
+
+A dataset is built by one process at a time: the builder holds an exclusive
+file lock while it loads and writes, and the others wait on the lock and then
+open what it published. Every publish writes a new, never-modified .arrow file
+and then atomically swaps the .json sidecar that points to it, so readers
+always see a complete file. Readers memory-map the file, so all worker
+processes share one copy of the data in the OS page cache instead of holding
+their own pandas copy.
+"""
+import json
+import os
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+import simfin as sf
+
+from simfin_setup import ensure_simfin_configured
+
+try:
+    import pyarrow as pa
+except ImportError: # pyarrow הוא תלות אופציונלית - בלעדיו נשארים עם טעינת ה-CSV של SimFin
+    pa = None
+
+try:
+    import fcntl
+except ImportError: # Windows - בלי נעילה בין תהליכים; כל תהליך עלול לבנות בעצמו, הפרסום עדיין אטומי
+    fcntl = None
+
+COLUMNAR_CACHE_FORMAT_VERSION = 2
+
+#---------------------------------------------------------------------------------------------
+
+def is_available():
+    return pa is not None
+
+def get_columnar_cache_dir():
+    ensure_simfin_configured()
+    return os.path.join(sf.get_data_dir(), 'columnar')
+
+def get_dataset_name(stmt_key, variant, market='us'):
+    return f"{market}-{stmt_key}-{variant}"
+
+def get_meta_path(dataset_name):
+    """Path of the .json sidecar that names the currently published .arrow file of a dataset."""
+    return os.path.join(get_columnar_cache_dir(), f"{dataset_name}.json")
+
+def read_columnar_meta(meta_path):
+    try:
+        with open(meta_path, 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+def _read_published_meta(dataset_name):
+    """The sidecar of a dataset plus the full path of its .arrow file, or None if nothing usable is published."""
+    meta = read_columnar_meta(get_meta_path(dataset_name))
+    if meta is None or meta.get('format_version') != COLUMNAR_CACHE_FORMAT_VERSION or not meta.get('arrow_file'):
+        return None
+    arrow_path = os.path.join(get_columnar_cache_dir(), meta['arrow_file'])
+    if not os.path.exists(arrow_path):
+        return None
+    return {**meta, 'arrow_path': arrow_path}
+
+@contextmanager
+def publish_lock(dataset_name):
+    """
+    Exclusive inter-process lock (flock on <columnar>/<dataset>.lock) held while
+    a dataset is loaded and published. Whoever gets it first builds; the others
+    block here and should then re-check for a fresh published copy.
+    """
+    cache_dir = get_columnar_cache_dir()
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(os.path.join(cache_dir, f"{dataset_name}.lock"), 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+@contextmanager
+def try_exclusive_lock(lock_name):
+    """
+    Non-blocking inter-process lock (flock on <columnar>/<lock_name>.lock): yields
+    True if this process got it, False if another process holds it. Without
+    fcntl every process gets it.
+    """
+    cache_dir = get_columnar_cache_dir()
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(os.path.join(cache_dir, f"{lock_name}.lock"), 'a') as lock_file:
+        if fcntl is None:
+            yield True
+            return
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+def _publish_table(table, dataset_name, meta):
+    """
+    Writes `table` to a new uncompressed Arrow IPC file (so it can be memory-mapped)
+    and atomically points the dataset's sidecar at it. Older files of the dataset
+    are then deleted; processes that still map them keep reading them until they reopen.
+    """
+    cache_dir = get_columnar_cache_dir()
+    os.makedirs(cache_dir, exist_ok=True)
+    arrow_file = f"{dataset_name}.{time.time_ns()}-{os.getpid()}.arrow"
+    arrow_path = os.path.join(cache_dir, arrow_file)
+
+    # קודם כותבים לקובץ זמני ורק אז מחליפים, כדי שתהליך אחר לא יקרא קובץ חצי-כתוב
+    tmp_arrow_path = f"{arrow_path}.tmp"
+    with pa.OSFile(tmp_arrow_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_arrow_path, arrow_path)
+
+    meta_path = get_meta_path(dataset_name)
+    tmp_meta_path = f"{meta_path}.{os.getpid()}.tmp"
+    with open(tmp_meta_path, 'w') as f:
+        json.dump({**meta, 'format_version': COLUMNAR_CACHE_FORMAT_VERSION, 'arrow_file': arrow_file,
+                   'num_rows': table.num_rows}, f)
+    os.replace(tmp_meta_path, meta_path)
+
+    for file_name in os.listdir(cache_dir):
+        if file_name.startswith(f"{dataset_name}.") and file_name.endswith('.arrow') and file_name != arrow_file:
+            try:
+                os.remove(os.path.join(cache_dir, file_name))
+            except OSError: # ב-Windows קובץ ממופה לא ניתן למחיקה - יימחק בפרסום הבא
+                pass
+    return arrow_path
+
+def _ticker_row_ranges(flat_df):
+    """{ticker: [start, stop]} for a frame whose rows are grouped by Ticker, or None if they are not."""
+    if 'Ticker' not in flat_df.columns:
+        return None
+    tickers = flat_df['Ticker']
+    if not tickers.is_monotonic_increasing:
+        return None
+    # אחרי המיון כל טיקר תופס טווח שורות רציף אחד
+    return {str(ticker): [int(positions[0]), int(positions[-1]) + 1]
+            for ticker, positions in flat_df.groupby('Ticker', sort=False).indices.items()}
+
+#---------------------------------------------------------------------------------------------
+
+def write_columnar_dataset(df_all, stmt_key, variant, market, source_signature):
+    """
+    Publishes a whole-market SimFin DataFrame as an Arrow file with its rows sorted by Ticker.
+
+    Args:
+        df_all (pd.DataFrame): The dataset as returned by sf.load_*.
+        stmt_key (str): 'income', 'balance', 'cashflow' or 'shareprices'.
+        variant (str): 'annual' or 'quarterly' ('latest' or 'daily' for shareprices).
+        market (str): The market (e.g., 'us').
+        source_signature (tuple): (mtime_ns, size) of the source file the data was loaded from.
+
+    Returns:
+        str: Path of the written .arrow file.
+    """
+    index_names = [name for name in df_all.index.names if name is not None]
+    flat_df = df_all.reset_index() if index_names else df_all.reset_index(drop=True)
+    if 'Ticker' in flat_df.columns:
+        flat_df = flat_df.sort_values('Ticker', kind='stable').reset_index(drop=True)
+
+    table = pa.Table.from_pandas(flat_df, preserve_index=False)
+    ticker_rows = _ticker_row_ranges(flat_df)
+    meta = {
+        'source_signature': list(source_signature) if source_signature else None,
+        'index_names': index_names,
+        'has_ticker_column': ticker_rows is not None,
+        'tickers': ticker_rows or {}
+    }
+    return _publish_table(table, get_dataset_name(stmt_key, variant, market), meta)
+
+def _read_fresh_meta(stmt_key, variant, market, source_signature):
+    meta = _read_published_meta(get_dataset_name(stmt_key, variant, market))
+    if meta is None or source_signature is None or meta.get('source_signature') != list(source_signature):
+        return None
+    return meta
+
+def is_columnar_dataset_fresh(stmt_key, variant, market, source_signature):
+    """True if a columnar copy built from the file with `source_signature` is published."""
+    return _read_fresh_meta(stmt_key, variant, market, source_signature) is not None
+
+def open_columnar_dataset(stmt_key, variant, market, source_signature):
+    """
+    Opens the memory-mapped columnar copy of a dataset if it exists and was built
+    from the file that currently has `source_signature`.
+
+    Returns:
+        ArrowTickerDataset, or None if there is no fresh copy.
+    """
+    meta = _read_fresh_meta(stmt_key, variant, market, source_signature)
+    if meta is None:
+        return None
+    return ArrowTickerDataset(meta['arrow_path'], meta)
+
+#---------------------------------------------------------------------------------------------
+
+def get_derived_dataset_name(table_name, market='us'):
+    """Dataset name of a table derived from the bulk datasets (e.g. screener metrics)."""
+    return get_dataset_name(table_name, 'derived', market)
+
+def write_derived_table(df, table_name, market, source_version):
+    """
+    Publishes a derived table as an Arrow file, tagged with the version of the
+    source datasets it was computed from (any JSON-serializable value).
+    """
+    index_names = [name for name in df.index.names if name is not None]
+    flat_df = df.reset_index() if index_names else df
+    table = pa.Table.from_pandas(flat_df, preserve_index=False)
+    ticker_rows = _ticker_row_ranges(flat_df)
+    meta = {
+        'source_version': json.loads(json.dumps(source_version)),
+        'index_names': index_names,
+        'has_ticker_column': ticker_rows is not None,
+        'tickers': ticker_rows or {}
+    }
+    return _publish_table(table, get_derived_dataset_name(table_name, market), meta)
+
+def _read_fresh_derived_meta(table_name, market, source_version):
+    meta = _read_published_meta(get_derived_dataset_name(table_name, market))
+    if meta is None or meta.get('source_version') != json.loads(json.dumps(source_version)):
+        return None
+    return meta
+
+def open_derived_table(table_name, market, source_version):
+    """
+    Memory-maps a derived table written by write_derived_table() if it was
+    computed from `source_version`; None if it is missing or stale.
+
+    Returns:
+        ArrowTickerDataset or None
+    """
+    meta = _read_fresh_derived_meta(table_name, market, source_version)
+    if meta is None:
+        return None
+    try:
+        return ArrowTickerDataset(meta['arrow_path'], meta)
+    except (IOError, pa.ArrowInvalid):
+        return None
+
+def read_derived_table(table_name, market, source_version):
+    """
+    Reads a derived table written by write_derived_table() into pandas if it
+    was computed from `source_version`; None if it is missing or stale.
+    """
+    table = open_derived_table(table_name, market, source_version)
+    return table.df_all if table is not None else None
+
+#---------------------------------------------------------------------------------------------
+
+class ArrowTickerDataset:
+    """
+    Same interface as statement_store.TickerIndexedDataset, backed by a
+    memory-mapped Arrow file. Only the rows of the requested ticker are
+    converted to pandas; the rest of the market stays in the OS page cache,
+    shared with every other process that maps the same file.
+    """
+
+    def __init__(self, arrow_path, meta):
+        self.arrow_path = arrow_path
+        self.index_names = meta.get('index_names', [])
+        self._source = pa.memory_map(arrow_path, 'r')
+        self.table = pa.ipc.open_file(self._source).read_all()
+        if meta.get('has_ticker_column'):
+            self.ticker_rows = {ticker: slice(start, stop) for ticker, (start, stop) in meta.get('tickers', {}).items()}
+        else:
+            self.ticker_rows = None
+
+    @property
+    def has_ticker_info(self):
+        return self.ticker_rows is not None
+
+    def tickers(self):
+        return list(self.ticker_rows.keys()) if self.has_ticker_info else []
+
+    def _table_to_frame(self, table):
+        df = table.to_pandas()
+        if self.index_names:
+            df = df.set_index(self.index_names)
+        return df
+
+    @property
+    def df_all(self):
+        """
+        The whole dataset as a pandas DataFrame. Built on every access and not
+        kept, so a process holds a private copy of the market only while it uses one.
+        """
+        return self._table_to_frame(self.table)
+
+    def get_rows(self, positions):
+        """The rows at `positions` (list of row numbers) as a DataFrame."""
+        return self._table_to_frame(self.table.take(pa.array(positions, type=pa.int64())))
+
+    def memory_report(self):
+        """Size of the mapped table; its pages live in the OS page cache, shared by every process that maps it."""
+        return {'backing': 'arrow-mmap', 'rows': self.table.num_rows, 'columns': self.table.num_columns,
+                'bytes': int(self.table.nbytes)}
+
+    def get_ticker(self, ticker):
+        if not self.has_ticker_info:
+            return None
+
+        rows = self.ticker_rows.get(ticker)
+        if rows is None:
+            return pd.DataFrame()
+
+        ticker_df = self._table_to_frame(self.table.slice(rows.start, rows.stop - rows.start))
+        if 'Ticker' in self.index_names and ticker_df.index.nlevels > 1:
+            ticker_df = ticker_df.droplevel('Ticker')
+        return ticker_df
@@ -0,0 +1,334 @@
+# derived_metrics.py
+"""
+Derived-metrics pipeline: TTM values, growth rates, margins and free cash flow
+for every ticker and every reported period, built once per bulk-dataset refresh.
+
+The whole market is processed with array operations on the Ticker-sorted
+statements (row shifts restricted to the same ticker), never per ticker. The
+result is persisted as a columnar file and served per ticker by an index lookup.
+"""
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import columnar_cache
+from statement_store import TickerIndexedDataset, get_dataset_signature, statement_store
+
+# לשנות כשנוסחאות המדדים משתנות, כדי שטבלאות שנשמרו בדיסק ייבנו מחדש
+DERIVED_METRICS_VERSION = 2
+
+# העמודה הראשונה שקיימת בנתונים היא זו שנבחרת - פעם אחת בבניית הטבלה ולא בכל בקשה
+REVENUE_COLUMN_OPTIONS = ['Revenue', 'Total Revenue', 'Sales']
+NET_INCOME_COLUMN_OPTIONS = ['Net Income (Common)', 'Net Income', 'Net Income Available to Common Shareholders']
+BASE_METRIC_SOURCES = {
+    'revenue': ('income', REVENUE_COLUMN_OPTIONS),
+    'gross_profit': ('income', ['Gross Profit']),
+    'operating_income': ('income', ['Operating Income (Loss)']),
+    'net_income': ('income', NET_INCOME_COLUMN_OPTIONS),
+    'operating_cash_flow': ('cashflow', ['Net Cash from Operating Activities']),
+    'capex': ('cashflow', ['Change in Fixed Assets & Intangibles']),
+    'depreciation': ('cashflow', ['Depreciation & Amortization'])
+}
+TTM_METRICS = ['revenue', 'gross_profit', 'operating_income', 'net_income', 'fcf', 'ebitda']
+MARGIN_METRICS = {'gross_margin': 'gross_profit', 'operating_margin': 'operating_income',
+                  'net_margin': 'net_income', 'fcf_margin': 'fcf'}
+
+# מרחק בימים בין סופי תקופות שנחשב רצוף: רבעון קודם, שלושה רבעונים אחורה (TTM), שנה אחורה
+PREVIOUS_QUARTER_DAYS = (75, 105)
+TTM_SPAN_DAYS = (250, 300)
+PREVIOUS_YEAR_DAYS = (340, 390)
+
+# הדוחות שמהם הטבלה נבנית
+SOURCE_STATEMENTS = ('income', 'cashflow')
+# בנייה ברקע שנכשלה (למשל הורדה) לא מתחילה שוב בכל בקשה
+BACKGROUND_BUILD_RETRY_SECONDS = 60
+
+#---------------------------------------------------------------------------------------------
+
+def resolve_column(df, options):
+    """The first of `options` that is a column of `df`, or None."""
+    return next((col for col in options if col in df.columns), None)
+
+def _shift_within_ticker(values, tickers, dates, periods, day_range):
+    """
+    `values` shifted down by `periods` rows, NaN where the earlier row belongs to
+    another ticker or its period end is not `day_range` days before this one.
+    Rows must be sorted by (Ticker, Report Date).
+    """
+    shifted = np.full(len(values), np.nan)
+    if periods >= len(values):
+        return shifted
+    same_ticker = tickers[periods:] == tickers[:-periods]
+    gap_days = (dates[periods:] - dates[:-periods]) / np.timedelta64(1, 'D')
+    valid = same_ticker & (gap_days >= day_range[0]) & (gap_days <= day_range[1])
+    shifted[periods:] = np.where(valid, values[:-periods], np.nan)
+    return shifted
+
+def _growth(current, previous):
+    return np.where(previous > 0, current / np.where(previous > 0, previous, 1.0) - 1.0, np.nan)
+
+def _ratio(numerator, denominator):
+    return np.where(denominator > 0, numerator / np.where(denominator > 0, denominator, 1.0), np.nan)
+
+def _positive_streak(values, tickers):
+    """Running count of consecutive periods with value > 0, restarting at every new ticker."""
+    positive = values > 0
+    new_ticker = np.concatenate(([True], tickers[1:] != tickers[:-1]))
+    block_id = np.cumsum(~positive | new_ticker)
+    block_start = np.flatnonzero(np.concatenate(([True], block_id[1:] != block_id[:-1])))
+    block_lengths = np.diff(np.append(block_start, len(values)))
+    position_in_block = np.arange(len(values)) - np.repeat(block_start, block_lengths)
+    # בלוק מתחיל בשורה לא-חיובית (שאינה נספרת) או בשורה הראשונה של טיקר (שנספרת אם היא חיובית)
+    streak = position_in_block + np.repeat(positive[block_start], block_lengths)
+    streak[~positive] = 0
+    return streak
+
+def compute_derived_metrics(income, cashflow, variant):
+    """
+    Builds the derived metrics of every ticker and period in one pass.
+
+    Args:
+        income, cashflow (pd.DataFrame): Whole-market statements as flat frames with
+            'Ticker' and 'Report Date' columns (cashflow may be None).
+        variant (str): 'quarterly' (adds TTM, QoQ and TTM-based metrics) or 'annual'.
+
+    Returns:
+        pd.DataFrame: Indexed by [Ticker, Report Date], sorted, one float column per metric.
+    """
+    keys = ['Ticker', 'Report Date']
+    sources = {'income': income, 'cashflow': cashflow}
+    frames = {}
+    for stmt_key, df in sources.items():
+        if df is None:
+            continue
+        columns = {metric: resolve_column(df, options) for metric, (source, options) in BASE_METRIC_SOURCES.items()
+                   if source == stmt_key}
+        frames[stmt_key] = df[keys + [col for col in columns.values() if col]].rename(
+            columns={col: metric for metric, col in columns.items() if col})
+    if 'income' not in frames:
+        return pd.DataFrame()
+
+    merged = frames['income']
+    if 'cashflow' in frames:
+        merged = merged.merge(frames['cashflow'], on=keys, how='left')
+    merged = merged.sort_values(keys, kind='stable').reset_index(drop=True)
+    merged = merged.reindex(columns=keys + list(BASE_METRIC_SOURCES))
+
+    tickers = merged['Ticker'].to_numpy(dtype=object)
+    dates = pd.to_datetime(merged['Report Date']).to_numpy(dtype='datetime64[ns]')
+    metrics = {metric: merged[metric].to_numpy(dtype=float) for metric in BASE_METRIC_SOURCES}
+    metrics['fcf'] = metrics['operating_cash_flow'] + np.nan_to_num(metrics['capex'])
+    # ב-SimFin פחת והפחתה בתזרים הוא תוספת חיובית; השקעות הוניות (capex) שליליות
+    metrics['ebitda'] = metrics['operating_income'] + np.nan_to_num(metrics['depreciation'])
+
+    def shift(values, periods, day_range):
+        return _shift_within_ticker(values, tickers, dates, periods, day_range)
+
+    quarterly = variant == 'quarterly'
+    year_periods = 4 if quarterly else 1
+
+    derived = {}
+    for metric in ('revenue', 'net_income'):
+        derived[f'{metric}_growth_yoy'] = _growth(metrics[metric], shift(metrics[metric], year_periods, PREVIOUS_YEAR_DAYS))
+    for margin, metric in MARGIN_METRICS.items():
+        derived[margin] = _ratio(metrics[metric], metrics['revenue'])
+    derived['positive_net_income_periods'] = _positive_streak(metrics['net_income'], tickers).astype(float)
+
+    if quarterly:
+        derived['revenue_growth_qoq'] = _growth(metrics['revenue'], shift(metrics['revenue'], 1, PREVIOUS_QUARTER_DAYS))
+        # TTM: הרבעון הנוכחי ושלושת הקודמים, רק כשהם רצופים (NaN באחד מהם נותן NaN)
+        ttm_span_ok = ~np.isnan(shift(np.zeros(len(tickers)), 3, TTM_SPAN_DAYS))
+        for metric in TTM_METRICS:
+            values = metrics[metric]
+            ttm = values + sum(shift(values, k, (0, TTM_SPAN_DAYS[1])) for k in (1, 2, 3))
+            derived[f'{metric}_ttm'] = np.where(ttm_span_ok, ttm, np.nan)
+        for metric in ('revenue', 'net_income'):
+            derived[f'{metric}_ttm_growth_yoy'] = _growth(derived[f'{metric}_ttm'],
+                                                          shift(derived[f'{metric}_ttm'], 4, PREVIOUS_YEAR_DAYS))
+        for margin, metric in MARGIN_METRICS.items():
+            derived[f'{margin}_ttm'] = _ratio(derived[f'{metric}_ttm'], derived['revenue_ttm'])
+
+    result = pd.DataFrame({**metrics, **derived})
+    result.insert(0, 'Ticker', tickers)
+    result.insert(1, 'Report Date', dates)
+    return result.set_index(keys)
+
+#---------------------------------------------------------------------------------------------
+
+def _load_flat_dataset(stmt_key, variant, market, store):
+    try:
+        dataset = store.get_dataset(stmt_key, variant, market)
+    except Exception as e: # למשל הורדה שנכשלה - הגרפים חוזרים לקובצי ה-CSV של הטיקר
+        print(f"derived_metrics.py: Could not load {market} {stmt_key} ({variant}): {e}")
+        return None
+    if dataset is None or not dataset.has_ticker_info:
+        return None
+    df_all = dataset.df_all
+    return df_all.reset_index() if 'Ticker' in df_all.index.names else df_all
+
+
+class DerivedMetricsStore:
+    """
+    The derived-metrics tables ('annual' and 'quarterly') of each market.
+
+    A table is rebuilt only when its source statements change on disk; it is
+    published as a columnar file that other processes and restarts memory-map
+    instead of rebuilding. Lookups of one ticker go through a Ticker index.
+
+    Each (variant, market) table has its own lock. A build that needs SimFin to
+    download a source dataset never runs on the caller's thread unless it asks
+    for it (`download=True`): it is started in the background and the caller
+    gets the previous table, or None until the first one is ready.
+    """
+
+    def __init__(self, store=None):
+        self.store = store or statement_store
+        self._tables = {}
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._background_builds = {}
+        self.last_build_seconds = {}
+
+    def _lock_for(self, key):
+        with self._locks_guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def version(self, variant, market='us'):
+        """Version of a derived table: the metrics version and the signatures of its source datasets."""
+        signatures = [get_dataset_signature(stmt_key, variant, market) for stmt_key in SOURCE_STATEMENTS]
+        return [DERIVED_METRICS_VERSION] + [list(signature) if signature else None for signature in signatures]
+
+    def requires_download(self, variant, market='us'):
+        """True if building the table would have SimFin download one of its source datasets."""
+        return any(self.store.requires_download(stmt_key, variant, market) for stmt_key in SOURCE_STATEMENTS)
+
+    def get_table(self, variant, market='us', download=False):
+        """
+        Returns the derived table of a market, indexed by [Ticker, Report Date]: the
+        memory-mapped published copy (ArrowTickerDataset) when pyarrow is installed,
+        else a TickerIndexedDataset. None if the statements could not be loaded, or
+        (without `download`) while their download runs in the background.
+        """
+        key = (variant, market)
+        with self._lock_for(key):
+            version = self.version(variant, market)
+            cached = self._tables.get(key)
+            if cached is not None and cached[0] == version:
+                return cached[1]
+
+            table_name = f'metrics_{variant}'
+            use_columnar = columnar_cache.is_available() and None not in version
+            table = columnar_cache.open_derived_table(table_name, market, version) if use_columnar else None
+            if table is None:
+                if not download and self.requires_download(variant, market):
+                    # ההורדה לא רצה בתוך בקשה: הבנייה עוברת לרקע, ועד אז הטבלה הקודמת (אם יש)
+                    self._start_background_build(variant, market)
+                    return cached[1] if cached is not None else None
+                if use_columnar:
+                    # תהליך אחד בונה ומפרסם; האחרים ממפים את הקובץ שפורסם במקום לבנות בעצמם
+                    with columnar_cache.publish_lock(columnar_cache.get_derived_dataset_name(table_name, market)):
+                        version = self.version(variant, market)
+                        table = columnar_cache.open_derived_table(table_name, market, version)
+                        if table is None:
+                            table, version = self._build_table(variant, market, publish=True)
+                else:
+                    table, version = self._build_table(variant, market, publish=False)
+            if table is None:
+                return None
+            self._tables[key] = (version, table)
+            return table
+
+    def _start_background_build(self, variant, market):
+        """Builds a table (downloading its sources) on a daemon thread, one at a time per table."""
+        key = (variant, market)
+        with self._locks_guard:
+            running = self._background_builds.get(key)
+            if running is not None and (running[0].is_alive() or
+                                        time.monotonic() - running[1] < BACKGROUND_BUILD_RETRY_SECONDS):
+                return running[0]
+            thread = threading.Thread(target=self._run_background_build, args=(variant, market),
+                                      name=f'derived-metrics-{market}-{variant}', daemon=True)
+            self._background_builds[key] = (thread, time.monotonic())
+        thread.start()
+        return thread
+
+    def _run_background_build(self, variant, market):
+        try:
+            if self.get_table(variant, market, download=True) is None:
+                print(f"derived_metrics.py: {market} {variant} statements are not available.")
+        except Exception as e:
+            print(f"derived_metrics.py: Could not build {market} {variant} metrics: {e}")
+
+    def _build_table(self, variant, market, publish):
+        """Computes a derived table; returns (dataset, version), dataset None if the statements are unavailable."""
+        income = _load_flat_dataset('income', variant, market, self.store)
+        if income is None:
+            return None, None
+        started = time.perf_counter()
+        metrics = compute_derived_metrics(income, _load_flat_dataset('cashflow', variant, market, self.store), variant)
+        self.last_build_seconds[(variant, market)] = time.perf_counter() - started
+        version = self.version(variant, market)
+        if publish:
+            table_name = f'metrics_{variant}'
+            try:
+                columnar_cache.write_derived_table(metrics, table_name, market, version)
+                table = columnar_cache.open_derived_table(table_name, market, version)
+                if table is not None:
+                    return table, version
+            except Exception as e:
+                print(f"derived_metrics.py: Could not persist {market} {variant} metrics: {e}")
+        return TickerIndexedDataset(metrics), version
+
+    def get_ticker_metrics(self, ticker, variant, market='us', download=False):
+        """
+        One ticker's derived series indexed by Report Date, an empty DataFrame if
+        the ticker is not in the data, or None if the table is unavailable.
+        """
+        table = self.get_table(variant, market, download)
+        if table is None:
+            return None
+        return table.get_ticker(ticker.upper().strip())
+
+    def get_tickers_metrics(self, tickers, variant, market='us', download=False):
+        """
+        The derived series of several tickers in one lookup: their rows are found
+        in the Ticker index and read with a single get_rows() call.
+
+        Returns:
+            tuple: (DataFrame indexed by [Ticker, Report Date] - None if the table is
+                    unavailable, empty if no ticker was found; list of the tickers not in the data)
+        """
+        table = self.get_table(variant, market, download)
+        if table is None:
+            return None, list(tickers)
+        positions, missing = [], []
+        for ticker in tickers:
+            rows = table.ticker_rows.get(ticker.upper().strip())
+            if rows is None:
+                missing.append(ticker)
+            else:
+                positions.extend(range(rows.start, rows.stop) if isinstance(rows, slice) else rows)
+        if not positions:
+            return pd.DataFrame(), missing
+        return table.get_rows(positions), missing
+
+    def latest_by_ticker(self, variant, market='us', download=False):
+        """The most recent row of every ticker, indexed by Ticker (None if unavailable)."""
+        table = self.get_table(variant, market, download)
+        if table is None:
+            return None
+        last_rows = [rows.stop - 1 if isinstance(rows, slice) else rows[-1] for rows in table.ticker_rows.values()]
+        return table.get_rows(last_rows).droplevel('Report Date')
+
+    def refresh(self, market='us'):
+        """Builds (or loads) both tables, downloading what is missing; meant for the refresh and ingest jobs."""
+        return {variant: self.get_table(variant, market, download=True) is not None for variant in ('annual', 'quarterly')}
+
+    def invalidate(self):
+        with self._locks_guard:
+            self._tables.clear()
+
+
+derived_metrics_store = DerivedMetricsStore()
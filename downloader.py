@@ -1,14 +1,21 @@
 # downloader.py
-import simfin as sf
-import pandas as pd
-import time # להשהיות
-import yfinance as yf
+from concurrent.futures import ThreadPoolExecutor
+
+from price_store import price_store
+from rate_limiter import TokenBucket
+from request_timing import STAGE_LOAD, timed_stage
+from statement_store import statement_store
 
 #---------------------------------------------------------------------------------------------
 
+@timed_stage(STAGE_LOAD)
 def download_price_history_with_mavg(ticker_symbol, period="10y", interval="1d", moving_averages=None):
     """
     Downloads historical price data for a ticker and calculates specified moving averages.
+    Bars come from the persistent PriceStore, which only fetches what is newer than
+    the stored history and keeps the MA columns updated incrementally (see
+    moving_averages.py). MAs are computed over the whole stored history, so the
+    first rows of the requested period already have values.
 
     Args:
         ticker_symbol (str): The stock ticker.
@@ -22,18 +29,12 @@ def download_price_history_with_mavg(ticker_symbol, period="10y", interval="1d",
     """
     # print(f"downloader.py: Downloading price history for {ticker_symbol} (period: {period}, interval: {interval})") # הוסר
     try:
-        ticker = yf.Ticker(ticker_symbol)
-        hist_df = ticker.history(period=period, interval=interval)
+        hist_df = price_store.get_history(ticker_symbol, period=period, interval=interval, moving_averages=moving_averages)
 
         if hist_df.empty:
             print(f"downloader.py: No price history found for {ticker_symbol} with period {period}, interval {interval}.") # נשאר - מידע חשוב
             return None
 
-        if moving_averages:
-            for ma in moving_averages:
-                if isinstance(ma, int) and ma > 0:
-                    hist_df[f'MA{ma}'] = hist_df['Close'].rolling(window=ma).mean()
-        
         # print(f"downloader.py: Price history for {ticker_symbol} downloaded and MAs calculated.") # הוסר
         return hist_df
     except Exception as e:
@@ -41,10 +42,70 @@ def download_price_history_with_mavg(ticker_symbol, period="10y", interval="1d",
         return None
 #---------------------------------------------------------------------------------------------
 
+STATEMENT_VARIANTS = ['annual', 'quarterly']
+STATEMENT_TYPES = ['income', 'balance', 'cashflow']
+STATEMENT_TYPE_READABLE_NAMES = {
+    'income': 'Income Statement',
+    'balance': 'Balance Sheet',
+    'cashflow': 'Cash Flow Statement'
+}
+
+# מגבלת קצב להורדות אמיתיות מהשרת של SimFin (במקום time.sleep קבוע לפני כל טעינה)
+SIMFIN_DOWNLOADS_PER_SECOND = 2.0
+SIMFIN_DOWNLOAD_BURST = 1
+STATEMENT_FETCH_MAX_WORKERS = 6
+
+simfin_download_limiter = TokenBucket(SIMFIN_DOWNLOADS_PER_SECOND, SIMFIN_DOWNLOAD_BURST)
+
+def configure_simfin_rate_limit(downloads_per_second, burst=1):
+    """Replaces the token bucket that throttles real SimFin network downloads."""
+    global simfin_download_limiter
+    simfin_download_limiter = TokenBucket(downloads_per_second, burst)
+
+def _fetch_statement_for_ticker(stmt_key, variant, ticker_symbol, market):
+    """
+    Loads one (statement, variant) dataset through the StatementStore and
+    returns the ticker's rows, or an error dictionary.
+    """
+    ticker_upper = ticker_symbol.upper()
+    result_key = f"{stmt_key}_{variant}"
+    readable_name = STATEMENT_TYPE_READABLE_NAMES[stmt_key]
+    # print(f"downloader.py: Processing {readable_name} ({variant}) for {ticker_upper}...") # הוסר
+
+    try:
+        if statement_store.requires_download(stmt_key, variant, market):
+            simfin_download_limiter.acquire() # רק הורדות רשת מוגבלות בקצב, לא קבצים מקומיים
+
+        dataset = statement_store.get_dataset(stmt_key, variant, market)
+
+        if dataset is None:
+            print(f"downloader.py: LoadFailed for ALL {result_key} for {ticker_symbol}") # נשאר - שגיאה חשובה
+            return {"Error": "LoadFailed", "Details": f"Failed to load ALL {readable_name} ({variant}) (SimFin returned None)."}
+
+        if not dataset.has_ticker_info:
+            # print(f"downloader.py: FilterFailed for {result_key}") # הוסר (המידע קיים ב-results)
+            return {"Error": "FilterFailed", "Details": f"Could not find 'Ticker' info in {readable_name} ({variant}) dataset."}
+
+        current_df = dataset.get_ticker(ticker_upper)
+        if current_df.empty:
+            # print(f"downloader.py: NoDataFound for {result_key}") # הוסר (המידע קיים ב-results)
+            return {"Error": "NoDataFound", "Details": f"No {readable_name} ({variant}) data for {ticker_symbol} (DataFrame empty after filter)."}
+
+        # print(f"downloader.py: {result_key} for {ticker_symbol} processed successfully.") # הוסר
+        return current_df.copy()
+
+    except Exception as e:
+        print(f"downloader.py: Exception for {result_key} for {ticker_symbol}: {e}") # נשאר - שגיאה חשובה
+        return {"Error": "ProcessingException", "Details": str(e)}
+
+@timed_stage(STAGE_LOAD)
 def download_financial_statements(ticker_symbol, market='us'):
     """
     Downloads ANNUAL and QUARTERLY financial statements (income, balance, cashflow)
-    for a specific ticker. Uses the 'filtering after full load' approach.
+    for a specific ticker. The full-market datasets are loaded once per process by
+    the shared StatementStore and the ticker's rows are looked up in its index.
+    The six (statement, variant) loads run concurrently; only loads that hit the
+    SimFin server are throttled by `simfin_download_limiter`.
 
     Args:
         ticker_symbol (str): The stock ticker.
@@ -55,58 +116,15 @@ def download_financial_statements(ticker_symbol, market='us'):
               and values are DataFrames or error dictionaries.
     """
     # print(f"downloader.py: Attempting to download ALL (Annual & Quarterly) statements for {ticker_symbol}...") # הוסר
-    results = {}
-    ticker_upper = ticker_symbol.upper()
-    variants = ['annual', 'quarterly']
-    statement_types_map = {
-        'income': sf.load_income,
-        'balance': sf.load_balance,
-        'cashflow': sf.load_cashflow
-    }
-    statement_type_readable_names = {
-        'income': 'Income Statement',
-        'balance': 'Balance Sheet',
-        'cashflow': 'Cash Flow Statement'
-    }
-
-    for variant in variants:
-        for stmt_key, load_function in statement_types_map.items():
-            result_key = f"{stmt_key}_{variant}"
-            readable_name = statement_type_readable_names[stmt_key]
-            # print(f"downloader.py: Processing {readable_name} ({variant}) for {ticker_upper}...") # הוסר
-            time.sleep(0.5)
-
-            try:
-                df_all = load_function(variant=variant, market=market)
-                
-                current_df = None
-                if df_all is not None:
-                    if 'Ticker' in df_all.index.names:
-                        if ticker_upper in df_all.index.get_level_values('Ticker'):
-                            current_df = df_all.loc[ticker_upper]
-                        else:
-                            current_df = pd.DataFrame()
-                    elif 'Ticker' in df_all.columns:
-                        current_df = df_all[df_all['Ticker'] == ticker_upper]
-                    else:
-                        results[result_key] = {"Error": "FilterFailed", "Details": f"Could not find 'Ticker' info in {readable_name} ({variant}) dataset."}
-                        # print(f"downloader.py: FilterFailed for {result_key}") # הוסר (המידע קיים ב-results)
-                        continue
-
-                    if current_df is not None:
-                        if not current_df.empty:
-                            results[result_key] = current_df.copy()
-                            # print(f"downloader.py: {result_key} for {ticker_symbol} processed successfully.") # הוסר
-                        else:
-                            results[result_key] = {"Error": "NoDataFound", "Details": f"No {readable_name} ({variant}) data for {ticker_symbol} (DataFrame empty after filter)."}
-                            # print(f"downloader.py: NoDataFound for {result_key}") # הוסר (המידע קיים ב-results)
-                else:
-                    results[result_key] = {"Error": "LoadFailed", "Details": f"Failed to load ALL {readable_name} ({variant}) (SimFin returned None)."}
-                    print(f"downloader.py: LoadFailed for ALL {result_key} for {ticker_symbol}") # נשאר - שגיאה חשובה
-
-            except Exception as e:
-                print(f"downloader.py: Exception for {result_key} for {ticker_symbol}: {e}") # נשאר - שגיאה חשובה
-                results[result_key] = {"Error": "ProcessingException", "Details": str(e)}
-                
+    jobs = [(stmt_key, variant) for variant in STATEMENT_VARIANTS for stmt_key in STATEMENT_TYPES]
+
+    with ThreadPoolExecutor(max_workers=min(STATEMENT_FETCH_MAX_WORKERS, len(jobs))) as executor:
+        futures = {
+            f"{stmt_key}_{variant}": executor.submit(_fetch_statement_for_ticker, stmt_key, variant, ticker_symbol, market)
+            for stmt_key, variant in jobs
+        }
+        # הסדר של המפתחות נשמר כמו בלולאה הסדרתית המקורית
+        results = {result_key: future.result() for result_key, future in futures.items()}
+
     # print(f"downloader.py: Finished all download attempts for {ticker_symbol}.") # הוסר
-    return results
\ No newline at end of file
+    return results
@@ -0,0 +1,143 @@
+# downsample.py
+import numpy as np
+import pandas as pd
+
+DEFAULT_TARGET_POINTS = 800
+MAX_TARGET_POINTS = 3000
+
+#---------------------------------------------------------------------------------------------
+
+def _bucket_starts(n_rows, n_buckets):
+    """Start positions of `n_buckets` near-equal consecutive buckets over `n_rows` rows."""
+    bucket_ids = (np.arange(n_rows) * n_buckets) // n_rows
+    return np.flatnonzero(np.diff(bucket_ids, prepend=-1))
+
+def aggregate_ohlc_buckets(df, n_buckets):
+    """
+    Merges consecutive bars into `n_buckets` candles that keep the real extremes:
+    first Open, max High, min Low, last Close, summed Volume. Each candle is
+    dated at its first bar.
+
+    Args:
+        df (pd.DataFrame): Bars with Open/High/Low/Close (and optionally Volume), sorted by date.
+        n_buckets (int): Number of candles wanted.
+
+    Returns:
+        pd.DataFrame: The bucketed bars (`df` itself if it is already small enough).
+    """
+    n_rows = len(df)
+    if n_rows <= n_buckets or n_buckets < 1:
+        return df[[col for col in ('Open', 'High', 'Low', 'Close', 'Volume') if col in df.columns]]
+
+    starts = _bucket_starts(n_rows, n_buckets)
+    ends = np.append(starts[1:], n_rows) - 1
+    columns = {
+        'Open': df['Open'].to_numpy(dtype=float)[starts],
+        'High': np.fmax.reduceat(df['High'].to_numpy(dtype=float), starts),
+        'Low': np.fmin.reduceat(df['Low'].to_numpy(dtype=float), starts),
+        'Close': df['Close'].to_numpy(dtype=float)[ends],
+    }
+    if 'Volume' in df.columns:
+        columns['Volume'] = np.add.reduceat(np.nan_to_num(df['Volume'].to_numpy(dtype=float)), starts)
+    return pd.DataFrame(columns, index=df.index[starts])
+
+def lttb_indices(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets: picks `n_out` points of a line that best keep
+    its visual shape. Always keeps the first and last point.
+
+    Args:
+        x (np.ndarray): Increasing numeric x values.
+        y (np.ndarray): y values (no NaN).
+        n_out (int): Number of points to keep.
+
+    Returns:
+        np.ndarray: Positions of the selected points.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    # n_out-2 דליים בין הנקודה הראשונה לאחרונה
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    previous = 0
+    for i in range(n_out - 2):
+        start, stop = edges[i], edges[i + 1]
+        next_start, next_stop = edges[i + 1], (edges[i + 2] if i + 2 < len(edges) else n)
+        avg_x = x[next_start:next_stop].mean()
+        avg_y = y[next_start:next_stop].mean()
+        bucket_x, bucket_y = x[start:stop], y[start:stop]
+        areas = np.abs((x[previous] - avg_x) * (bucket_y - y[previous]) - (x[previous] - bucket_x) * (avg_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        selected[i + 1] = previous
+    return selected
+
+def lttb_series(series, n_out):
+    """LTTB-decimates a date-indexed Series, ignoring NaN (e.g. the start of an MA)."""
+    series = series.dropna()
+    if len(series) <= n_out:
+        return series
+    x = series.index.asi8.astype(float)
+    positions = lttb_indices(x, series.to_numpy(dtype=float), n_out)
+    return series.iloc[positions]
+
+def downsample_prices(df, target_points=DEFAULT_TARGET_POINTS, ma_columns=None, start=None, end=None):
+    """
+    Cuts price bars to [start, end] and reduces them to about `target_points`:
+    OHLC bucket aggregation for the candles, LTTB for every moving-average line.
+
+    Returns:
+        dict: {'candles': DataFrame, 'moving_averages': {column: Series},
+               'total_bars': int, 'bucketed': bool}
+    """
+    target_points = max(3, min(int(target_points), MAX_TARGET_POINTS))
+    if start is not None:
+        df = df[df.index >= _align_timestamp(start, df.index)]
+    if end is not None:
+        df = df[df.index <= _align_timestamp(end, df.index)]
+
+    candles = aggregate_ohlc_buckets(df, target_points)
+    moving_averages = {
+        column: lttb_series(df[column], target_points)
+        for column in (ma_columns or []) if column in df.columns
+    }
+    return {
+        'candles': candles,
+        'moving_averages': moving_averages,
+        'total_bars': len(df),
+        'bucketed': len(candles) < len(df)
+    }
+
+def _align_timestamp(value, index):
+    timestamp = pd.Timestamp(value)
+    if getattr(index, 'tz', None) is not None and timestamp.tz is None:
+        timestamp = timestamp.tz_localize(index.tz)
+    elif getattr(index, 'tz', None) is None and timestamp.tz is not None:
+        timestamp = timestamp.tz_localize(None)
+    return timestamp
+
+#---------------------------------------------------------------------------------------------
+
+def _to_json_list(values):
+    return [None if pd.isna(value) else float(value) for value in values]
+
+def _to_date_list(index):
+    return [timestamp.strftime('%Y-%m-%d') for timestamp in index]
+
+def price_payload_to_json(payload):
+    """Plain-JSON form of a downsample_prices() result (NaN -> null, dates as YYYY-MM-DD)."""
+    candles = payload['candles']
+    return {
+        'total_bars': payload['total_bars'],
+        'bucketed': payload['bucketed'],
+        'candles': {
+            'x': _to_date_list(candles.index),
+            **{column.lower(): _to_json_list(candles[column]) for column in candles.columns}
+        },
+        'moving_averages': [
+            {'name': column, 'x': _to_date_list(series.index), 'y': _to_json_list(series)}
+            for column, series in payload['moving_averages'].items()
+        ]
+    }
@@ -0,0 +1,86 @@
+# frame_cache.py
+import threading
+from collections import OrderedDict
+
+DEFAULT_FRAME_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+#---------------------------------------------------------------------------------------------
+
+def frame_cache_key(ticker, statement_key, variant):
+    return (ticker.upper(), statement_key, variant)
+
+def estimate_frame_bytes(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class FrameCache:
+    """
+    Server-side LRU cache of parsed statement DataFrames keyed by
+    (ticker, statement, variant), bounded by an approximate memory budget.
+    Cached frames are shared between requests and must be treated as read-only.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_FRAME_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._frames = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def set_max_bytes(self, max_bytes):
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict_until_fits(0)
+
+    def _evict_until_fits(self, incoming_bytes):
+        while self._frames and self.current_bytes + incoming_bytes > self.max_bytes:
+            _, (_, evicted_bytes) = self._frames.popitem(last=False)
+            self.current_bytes -= evicted_bytes
+            self.evictions += 1
+
+    def get(self, key):
+        with self._lock:
+            item = self._frames.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._frames.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, df):
+        """Caches `df` under `key`; frames larger than the whole budget are not cached."""
+        frame_bytes = estimate_frame_bytes(df)
+        with self._lock:
+            old_item = self._frames.pop(key, None)
+            if old_item is not None:
+                self.current_bytes -= old_item[1]
+            if frame_bytes > self.max_bytes:
+                return False
+            self._evict_until_fits(frame_bytes)
+            self._frames[key] = (df, frame_bytes)
+            self.current_bytes += frame_bytes
+            return True
+
+    def invalidate(self, ticker=None):
+        """Drops every cached frame of `ticker` (all frames if None)."""
+        with self._lock:
+            for key in list(self._frames.keys()):
+                if ticker is None or key[0] == ticker.upper():
+                    self.current_bytes -= self._frames.pop(key)[1]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._frames),
+                'current_bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+frame_cache = FrameCache()
@@ -0,0 +1,151 @@
+# frame_compaction.py
+"""
+Compact in-memory representation of the SimFin statement frames.
+
+SimFin loads every line item as float64 and every text column (Ticker,
+Currency, Fiscal Period) as Python strings. compact_frame() stores repeated
+strings as categoricals, downcasts numbers where the values survive the
+round trip unchanged (integers to smaller integer types, floats to float32),
+and keeps mostly-empty line items as sparse columns.
+Values are never changed; only their storage is.
+"""
+import numpy as np
+import pandas as pd
+
+# עמודת טקסט הופכת לקטגוריה כשמספר הערכים השונים קטן מחלק זה ממספר השורות
+CATEGORY_MAX_UNIQUE_FRACTION = 0.5
+# עמודה מספרית נשמרת דלילה כשלפחות חלק זה מהשורות ריק (NaN)
+SPARSE_MIN_EMPTY_FRACTION = 0.6
+
+#---------------------------------------------------------------------------------------------
+
+INTEGER_DTYPES = (np.int8, np.int16, np.int32, np.int64)
+
+def _smallest_int_dtype(min_value, max_value):
+    for dtype in INTEGER_DTYPES:
+        info = np.iinfo(dtype)
+        if info.min <= min_value and max_value <= info.max:
+            return dtype
+    return None
+
+def _compact_int(values):
+    """Integer values -> the smallest integer type that holds them."""
+    if not len(values):
+        return values
+    dtype = _smallest_int_dtype(values.min(), values.max())
+    return values.astype(dtype) if dtype is not None and dtype != values.dtype else values
+
+def _compact_float(values):
+    """float64 -> float32 if every value survives the round trip, else unchanged."""
+    # לא ממירים float ל-int גם כשהערכים שלמים: חשבון על int32 עלול לגלוש בשקט
+    with np.errstate(over='ignore', invalid='ignore'):
+        as_float32 = values.astype(np.float32)
+    if np.array_equal(as_float32.astype(np.float64), values, equal_nan=True):
+        return as_float32
+    return values
+
+def compact_frame(df, sparse=True, sparse_min_empty_fraction=SPARSE_MIN_EMPTY_FRACTION):
+    """
+    Returns a copy of `df` with compact dtypes: categorical text columns,
+    downcast numeric columns and (with `sparse`) sparse mostly-empty float columns.
+    The index is kept as is.
+
+    Args:
+        df (pd.DataFrame): A statement frame (one ticker or a whole market).
+        sparse (bool): Also convert mostly-empty float columns to sparse. Sparse
+            columns save the most on whole-market frames; per-ticker frames are
+            usually left dense.
+        sparse_min_empty_fraction (float): Share of NaN rows from which a column is made sparse.
+
+    Returns:
+        pd.DataFrame
+    """
+    if df is None or df.empty:
+        return df
+
+    row_count = len(df)
+    columns = {}
+    changed = False
+    for column, series in df.items():
+        dtype = series.dtype
+        columns[column] = series
+        if isinstance(dtype, (pd.CategoricalDtype, pd.SparseDtype)):
+            continue
+        if dtype == object or pd.api.types.is_string_dtype(dtype):
+            if series.nunique(dropna=True) <= row_count * CATEGORY_MAX_UNIQUE_FRACTION:
+                columns[column] = series.astype('category')
+                changed = True
+        elif pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_datetime64_any_dtype(dtype):
+            continue
+        elif pd.api.types.is_integer_dtype(dtype) and isinstance(dtype, np.dtype):
+            compact_values = _compact_int(series.to_numpy())
+            if compact_values.dtype != dtype:
+                columns[column] = compact_values
+                changed = True
+        elif pd.api.types.is_float_dtype(dtype):
+            values = series.to_numpy(dtype=np.float64)
+            is_empty = np.isnan(values)
+            if sparse and is_empty.mean() >= sparse_min_empty_fraction:
+                # בעמודה דלילה נשמרים רק הערכים הקיימים והמיקומים שלהם
+                compact_values = _compact_float(values[~is_empty])
+                subtype = np.float32 if compact_values.dtype == np.float32 else np.float64
+                columns[column] = pd.arrays.SparseArray(values.astype(subtype), fill_value=np.nan)
+                changed = True
+            else:
+                compact_values = _compact_float(values)
+                if compact_values.dtype != dtype:
+                    columns[column] = compact_values
+                    changed = True
+
+    if not changed:
+        return df.copy()
+    # בונים את הטבלה פעם אחת מכל העמודות, במקום להחליף עמודה-עמודה בעותק
+    compact_df = pd.DataFrame({position: values for position, values in enumerate(columns.values())}, index=df.index)
+    compact_df.columns = df.columns
+    return compact_df
+
+def densify_frame(df):
+    """Converts sparse columns back to dense ones (same values); other columns are kept."""
+    if df is None:
+        return df
+    sparse_columns = {column: dtype.subtype for column, dtype in df.dtypes.items() if isinstance(dtype, pd.SparseDtype)}
+    return df.astype(sparse_columns) if sparse_columns else df
+
+#---------------------------------------------------------------------------------------------
+
+def _dtype_kind(dtype):
+    if isinstance(dtype, pd.SparseDtype):
+        return 'sparse'
+    if isinstance(dtype, pd.CategoricalDtype):
+        return 'category'
+    return str(dtype)
+
+def frame_memory_report(df):
+    """
+    Memory footprint of a DataFrame: rows, columns, total bytes (deep) and
+    bytes / column count per storage kind (float64, float32, category, sparse, ...).
+    """
+    usage = df.memory_usage(index=True, deep=True)
+    by_kind = {}
+    for column, dtype in df.dtypes.items():
+        kind_stats = by_kind.setdefault(_dtype_kind(dtype), {'columns': 0, 'bytes': 0})
+        kind_stats['columns'] += 1
+        kind_stats['bytes'] += int(usage[column])
+    return {
+        'rows': len(df),
+        'columns': len(df.columns),
+        'bytes': int(usage.sum()),
+        'index_bytes': int(usage['Index']),
+        'by_kind': dict(sorted(by_kind.items(), key=lambda item: -item[1]['bytes']))
+    }
+
+def compaction_report(df, sparse=True):
+    """Footprint of `df` with default dtypes and after compact_frame(), and the saving."""
+    default_report = frame_memory_report(df)
+    compact_report = frame_memory_report(compact_frame(df, sparse=sparse))
+    return {
+        'default': default_report,
+        'compact': compact_report,
+        'saved_bytes': default_report['bytes'] - compact_report['bytes'],
+        'compact_ratio': round(compact_report['bytes'] / default_report['bytes'], 3) if default_report['bytes'] else None
+    }
@@ -0,0 +1,324 @@
+# ingest.py
+"""
+Batch ingest: writes the Data/<ticker>/ statements file (see statement_files) for a
+watchlist or the whole market; --csv also writes the per-statement CSV files.
+
+Each SimFin bulk dataset is loaded once, split by Ticker with a single groupby,
+and the per-ticker files are written in parallel on a process pool. Finished
+tickers are recorded in a progress file so an interrupted run can be resumed.
+At the end the derived-metrics tables (TTM, growth, margins) are rebuilt if the
+bulk datasets changed.
+
+With --publish-only nothing is written to Data/: every bulk dataset and the
+derived tables are just published to the shared columnar cache, so that web
+workers started afterwards memory-map them instead of loading them one by one.
+
+--memory-report prints the in-memory footprint of every statement dataset of
+a market with SimFin's default dtypes and with the compact ones.
+
+Examples:
+    python ingest.py --publish-only
+    python ingest.py --memory-report --market us
+    python ingest.py --all
+    python ingest.py --tickers AAPL MSFT NVDA
+    python ingest.py --watchlist my_watchlist.txt --workers 8 --resume
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from derived_metrics import derived_metrics_store
+from frame_compaction import compaction_report
+from downloader import STATEMENT_TYPES, STATEMENT_VARIANTS
+from simfin_setup import configure_simfin
+from statement_files import PROCESSED_DATA_BASE_DIR, save_ticker_statements
+from statement_store import get_dataset_signature, statement_store
+
+PROGRESS_FILE_NAME = '.ingest_progress.json'
+DEFAULT_CHUNK_SIZE = 50
+
+#---------------------------------------------------------------------------------------------
+
+def read_watchlist(path):
+    """One ticker per line; blank lines and '#' comments are ignored."""
+    tickers = []
+    with open(path, 'r') as f:
+        for line in f:
+            ticker = line.split('#', 1)[0].strip().upper()
+            if ticker:
+                tickers.append(ticker)
+    return tickers
+
+def load_progress(progress_path, dataset_signatures):
+    """
+    Returns the set of tickers already written by a previous run, or an empty set
+    if there is no progress file or it was made from different bulk datasets.
+    """
+    try:
+        with open(progress_path, 'r') as f:
+            progress = json.load(f)
+    except (IOError, ValueError):
+        return set()
+    if progress.get('dataset_signatures') != dataset_signatures:
+        print("ingest.py: Bulk datasets changed since the last run; ignoring saved progress.")
+        return set()
+    return set(progress.get('completed', []))
+
+def save_progress(progress_path, dataset_signatures, completed):
+    tmp_path = f"{progress_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({'dataset_signatures': dataset_signatures, 'completed': sorted(completed)}, f)
+    os.replace(tmp_path, progress_path)
+
+#---------------------------------------------------------------------------------------------
+
+def split_datasets_by_ticker(market, tickers=None):
+    """
+    Loads every (statement, variant) dataset once and splits it by Ticker.
+
+    Args:
+        market (str): The market (e.g., 'us').
+        tickers (set of str, optional): Restrict the split to these tickers. None = all.
+
+    Returns:
+        tuple: ({ticker: {result_key: DataFrame}}, {result_key: error message})
+    """
+    frames_by_ticker = {}
+    dataset_errors = {}
+
+    for variant in STATEMENT_VARIANTS:
+        for stmt_key in STATEMENT_TYPES:
+            result_key = f"{stmt_key}_{variant}"
+            try:
+                dataset = statement_store.get_dataset(stmt_key, variant, market)
+            except Exception as e:
+                dataset_errors[result_key] = str(e)
+                print(f"ingest.py: Could not load {result_key}: {e}")
+                continue
+            if dataset is None or not dataset.has_ticker_info:
+                dataset_errors[result_key] = "Dataset not available or has no 'Ticker' info."
+                continue
+
+            df_all = dataset.df_all
+            ticker_in_index = 'Ticker' in df_all.index.names
+            ticker_values = df_all.index.get_level_values('Ticker') if ticker_in_index else df_all['Ticker']
+            if tickers is not None:
+                df_all = df_all[ticker_values.isin(tickers)]
+                ticker_values = df_all.index.get_level_values('Ticker') if ticker_in_index else df_all['Ticker']
+
+            for ticker, ticker_df in df_all.groupby(ticker_values, sort=False):
+                if ticker_in_index and ticker_df.index.nlevels > 1:
+                    ticker_df = ticker_df.droplevel('Ticker')
+                frames_by_ticker.setdefault(ticker, {})[result_key] = ticker_df
+
+    return frames_by_ticker, dataset_errors
+
+def publish_datasets(market='us'):
+    """
+    Loads (or reuses) every bulk dataset and derived table of a market so that
+    their columnar copies are published for the web workers. Meant to run once
+    per deploy or refresh, before the workers start.
+
+    Returns:
+        dict: Summary report of the run.
+    """
+    started = time.perf_counter()
+    datasets = {}
+    for variant in STATEMENT_VARIANTS:
+        for stmt_key in STATEMENT_TYPES:
+            result_key = f"{stmt_key}_{variant}"
+            try:
+                dataset = statement_store.get_dataset(stmt_key, variant, market)
+            except Exception as e:
+                datasets[result_key] = f"error: {e}"
+                continue
+            datasets[result_key] = type(dataset).__name__ if dataset is not None else 'not available'
+
+    try:
+        derived_metrics = derived_metrics_store.refresh(market)
+    except Exception as e:
+        derived_metrics = {'error': str(e)}
+
+    return {
+        'market': market,
+        'datasets': datasets,
+        'derived_metrics': derived_metrics,
+        'total_seconds': round(time.perf_counter() - started, 2)
+    }
+
+def build_memory_report(market='us'):
+    """
+    Loads every (statement, variant) dataset of a market as SimFin returns it
+    and reports its footprint with default and with compact dtypes.
+
+    Returns:
+        dict: {'datasets': {result_key: compaction report}, 'total': {...}}
+    """
+    datasets = {}
+    for variant in STATEMENT_VARIANTS:
+        for stmt_key in STATEMENT_TYPES:
+            result_key = f"{stmt_key}_{variant}"
+            try:
+                df_all = statement_store.loaders[stmt_key](variant=variant, market=market)
+            except Exception as e:
+                datasets[result_key] = {'error': str(e)}
+                continue
+            if df_all is not None:
+                datasets[result_key] = compaction_report(df_all)
+
+    reports = [report for report in datasets.values() if 'error' not in report]
+    default_bytes = sum(report['default']['bytes'] for report in reports)
+    compact_bytes = sum(report['compact']['bytes'] for report in reports)
+    return {
+        'market': market,
+        'datasets': datasets,
+        'total': {
+            'default_bytes': default_bytes,
+            'compact_bytes': compact_bytes,
+            'compact_ratio': round(compact_bytes / default_bytes, 3) if default_bytes else None
+        }
+    }
+
+def _write_ticker_chunk(chunk, base_dir, export_csv=False):
+    """
+    Process-pool worker: writes the statements file (and with `export_csv` the
+    statement CSVs) of each ticker in a chunk.
+
+    Returns:
+        list of (ticker, files_written, error or None)
+    """
+    chunk_results = []
+    for ticker, frames in chunk:
+        try:
+            saved_paths = save_ticker_statements(
+                {tuple(result_key.rsplit('_', 1)): ticker_df for result_key, ticker_df in frames.items()},
+                ticker, base_dir, export_csv=export_csv)
+            chunk_results.append((ticker, len(set(saved_paths.values())), None))
+        except Exception as e:
+            chunk_results.append((ticker, 0, str(e)))
+    return chunk_results
+
+def run_ingest(tickers=None, market='us', workers=None, resume=False, base_dir=None, chunk_size=DEFAULT_CHUNK_SIZE,
+               export_csv=False):
+    """
+    Writes statement files for `tickers` (None = the whole market).
+
+    Returns:
+        dict: Summary report of the run.
+    """
+    started = time.perf_counter()
+    base_dir = base_dir or PROCESSED_DATA_BASE_DIR
+    os.makedirs(base_dir, exist_ok=True)
+    progress_path = os.path.join(base_dir, PROGRESS_FILE_NAME)
+
+    requested = {ticker.upper() for ticker in tickers} if tickers else None
+    frames_by_ticker, dataset_errors = split_datasets_by_ticker(market, requested)
+    load_seconds = time.perf_counter() - started
+
+    dataset_signatures = {
+        f"{stmt_key}_{variant}": list(get_dataset_signature(stmt_key, variant, market) or [])
+        for variant in STATEMENT_VARIANTS for stmt_key in STATEMENT_TYPES
+    }
+    completed = load_progress(progress_path, dataset_signatures) if resume else set()
+
+    pending = sorted(ticker for ticker in frames_by_ticker if ticker not in completed)
+    chunks = [
+        [(ticker, frames_by_ticker[ticker]) for ticker in pending[i:i + chunk_size]]
+        for i in range(0, len(pending), chunk_size)
+    ]
+
+    files_written = 0
+    failed = {}
+    written_tickers = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_write_ticker_chunk, chunk, base_dir, export_csv) for chunk in chunks]
+        for chunks_done, future in enumerate(as_completed(futures), start=1):
+            for ticker, ticker_files, error in future.result():
+                files_written += ticker_files
+                if error:
+                    failed[ticker] = error
+                else:
+                    completed.add(ticker)
+                    written_tickers += 1
+            save_progress(progress_path, dataset_signatures, completed)
+            if chunks_done % 10 == 0 or chunks_done == len(futures):
+                print(f"ingest.py: {written_tickers + len(failed)}/{len(pending)} tickers processed.")
+
+    # שלב המדדים הנגזרים רץ פעם אחת לכל רענון של קבצי ה-bulk (אם לא השתנו - רק נטען מהדיסק)
+    derived_started = time.perf_counter()
+    try:
+        derived_metrics = derived_metrics_store.refresh(market)
+    except Exception as e:
+        derived_metrics = {'error': str(e)}
+
+    return {
+        'market': market,
+        'tickers_requested': len(requested) if requested is not None else 'all',
+        'tickers_found': len(frames_by_ticker),
+        'tickers_not_found': sorted(requested - set(frames_by_ticker)) if requested is not None else [],
+        'tickers_skipped_from_previous_run': len(frames_by_ticker) - len(pending),
+        'tickers_written': written_tickers,
+        'files_written': files_written,
+        'tickers_failed': failed,
+        'dataset_errors': dataset_errors,
+        'derived_metrics': derived_metrics,
+        'derived_metrics_seconds': round(time.perf_counter() - derived_started, 2),
+        'load_seconds': round(load_seconds, 2),
+        'total_seconds': round(time.perf_counter() - started, 2)
+    }
+
+#---------------------------------------------------------------------------------------------
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write Data/<ticker>/ statement files for many tickers in one pass.")
+    selection = parser.add_mutually_exclusive_group(required=True)
+    selection.add_argument('--all', action='store_true', help="Every ticker in the bulk datasets.")
+    selection.add_argument('--tickers', nargs='+', help="Tickers to ingest.")
+    selection.add_argument('--watchlist', help="File with one ticker per line.")
+    selection.add_argument('--publish-only', action='store_true',
+                           help="Only publish the bulk datasets and derived tables to the shared columnar cache.")
+    selection.add_argument('--memory-report', action='store_true',
+                           help="Print the memory footprint of each dataset with default and compact dtypes.")
+    parser.add_argument('--market', default='us')
+    parser.add_argument('--workers', type=int, default=None, help="Process pool size (default: CPU count).")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="Tickers per worker task.")
+    parser.add_argument('--resume', action='store_true', help="Skip tickers finished by a previous run.")
+    parser.add_argument('--csv', action='store_true', help="Also write the per-statement CSV files.")
+    parser.add_argument('--output-dir', default=None, help="Defaults to the app's Data/ directory.")
+    parser.add_argument('--report', default=None, help="Also write the summary report to this JSON file.")
+    args = parser.parse_args(argv)
+
+    configure_simfin()
+
+    if args.memory_report:
+        report = build_memory_report(args.market)
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        if args.report:
+            with open(args.report, 'w') as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
+        return 0
+
+    if args.publish_only:
+        report = publish_datasets(args.market)
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        return 1 if any(str(status).startswith('error') for status in report['datasets'].values()) else 0
+
+    if args.watchlist:
+        tickers = read_watchlist(args.watchlist)
+    else:
+        tickers = args.tickers # None עבור --all
+
+    report = run_ingest(tickers=tickers, market=args.market, workers=args.workers, resume=args.resume,
+                        base_dir=args.output_dir, chunk_size=args.chunk_size, export_csv=args.csv)
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    return 1 if report['tickers_failed'] else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
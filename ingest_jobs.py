@@ -0,0 +1,338 @@
+# ingest_jobs.py
+"""
+Background ingest of single tickers, off the request path.
+
+POST /set_ticker only enqueues a job; worker threads load the ticker's
+statements from the bulk datasets, write its Data/<ticker>/ files and refill
+the server-side caches. Requests for a ticker that already has a queued or
+running job get that same job back instead of a new one. Job status is also
+written to a small JSON file, so a poll that lands on another worker process
+still finds it.
+
+refresh_bulk_datasets() re-pulls the SimFin bulk datasets; the app can run it on
+a schedule, so the daily data refresh never happens inside a user request. Only
+one process on the machine refreshes at a time.
+"""
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import pandas as pd
+
+import columnar_cache
+import downloader
+from chart_cache import chart_payload_cache
+from derived_metrics import derived_metrics_store
+from frame_cache import frame_cache, frame_cache_key
+from frame_compaction import compact_frame
+from statement_files import PROCESSED_DATA_BASE_DIR, save_ticker_statements
+from statement_store import get_dataset_age_days, statement_store
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+FINISHED_JOB_STATES = (JOB_DONE, JOB_FAILED)
+
+DEFAULT_INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', 2))
+# גם קובצי CSV לכל דוח, בנוסף לקובץ הדוחות הבינארי של הטיקר (EXPORT_STATEMENT_CSV=1)
+EXPORT_STATEMENT_CSV = os.environ.get('EXPORT_STATEMENT_CSV', '').lower() in ('1', 'true', 'yes')
+MAX_FINISHED_JOBS_IN_MEMORY = 500
+JOB_STATUS_DIR = os.path.join(PROCESSED_DATA_BASE_DIR, '.ingest_jobs')
+JOB_STATUS_MAX_AGE_SECONDS = 24 * 3600
+
+DEFAULT_BULK_REFRESH_DAYS = 1
+# כל ה-datasets שהרענון המתוזמן מושך מחדש: הדוחות, ומחירי המניות האחרונים שעליהם נשענות הערכות השווי
+BULK_REFRESH_DATASETS = ([(stmt_key, variant) for variant in downloader.STATEMENT_VARIANTS for stmt_key in downloader.STATEMENT_TYPES]
+                         + [('shareprices', 'latest')])
+BULK_REFRESH_LOCK_NAME = 'bulk-refresh'
+
+#---------------------------------------------------------------------------------------------
+
+def ingest_ticker(ticker, market='us', base_dir=None, export_csv=None):
+    """
+    Loads one ticker's annual and quarterly statements, writes them to its
+    statements file under Data/<ticker>/ (plus CSV files with `export_csv`,
+    default EXPORT_STATEMENT_CSV) and, once they are saved, puts them in the
+    frame cache, replacing whatever the caches held for the ticker.
+
+    Returns:
+        tuple: ({result_key: status message}, any_success)
+    """
+    download_results = downloader.download_financial_statements(ticker_symbol=ticker, market=market)
+
+    statuses = {}
+    frames = {}
+    for variant in downloader.STATEMENT_VARIANTS:
+        for stmt_key in downloader.STATEMENT_TYPES:
+            result_key = f"{stmt_key}_{variant}"
+            data_item = download_results.get(result_key)
+
+            if isinstance(data_item, pd.DataFrame) and not data_item.empty:
+                frames[(stmt_key, variant)] = data_item.sort_index()
+            elif isinstance(data_item, dict) and "Error" in data_item:
+                statuses[result_key] = f"Download Error for {result_key}: {data_item['Details']}"
+            else:
+                statuses[result_key] = f"No data or empty data for {result_key}."
+    if not frames:
+        return statuses, False
+
+    try:
+        saved_paths = save_ticker_statements(frames, ticker, base_dir,
+                                             export_csv=EXPORT_STATEMENT_CSV if export_csv is None else export_csv)
+    except Exception as e:
+        print(f"ingest_jobs.py: Error saving statements of {ticker}: {e}")
+        for stmt_key, variant in frames:
+            statuses[f"{stmt_key}_{variant}"] = f"Error saving {stmt_key}_{variant}: {e}"
+        return statuses, False
+
+    # רק אחרי שמירה מוצלחת: אם השמירה נכשלה, המטמונים עדיין תואמים לקבצים שבדיסק
+    chart_payload_cache.invalidate(ticker)
+    frame_cache.invalidate(ticker)
+    for (stmt_key, variant), df in frames.items():
+        statuses[f"{stmt_key}_{variant}"] = f"Saved: {os.path.basename(saved_paths[(stmt_key, variant)])}"
+        frame_cache.put(frame_cache_key(ticker, stmt_key, variant), compact_frame(df, sparse=False))
+    # הסדר של הסטטוסים כמו בלולאה (annual ואז quarterly)
+    ordered_statuses = {f"{stmt_key}_{variant}": statuses[f"{stmt_key}_{variant}"]
+                        for variant in downloader.STATEMENT_VARIANTS for stmt_key in downloader.STATEMENT_TYPES}
+    return ordered_statuses, True
+
+#---------------------------------------------------------------------------------------------
+
+class IngestJob:
+    """One ticker ingest, shared by every request that asked for the ticker while it was pending."""
+
+    def __init__(self, ticker, market='us'):
+        self.job_id = uuid.uuid4().hex
+        self.ticker = ticker
+        self.market = market
+        self.status = JOB_QUEUED
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.results = {}
+        self.any_success = False
+        self.error = None
+        self.requests = 1 # כמה בקשות קיבלו את העבודה הזו (1 + מספר הבקשות שאוחדו אליה)
+        self._finished = threading.Event()
+
+    @property
+    def is_finished(self):
+        return self.status in FINISHED_JOB_STATES
+
+    def wait(self, timeout=None):
+        """Blocks until the job finishes or `timeout` seconds pass; True if it finished."""
+        return self._finished.wait(timeout)
+
+    def to_dict(self):
+        return {
+            'job_id': self.job_id,
+            'ticker': self.ticker,
+            'market': self.market,
+            'status': self.status,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'results': self.results,
+            'any_success': self.any_success,
+            'error': self.error,
+            'requests': self.requests
+        }
+
+
+class IngestJobQueue:
+    """
+    FIFO queue of ticker ingest jobs run by a few daemon worker threads, which
+    start on the first submit. Jobs are coalesced per (ticker, market) while
+    queued or running. Across worker processes jobs are not coalesced, but the
+    expensive part - loading a bulk dataset - is already done once per machine
+    by the StatementStore publish lock.
+    """
+
+    def __init__(self, run_job=None, workers=DEFAULT_INGEST_WORKERS, status_dir=JOB_STATUS_DIR):
+        self.run_job = run_job or ingest_ticker
+        self.workers = workers
+        self.status_dir = status_dir
+        self._queue = queue.Queue()
+        self._in_flight = {} # (ticker, market) -> job שעדיין בתור או רץ
+        self._jobs = OrderedDict() # job_id -> job, כולל עבודות שהסתיימו (חסום בגודלו)
+        self._lock = threading.Lock()
+        self._threads = []
+        self.submitted = 0
+        self.coalesced = 0
+
+    def _ensure_workers(self):
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._worker_loop, name=f'ingest-worker-{len(self._threads) + 1}', daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def submit(self, ticker, market='us'):
+        """
+        Enqueues an ingest of `ticker`, or returns the job already queued or
+        running for it.
+
+        Returns:
+            IngestJob
+        """
+        key = (ticker.upper().strip(), market)
+        with self._lock:
+            job = self._in_flight.get(key)
+            if job is not None:
+                job.requests += 1
+                self.coalesced += 1
+                return job
+
+            job = IngestJob(key[0], market)
+            self._in_flight[key] = job
+            self._jobs[job.job_id] = job
+            while len(self._jobs) > MAX_FINISHED_JOBS_IN_MEMORY:
+                oldest_id, oldest_job = next(iter(self._jobs.items()))
+                if not oldest_job.is_finished:
+                    break
+                del self._jobs[oldest_id]
+            self.submitted += 1
+            self._ensure_workers()
+        self._save_status(job)
+        self._queue.put(job)
+        return job
+
+    def get(self, job_id):
+        """Status dict of a job of this process, or of another process (from its status file); None if unknown."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        return self._load_status(job_id)
+
+    def stats(self):
+        with self._lock:
+            running = sum(1 for job in self._in_flight.values() if job.status == JOB_RUNNING)
+            return {
+                'queued': len(self._in_flight) - running,
+                'running': running,
+                'submitted': self.submitted,
+                'coalesced': self.coalesced,
+                'workers': len(self._threads)
+            }
+
+    def _worker_loop(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._run(job)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job):
+        job.status = JOB_RUNNING
+        job.started_at = time.time()
+        self._save_status(job)
+        try:
+            job.results, job.any_success = self.run_job(job.ticker, job.market)
+            job.status = JOB_DONE
+        except Exception as e:
+            job.error = str(e)
+            job.status = JOB_FAILED
+            print(f"ingest_jobs.py: Ingest of {job.ticker} failed: {e}")
+        job.finished_at = time.time()
+        with self._lock:
+            # מרגע זה בקשה חדשה לאותו טיקר פותחת עבודה חדשה (הנתונים אולי השתנו)
+            if self._in_flight.get((job.ticker, job.market)) is job:
+                del self._in_flight[(job.ticker, job.market)]
+        self._save_status(job)
+        job._finished.set()
+        self._prune_status_files()
+
+    #--- קובצי סטטוס, כדי שבדיקת סטטוס שמגיעה לתהליך worker אחר תמצא את העבודה ---
+    def _status_path(self, job_id):
+        return os.path.join(self.status_dir, f"{job_id}.json")
+
+    def _save_status(self, job):
+        if not self.status_dir:
+            return
+        try:
+            os.makedirs(self.status_dir, exist_ok=True)
+            status_path = self._status_path(job.job_id)
+            tmp_path = f"{status_path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(job.to_dict(), f)
+            os.replace(tmp_path, status_path)
+        except (IOError, OSError) as e:
+            print(f"ingest_jobs.py: Could not write status of job {job.job_id}: {e}")
+
+    def _load_status(self, job_id):
+        if not self.status_dir or not job_id or not all(c in '0123456789abcdef' for c in job_id):
+            return None
+        try:
+            with open(self._status_path(job_id), 'r') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def _prune_status_files(self):
+        if not self.status_dir:
+            return
+        cutoff = time.time() - JOB_STATUS_MAX_AGE_SECONDS
+        try:
+            for file_name in os.listdir(self.status_dir):
+                file_path = os.path.join(self.status_dir, file_name)
+                if os.path.getmtime(file_path) < cutoff:
+                    os.remove(file_path)
+        except OSError:
+            pass
+
+
+ingest_job_queue = IngestJobQueue()
+
+#---------------------------------------------------------------------------------------------
+
+def refresh_bulk_datasets(market='us', refresh_days=DEFAULT_BULK_REFRESH_DAYS):
+    """
+    Re-pulls every dataset of BULK_REFRESH_DATASETS (the statements and the
+    latest share prices) whose CSV is older than `refresh_days` and rebuilds the
+    derived-metrics tables. Valuations and the screener follow on their next
+    use, since their caches are keyed by the datasets' file signatures. Downloads go through the same
+    rate limiter as on-demand loads.
+
+    Returns:
+        dict: Summary report of the run, or None if another process on the
+              machine is already refreshing (nothing is done then).
+    """
+    # כמה תהליכי worker מריצים את אותו תזמון - רק מי שתופס את הנעילה מרענן
+    with columnar_cache.try_exclusive_lock(BULK_REFRESH_LOCK_NAME) as acquired:
+        if not acquired:
+            print(f"ingest_jobs.py: Another process is refreshing the {market} bulk datasets, skipping.")
+            return None
+        started = time.perf_counter()
+        refreshed = []
+        errors = {}
+        for stmt_key, variant in BULK_REFRESH_DATASETS:
+            result_key = f"{stmt_key}_{variant}"
+            age_days = get_dataset_age_days(stmt_key, variant, market)
+            if age_days is not None and age_days < refresh_days:
+                continue
+            try:
+                downloader.simfin_download_limiter.acquire()
+                if statement_store.refresh_dataset(stmt_key, variant, market, refresh_days):
+                    refreshed.append(result_key)
+            except Exception as e:
+                errors[result_key] = str(e)
+                print(f"ingest_jobs.py: Could not refresh {market} {result_key}: {e}")
+
+        try:
+            derived_metrics = derived_metrics_store.refresh(market)
+        except Exception as e:
+            derived_metrics = {'error': str(e)}
+        return {
+            'market': market,
+            'refreshed': refreshed,
+            'errors': errors,
+            'derived_metrics': derived_metrics,
+            'total_seconds': round(time.perf_counter() - started, 2)
+        }
+
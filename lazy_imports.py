@@ -0,0 +1,84 @@
+# lazy_imports.py
+import importlib
+import threading
+
+#---------------------------------------------------------------------------------------------
+
+class LazyModule:
+    """
+    Stand-in for a module that is imported on first attribute access, so
+    importing the web app does not pay for pandas, plotly, simfin and the
+    data modules until a request (or the cache pre-warm) actually needs them.
+    """
+
+    def __init__(self, module_name):
+        self._module_name = module_name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Imports the module (once) and returns it."""
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._module_name)
+        return self._module
+
+    @property
+    def is_loaded(self):
+        return self._module is not None
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+    def __repr__(self):
+        state = 'loaded' if self.is_loaded else 'not loaded'
+        return f"<LazyModule '{self._module_name}' ({state})>"
+
+
+_lazy_modules = {}
+_lazy_modules_lock = threading.Lock()
+
+def lazy_module(module_name):
+    """The LazyModule of `module_name` (one shared instance per module name)."""
+    with _lazy_modules_lock:
+        module = _lazy_modules.get(module_name)
+        if module is None:
+            module = _lazy_modules[module_name] = LazyModule(module_name)
+        return module
+
+def loaded_lazy_modules():
+    """Names of the lazy modules that have been imported so far."""
+    with _lazy_modules_lock:
+        return [name for name, module in _lazy_modules.items() if module.is_loaded]
+
+
+class LazyAttribute:
+    """
+    Stand-in for an object or function of a lazily imported module (what
+    `from module import name` would bind). Calls and attribute access are
+    forwarded to the real object, which is looked up on first use.
+    """
+
+    def __init__(self, module, attribute_name):
+        self._module = module
+        self._attribute_name = attribute_name
+
+    def resolve(self):
+        return getattr(self._module.load(), self._attribute_name)
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+    def __call__(self, *args, **kwargs):
+        return self.resolve()(*args, **kwargs)
+
+    def __repr__(self):
+        return f"<LazyAttribute '{self._module._module_name}.{self._attribute_name}'>"
+
+
+def lazy_from(module_name, *attribute_names):
+    """Lazy form of `from module_name import a, b`: returns one LazyAttribute per name."""
+    module = lazy_module(module_name)
+    attributes = tuple(LazyAttribute(module, name) for name in attribute_names)
+    return attributes[0] if len(attributes) == 1 else attributes
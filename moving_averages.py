@@ -0,0 +1,103 @@
+# moving_averages.py
+import numpy as np
+import pandas as pd
+
+#---------------------------------------------------------------------------------------------
+
+def sma_column_name(window):
+    return f'MA{window}'
+
+def ema_column_name(window):
+    return f'EMA{window}'
+
+def _valid_windows(windows):
+    return sorted({w for w in (windows or []) if isinstance(w, (int, np.integer)) and w > 0})
+
+def _simple_moving_averages(values, windows):
+    """
+    All SMA windows from one cumulative-sum buffer. Matches
+    `Series.rolling(window).mean()`: a window with any NaN gives NaN.
+    """
+    n = len(values)
+    valid = ~np.isnan(values)
+    cumulative_sum = np.concatenate(([0.0], np.cumsum(np.where(valid, values, 0.0))))
+    cumulative_count = np.concatenate(([0], np.cumsum(valid)))
+
+    averages = {}
+    for window in windows:
+        sma = np.full(n, np.nan)
+        if window <= n:
+            window_sums = cumulative_sum[window:] - cumulative_sum[:-window]
+            window_counts = cumulative_count[window:] - cumulative_count[:-window]
+            window_means = window_sums / window
+            window_means[window_counts < window] = np.nan
+            sma[window - 1:] = window_means
+        averages[window] = sma
+    return averages
+
+def compute_moving_averages(close, sma_windows=None, ema_windows=None):
+    """
+    Computes a set of SMA/EMA windows over a close-price series in one pass.
+
+    Args:
+        close (pd.Series): Close prices.
+        sma_windows (list of int, optional): Simple moving-average windows -> 'MA<w>' columns.
+        ema_windows (list of int, optional): Exponential moving-average spans -> 'EMA<w>' columns.
+
+    Returns:
+        pd.DataFrame: One column per window, aligned to `close.index`.
+    """
+    values = close.to_numpy(dtype=float)
+    columns = {}
+    for window, sma in _simple_moving_averages(values, _valid_windows(sma_windows)).items():
+        columns[sma_column_name(window)] = sma
+    for window in _valid_windows(ema_windows):
+        columns[ema_column_name(window)] = close.astype(float).ewm(span=window, adjust=False).mean().to_numpy()
+    return pd.DataFrame(columns, index=close.index)
+
+def update_moving_averages(df, first_changed_row, sma_windows=None, ema_windows=None, close_column='Close'):
+    """
+    Updates existing MA/EMA columns in place after rows from `first_changed_row`
+    on were appended or replaced. Only the tail is recomputed: each SMA needs
+    the last `window - 1` earlier closes, each EMA continues from its previous value.
+
+    Args:
+        df (pd.DataFrame): Price bars that already hold the MA columns for rows before `first_changed_row`.
+        first_changed_row (int): Position of the first new or changed bar.
+        sma_windows (list of int, optional): SMA windows to update.
+        ema_windows (list of int, optional): EMA spans to update.
+        close_column (str): Column with the close prices.
+
+    Returns:
+        pd.DataFrame: `df`, with the MA columns filled for the changed rows.
+    """
+    sma_windows = _valid_windows(sma_windows)
+    ema_windows = _valid_windows(ema_windows)
+    n = len(df)
+    first_changed_row = max(0, min(first_changed_row, n))
+    if first_changed_row == n:
+        return df
+
+    close = df[close_column]
+    if sma_windows:
+        # הקשר משותף לכל החלונות: window-1 ערכים לפני השורה הראשונה שהשתנתה עבור החלון הגדול ביותר
+        context_start = max(0, first_changed_row - max(sma_windows) + 1)
+        tail_values = close.iloc[context_start:].to_numpy(dtype=float)
+        for window, tail_sma in _simple_moving_averages(tail_values, sma_windows).items():
+            column = sma_column_name(window)
+            column_values = df[column].to_numpy(dtype=float, copy=True) if column in df.columns else np.full(n, np.nan)
+            column_values[first_changed_row:] = tail_sma[first_changed_row - context_start:]
+            df[column] = column_values
+
+    for window in ema_windows:
+        column = ema_column_name(window)
+        previous = df[column].iloc[first_changed_row - 1] if column in df.columns and first_changed_row > 0 else np.nan
+        if np.isnan(previous):
+            df[column] = close.astype(float).ewm(span=window, adjust=False).mean()
+            continue
+        # ewm עם adjust=False שמתחיל מהערך הקודם ממשיך בדיוק את אותה רקורסיה
+        seeded = np.concatenate(([previous], close.iloc[first_changed_row:].to_numpy(dtype=float)))
+        column_values = df[column].to_numpy(dtype=float, copy=True)
+        column_values[first_changed_row:] = pd.Series(seeded).ewm(span=window, adjust=False).mean().to_numpy()[1:]
+        df[column] = column_values
+    return df
@@ -0,0 +1,129 @@
+# peer_comparison.py
+"""
+Peer comparison: one derived metric of several tickers on a common
+calendar-period axis.
+
+All tickers are read from the derived-metrics table of the market in one
+batched lookup (DerivedMetricsStore.get_tickers_metrics). Fiscal periods are
+then aligned with array operations: every fiscal quarter (year) is assigned
+the calendar quarter (year) that contains its midpoint, so a quarter ending
+Jan 31 lines up with calendar Q4 and a fiscal year ending in September with
+the calendar year it mostly covers. A single pivot gives one column per ticker.
+"""
+import re
+
+import pandas as pd
+
+from derived_metrics import derived_metrics_store
+
+MAX_PEER_TICKERS = 20
+
+# מדד -> (תווית, האם זה יחס שמוצג באחוזים)
+PEER_METRICS = {
+    'revenue': ('Revenue', False),
+    'net_income': ('Net income', False),
+    'revenue_ttm': ('Revenue TTM', False),
+    'net_income_ttm': ('Net income TTM', False),
+    'gross_margin': ('Gross margin', True),
+    'operating_margin': ('Operating margin', True),
+    'net_margin': ('Net margin', True),
+    'fcf_margin': ('FCF margin', True)
+}
+QUARTERLY_ONLY_METRICS = ('revenue_ttm', 'net_income_ttm')
+
+# כמה ימים לפני סוף התקופה נמצא האמצע שלה - לפיו נקבעת התקופה הקלנדרית
+PERIOD_MIDPOINT_DAYS = {'quarterly': 45, 'annual': 182}
+CALENDAR_PERIOD_FREQ = {'quarterly': 'Q', 'annual': 'Y'}
+
+#---------------------------------------------------------------------------------------------
+
+def parse_peer_tickers(text, max_tickers=MAX_PEER_TICKERS):
+    """
+    Tickers from a comma/space separated string, upper-cased, duplicates removed
+    (first occurrence kept). Raises ValueError if there are none or too many.
+    """
+    tickers = list(dict.fromkeys(t.upper() for t in re.split(r'[\s,;]+', text or '') if t))
+    if not tickers:
+        raise ValueError("No tickers given.")
+    if len(tickers) > max_tickers:
+        raise ValueError(f"At most {max_tickers} tickers can be compared ({len(tickers)} given).")
+    return tickers
+
+def validate_peer_metric(metric, variant):
+    """Raises ValueError for an unknown metric, variant or combination."""
+    if variant not in PERIOD_MIDPOINT_DAYS:
+        raise ValueError(f"Unsupported variant '{variant}'.")
+    if metric not in PEER_METRICS:
+        raise ValueError(f"Unsupported metric '{metric}'. Available: {', '.join(PEER_METRICS)}.")
+    if metric in QUARTERLY_ONLY_METRICS and variant != 'quarterly':
+        raise ValueError(f"'{metric}' is only available for quarterly data.")
+
+def calendar_periods(report_dates, variant):
+    """The calendar quarter ('quarterly') or year ('annual') containing the midpoint of each fiscal period."""
+    midpoints = pd.DatetimeIndex(report_dates) - pd.Timedelta(days=PERIOD_MIDPOINT_DAYS[variant])
+    return midpoints.to_period(CALENDAR_PERIOD_FREQ[variant])
+
+def _empty_alignment(variant):
+    """(values, report_dates) with no periods and no tickers."""
+    empty = pd.DataFrame(index=pd.PeriodIndex([], freq=CALENDAR_PERIOD_FREQ[variant], name='Period'))
+    return empty, empty.copy()
+
+def align_fiscal_periods(metrics, metric, variant, tickers=None):
+    """
+    Puts the tickers' fiscal periods on one calendar axis.
+
+    Args:
+        metrics (pd.DataFrame): Derived metrics indexed by [Ticker, Report Date].
+        metric (str): Column to compare.
+        variant (str): 'quarterly' or 'annual'.
+        tickers (list of str, optional): Column order of the result (tickers without data are left out).
+
+    Returns:
+        tuple: (values, report_dates) - two DataFrames indexed by calendar Period with one
+               column per ticker: the metric and the fiscal period end it came from. If a
+               ticker has two fiscal periods in one calendar period (a changed fiscal year
+               end), the later one is kept.
+    """
+    flat = metrics[[metric]].reset_index()
+    flat = flat[flat[metric].notna()]
+    if flat.empty: # למשל שולי רווח גולמי של בנקים - אין אף ערך, וכל הטיקרים ידווחו כחסרים
+        return _empty_alignment(variant)
+    flat['Period'] = calendar_periods(flat['Report Date'], variant)
+    flat = flat.sort_values(['Ticker', 'Report Date'], kind='stable').drop_duplicates(['Ticker', 'Period'], keep='last')
+    aligned = flat.pivot(index='Period', columns='Ticker', values=[metric, 'Report Date']).sort_index()
+    columns = [t for t in (tickers or aligned[metric].columns) if t in aligned[metric].columns]
+    # pivot של שתי עמודות בבת אחת מחזיר object; המדד חוזר ל-float
+    return aligned[metric].reindex(columns=columns).astype(float), aligned['Report Date'].reindex(columns=columns)
+
+def build_peer_comparison(tickers, metric, variant, market='us', metrics_store=None):
+    """
+    One metric of several tickers, aligned by calendar period, from a single
+    lookup in the derived-metrics table.
+
+    Returns:
+        tuple: (values, report_dates, missing tickers); values and report_dates are None
+               if the derived-metrics table is unavailable.
+    """
+    validate_peer_metric(metric, variant)
+    metrics, missing = (metrics_store or derived_metrics_store).get_tickers_metrics(tickers, variant, market)
+    if metrics is None:
+        return None, None, missing
+    if metrics.empty:
+        values, report_dates = _empty_alignment(variant)
+    else:
+        values, report_dates = align_fiscal_periods(metrics, metric, variant, tickers)
+    # טיקר שקיים בנתונים אבל בלי ערך אחד במדד הזה נחשב חסר
+    missing += [t for t in tickers if t not in missing and t not in values.columns]
+    return values, report_dates, missing
+
+def peer_comparison_payload(values, report_dates):
+    """JSON-ready form: period labels and, per ticker, its values and fiscal period ends (NaN -> None)."""
+    series = {}
+    for ticker in values.columns:
+        ticker_values = values[ticker].astype(object)
+        ticker_dates = pd.to_datetime(report_dates[ticker]).dt.strftime('%Y-%m-%d')
+        series[ticker] = {
+            'values': ticker_values.where(values[ticker].notna(), None).tolist(),
+            'report_dates': ticker_dates.astype(object).where(report_dates[ticker].notna(), None).tolist()
+        }
+    return {'periods': [str(period) for period in values.index], 'series': series}
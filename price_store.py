@@ -0,0 +1,283 @@
+# price_store.py
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import pandas as pd
+import yfinance as yf
+
+from frame_cache import estimate_frame_bytes
+from moving_averages import compute_moving_averages, sma_column_name, update_moving_averages
+from statement_files import PROCESSED_DATA_BASE_DIR
+
+# כמה ימים כל period של yfinance מכסה, כדי לדעת אם ההיסטוריה השמורה מספיקה לבקשה
+PERIOD_DAYS = {
+    '1d': 1, '5d': 5, '1mo': 31, '3mo': 92, '6mo': 183,
+    '1y': 366, '2y': 731, '5y': 1827, '10y': 3653, 'max': float('inf')
+}
+
+DEFAULT_MIN_REFRESH_SECONDS = 15 * 60
+# תקציב הזיכרון של ההיסטוריות שמוחזקות בזיכרון (בבתים); מה שנזרק נקרא שוב מהקובץ בדיסק
+DEFAULT_PRICE_CACHE_MAX_BYTES = int(os.environ.get('PRICE_CACHE_MAX_BYTES', 128 * 1024 * 1024))
+
+#---------------------------------------------------------------------------------------------
+
+def get_period_days(period):
+    if period == 'ytd':
+        today = pd.Timestamp.today()
+        return (today - pd.Timestamp(year=today.year, month=1, day=1)).days + 1
+    if period not in PERIOD_DAYS:
+        raise ValueError(f"Unsupported period '{period}'.")
+    return PERIOD_DAYS[period]
+
+
+class YFinancePriceSource:
+    """Fetches OHLCV bars from yfinance."""
+
+    def fetch(self, ticker_symbol, interval, period=None, start=None):
+        """
+        Args:
+            ticker_symbol (str): The stock ticker.
+            interval (str): Bar interval (e.g., "1d").
+            period (str, optional): yfinance period for a full download.
+            start (pd.Timestamp, optional): First bar date for an incremental download.
+
+        Returns:
+            pd.DataFrame: Bars indexed by date (possibly empty).
+        """
+        ticker = yf.Ticker(ticker_symbol)
+        if start is not None:
+            return ticker.history(start=start.strftime('%Y-%m-%d'), interval=interval)
+        return ticker.history(period=period, interval=interval)
+
+
+class StaticPriceSource:
+    """
+    Offline price source serving pre-built bars, e.g. for tests and benchmarks.
+    `bars_by_ticker` maps ticker -> DataFrame with a DatetimeIndex.
+    """
+
+    def __init__(self, bars_by_ticker):
+        self.bars_by_ticker = {ticker.upper(): bars for ticker, bars in bars_by_ticker.items()}
+        self.fetch_calls = []
+
+    def fetch(self, ticker_symbol, interval, period=None, start=None):
+        self.fetch_calls.append((ticker_symbol, interval, period, start))
+        bars = self.bars_by_ticker.get(ticker_symbol.upper())
+        if bars is None:
+            return pd.DataFrame()
+        if start is not None:
+            if bars.index.tz is not None and start.tz is None:
+                start = start.tz_localize(bars.index.tz)
+            return bars[bars.index >= start].copy()
+        period_days = get_period_days(period)
+        if period_days != float('inf') and not bars.empty:
+            bars = bars[bars.index >= bars.index[-1] - pd.Timedelta(days=period_days)]
+        return bars.copy()
+
+#---------------------------------------------------------------------------------------------
+
+class PriceStore:
+    """
+    Persistent per-(ticker, interval) price history.
+
+    The first request downloads the full period. Later requests download only
+    the bars from the last stored date onward and merge them in, and at most
+    once every `min_refresh_seconds`. Histories are pickled to
+    Data/<ticker>/<ticker>_prices_<interval>.pkl; the ones in memory are kept
+    in an LRU bounded by `max_bytes`, like FrameCache.
+    """
+
+    def __init__(self, source=None, base_dir=None, min_refresh_seconds=DEFAULT_MIN_REFRESH_SECONDS,
+                 max_bytes=DEFAULT_PRICE_CACHE_MAX_BYTES):
+        self.source = source or YFinancePriceSource()
+        self.base_dir = base_dir or PROCESSED_DATA_BASE_DIR
+        self.min_refresh_seconds = min_refresh_seconds
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._entries_lock = threading.Lock()
+        self.current_bytes = 0
+        self.evictions = 0
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def _lock_for(self, key):
+        with self._locks_guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def get_file_path(self, ticker_symbol, interval):
+        return os.path.join(self.base_dir, ticker_symbol, f"{ticker_symbol}_prices_{interval}.pkl")
+
+    def _get_cached_entry(self, key):
+        with self._entries_lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            self._entries.move_to_end(key)
+            return item[0]
+
+    def _cache_entry(self, key, entry):
+        """Keeps `entry` in memory, evicting the least recently used ones beyond `max_bytes`."""
+        entry_bytes = estimate_frame_bytes(entry['bars'])
+        with self._entries_lock:
+            old_item = self._entries.pop(key, None)
+            if old_item is not None:
+                self.current_bytes -= old_item[1]
+            if entry_bytes > self.max_bytes:
+                return
+            while self._entries and self.current_bytes + entry_bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_bytes
+                self.evictions += 1
+            self._entries[key] = (entry, entry_bytes)
+            self.current_bytes += entry_bytes
+
+    def _read_entry(self, ticker_symbol, interval):
+        key = (ticker_symbol, interval)
+        entry = self._get_cached_entry(key)
+        if entry is not None:
+            return entry
+        file_path = self.get_file_path(ticker_symbol, interval)
+        if os.path.exists(file_path):
+            try:
+                entry = pd.read_pickle(file_path)
+                self._cache_entry(key, entry)
+            except Exception as e:
+                print(f"price_store.py: Could not read cached prices {file_path}: {e}")
+                entry = None
+        return entry
+
+    def _write_entry(self, ticker_symbol, interval, entry):
+        file_path = self.get_file_path(ticker_symbol, interval)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        tmp_path = f"{file_path}.{os.getpid()}.tmp"
+        pd.to_pickle(entry, tmp_path)
+        os.replace(tmp_path, file_path)
+        self._cache_entry((ticker_symbol, interval), entry)
+
+    @staticmethod
+    def _merge_new_bars(bars, new_bars):
+        """
+        Appends `new_bars`, replacing stored bars from the first new date on
+        (the last stored bar may have been partial).
+
+        Returns:
+            tuple: (merged bars, position of the first new or replaced bar)
+        """
+        if new_bars is None or new_bars.empty:
+            return bars, len(bars)
+        kept_bars = bars[bars.index < new_bars.index[0]]
+        merged = pd.concat([kept_bars, new_bars])
+        # עמודות ממוצעים נעים קיימות נשמרות; לשורות החדשות הן יחושבו ב-update_moving_averages
+        return merged, len(kept_bars)
+
+    def _refresh(self, ticker_symbol, interval, period, entry):
+        period_days = get_period_days(period)
+        needs_full_download = (
+            entry is None or entry['bars'].empty or entry['covered_period_days'] < period_days
+        )
+
+        if not needs_full_download:
+            bars = entry['bars']
+            new_bars = self.source.fetch(ticker_symbol, interval, start=bars.index[-1].normalize())
+            # אחרי דיבידנד או פיצול yfinance מתאים את כל ההיסטוריה, אז אי אפשר רק להוסיף בסוף
+            corporate_action = False
+            if new_bars is not None and not new_bars.empty:
+                added_bars = new_bars[new_bars.index > bars.index[-1]]
+                corporate_action = any(
+                    col in added_bars.columns and (added_bars[col].fillna(0) != 0).any()
+                    for col in ('Dividends', 'Stock Splits')
+                )
+            if not corporate_action:
+                merged_bars, first_changed_row = self._merge_new_bars(bars, new_bars)
+                ma_windows = entry.get('ma_windows', [])
+                if ma_windows and first_changed_row < len(merged_bars):
+                    update_moving_averages(merged_bars, first_changed_row, sma_windows=ma_windows)
+                return {
+                    'bars': merged_bars,
+                    'covered_period_days': entry['covered_period_days'],
+                    'ma_windows': ma_windows,
+                    'fetched_at': time.time(),
+                    'full_download': False,
+                }
+            period_days = max(period_days, entry['covered_period_days'])
+            period = next(p for p, days in PERIOD_DAYS.items() if days >= period_days)
+
+        bars = self.source.fetch(ticker_symbol, interval, period=period)
+        return {
+            'bars': bars if bars is not None else pd.DataFrame(),
+            'covered_period_days': period_days,
+            'ma_windows': [],
+            'fetched_at': time.time(),
+            'full_download': True,
+        }
+
+    def get_history(self, ticker_symbol, period="10y", interval="1d", moving_averages=None):
+        """
+        Returns the bars of the last `period` for a ticker, fetching only what is
+        missing from the stored history.
+
+        Simple moving averages are stored with the bars: windows seen before are
+        only extended over newly appended bars, new windows are computed once
+        over the whole stored history.
+
+        Args:
+            ticker_symbol (str): The stock ticker.
+            period (str): yfinance period (e.g., "1y", "10y", "max").
+            interval (str): Bar interval (e.g., "1d").
+            moving_averages (list of int, optional): SMA windows to include as 'MA<w>' columns.
+
+        Returns:
+            pd.DataFrame: OHLCV bars (a copy), empty if nothing was found.
+        """
+        ticker_symbol = ticker_symbol.upper()
+        with self._lock_for((ticker_symbol, interval)):
+            entry = self._read_entry(ticker_symbol, interval)
+            is_recent = entry is not None and (time.time() - entry['fetched_at']) < self.min_refresh_seconds
+            if not (is_recent and entry['covered_period_days'] >= get_period_days(period)):
+                refreshed_entry = self._refresh(ticker_symbol, interval, period, entry)
+                if not refreshed_entry['bars'].empty:
+                    self._write_entry(ticker_symbol, interval, refreshed_entry)
+                    entry = refreshed_entry
+                elif entry is None:
+                    entry = refreshed_entry
+
+            requested_windows = sorted({ma for ma in (moving_averages or []) if isinstance(ma, int) and ma > 0})
+            missing_windows = [ma for ma in requested_windows if ma not in entry.get('ma_windows', [])]
+            if missing_windows and not entry['bars'].empty:
+                new_columns = compute_moving_averages(entry['bars']['Close'], sma_windows=missing_windows)
+                for column in new_columns.columns:
+                    entry['bars'][column] = new_columns[column]
+                entry['ma_windows'] = sorted(set(entry.get('ma_windows', [])) | set(missing_windows))
+                self._write_entry(ticker_symbol, interval, entry)
+
+            unrequested_columns = [
+                sma_column_name(ma) for ma in entry.get('ma_windows', []) if ma not in requested_windows
+            ]
+            bars = entry['bars'].drop(columns=unrequested_columns, errors='ignore')
+            period_days = get_period_days(period)
+            if period_days != float('inf') and not bars.empty:
+                bars = bars[bars.index >= bars.index[-1] - pd.Timedelta(days=period_days)]
+            return bars.copy()
+
+    def get_version(self, ticker_symbol, interval="1d"):
+        """
+        Identifies the stored history of a ticker while it is recent enough to be
+        served without a refresh.
+
+        Returns:
+            tuple: (version string, last fetch as a UTC datetime), or (None, None)
+                   if nothing is stored or a refresh is due.
+        """
+        entry = self._read_entry(ticker_symbol.upper(), interval)
+        if entry is None or entry['bars'].empty:
+            return None, None
+        if time.time() - entry['fetched_at'] >= self.min_refresh_seconds:
+            return None, None
+        fetched_at = datetime.fromtimestamp(entry['fetched_at'], tz=timezone.utc)
+        return f"{entry['fetched_at']:.3f}:{len(entry['bars'])}", fetched_at
+
+
+price_store = PriceStore()
@@ -0,0 +1,56 @@
+# rate_limiter.py
+import threading
+import time
+
+#---------------------------------------------------------------------------------------------
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. Tokens refill continuously at `rate_per_second`
+    up to `capacity`; acquire() blocks until enough tokens are available.
+    """
+
+    def __init__(self, rate_per_second, capacity=1):
+        if rate_per_second <= 0:
+            raise ValueError("rate_per_second must be positive.")
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1.")
+        self.rate_per_second = float(rate_per_second)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate_per_second)
+        self._last_refill = now
+
+    def try_acquire(self, tokens=1):
+        """Takes `tokens` if available right now; returns True on success."""
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens=1):
+        """
+        Blocks until `tokens` can be taken from the bucket.
+
+        Returns:
+            float: Seconds spent waiting.
+        """
+        if tokens > self.capacity:
+            raise ValueError("Cannot acquire more tokens than the bucket capacity.")
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                wait_time = (tokens - self._tokens) / self.rate_per_second
+            time.sleep(wait_time)
+            waited += wait_time
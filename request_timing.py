@@ -0,0 +1,222 @@
+# request_timing.py
+"""
+Per-request timing: each request records how long it spent in named stages
+(data load, transformation, figure construction, serialization, template
+rendering). The breakdown is sent in a Server-Timing header, aggregated into
+Prometheus-style latency histograms and, for slow requests, logged together
+with the stage that dominated.
+"""
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import before_render_template, g, has_request_context, request, template_rendered
+
+# שמות השלבים שנמדדים (זמן "בלעדי": שלב פנימי לא נספר גם בשלב שעוטף אותו)
+STAGE_LOAD = 'load'
+STAGE_TRANSFORM = 'transform'
+STAGE_FIGURE = 'figure'
+STAGE_SERIALIZE = 'serialize'
+STAGE_RENDER = 'render'
+STAGE_STORE = 'store'
+STAGE_DESCRIPTIONS = {
+    STAGE_LOAD: 'Data load (session/CSV/SimFin/prices)',
+    STAGE_TRANSFORM: 'Data transformation',
+    STAGE_FIGURE: 'Plotly figure construction',
+    STAGE_SERIALIZE: 'JSON serialization',
+    STAGE_RENDER: 'Template rendering',
+    STAGE_STORE: 'Writing statement files',
+}
+
+# גבולות הדליים של ההיסטוגרמות, בשניות
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DEFAULT_SLOW_REQUEST_SECONDS = 1.0
+
+#---------------------------------------------------------------------------------------------
+
+def _start_stage(name):
+    if not has_request_context() or 'stage_stack' not in g:
+        return None
+    frame = [name, time.perf_counter(), 0.0] # [שם השלב, זמן התחלה, זמן שלבים פנימיים]
+    g.stage_stack.append(frame)
+    return frame
+
+def _end_stage(frame):
+    if frame is None or not g.stage_stack or g.stage_stack[-1] is not frame:
+        return
+    name, started, nested_seconds = g.stage_stack.pop()
+    elapsed = time.perf_counter() - started
+    g.stage_timings[name] = g.stage_timings.get(name, 0.0) + elapsed - nested_seconds
+    if g.stage_stack:
+        g.stage_stack[-1][2] += elapsed
+
+@contextmanager
+def stage(name):
+    """
+    Times a block as stage `name` of the current request. Time spent in stages
+    nested inside the block is counted only in the inner stage. Outside a
+    request (background threads, scripts) the block just runs.
+    """
+    frame = _start_stage(name)
+    try:
+        yield
+    finally:
+        _end_stage(frame)
+
+def timed_stage(name):
+    """Decorator form of stage(): every call of the function is timed as stage `name`."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def format_server_timing(stage_timings, total_seconds):
+    """Server-Timing header value, e.g. 'load;dur=12.3;desc="...", total;dur=15.0'."""
+    entries = []
+    for name, seconds in stage_timings.items():
+        description = STAGE_DESCRIPTIONS.get(name)
+        entry = f"{name};dur={seconds * 1000:.1f}"
+        entries.append(f'{entry};desc="{description}"' if description else entry)
+    entries.append(f"total;dur={total_seconds * 1000:.1f}")
+    return ', '.join(entries)
+
+#---------------------------------------------------------------------------------------------
+
+class Histogram:
+    """Cumulative-bucket histogram per label set, in the Prometheus exposition format."""
+
+    def __init__(self, name, help_text, label_names, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {} # labels -> [counts per bucket, sum, count]
+
+    def observe(self, value, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][i] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, (bucket_counts, total, count) in sorted(self._series.items()):
+            labels = ','.join(f'{name}="{_escape_label(value)}"' for name, value in zip(self.label_names, label_values))
+            prefix = f"{labels}," if labels else ''
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {bucket_count}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return lines
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class RequestMetrics:
+    """Latency histograms of whole requests and of their stages, plus a count of slow requests."""
+
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS):
+        self._lock = threading.Lock()
+        self.request_duration = Histogram(
+            'simfin_request_duration_seconds', 'Request latency by endpoint.',
+            ['endpoint', 'method', 'status'], buckets)
+        self.stage_duration = Histogram(
+            'simfin_request_stage_duration_seconds', 'Time spent per request in each stage, by endpoint.',
+            ['endpoint', 'stage'], buckets)
+        self.slow_requests = {} # (endpoint, dominant stage) -> count
+        self.gauges = {} # name -> (help text, value)
+
+    def observe(self, endpoint, method, status, total_seconds, stage_timings, slow_stage=None):
+        with self._lock:
+            self.request_duration.observe(total_seconds, endpoint, method, str(status))
+            for name, seconds in stage_timings.items():
+                self.stage_duration.observe(seconds, endpoint, name)
+            if slow_stage is not None:
+                key = (endpoint, slow_stage)
+                self.slow_requests[key] = self.slow_requests.get(key, 0) + 1
+
+    def set_gauge(self, name, help_text, value):
+        with self._lock:
+            self.gauges[name] = (help_text, value)
+
+    def render_prometheus(self):
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            lines = self.request_duration.render() + self.stage_duration.render()
+            lines += ["# HELP simfin_slow_requests_total Requests slower than the slow-request threshold, by dominant stage.",
+                      "# TYPE simfin_slow_requests_total counter"]
+            for (endpoint, stage_name), count in sorted(self.slow_requests.items()):
+                lines.append(f'simfin_slow_requests_total{{endpoint="{_escape_label(endpoint)}",'
+                             f'stage="{_escape_label(stage_name)}"}} {count}')
+            for name, (help_text, value) in sorted(self.gauges.items()):
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"]
+        return '\n'.join(lines) + '\n'
+
+
+request_metrics = RequestMetrics()
+
+#---------------------------------------------------------------------------------------------
+
+def init_request_timing(app, metrics=None):
+    """
+    Installs the timing hooks on a Flask app. The slow-request threshold is
+    app.config['SLOW_REQUEST_SECONDS'] (None or 0 disables the log).
+    """
+    metrics = metrics or request_metrics
+    app.config.setdefault('SLOW_REQUEST_SECONDS', DEFAULT_SLOW_REQUEST_SECONDS)
+
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+        g.stage_timings = {}
+        g.stage_stack = []
+
+    # render_template() של Flask משדר אותות לפני ואחרי הרינדור - כך כל רינדור נמדד בלי לעטוף כל קריאה
+    def start_render_stage(sender, template, context, **extra):
+        g.render_stage_frames = g.get('render_stage_frames', []) + [_start_stage(STAGE_RENDER)]
+
+    def end_render_stage(sender, template, context, **extra):
+        frames = g.get('render_stage_frames')
+        if frames:
+            _end_stage(frames.pop())
+
+    before_render_template.connect(start_render_stage, app, weak=False)
+    template_rendered.connect(end_render_stage, app, weak=False)
+
+    @app.after_request
+    def record_request_timing(response):
+        started = g.get('request_started')
+        if started is None:
+            return response
+        total_seconds = time.perf_counter() - started
+        stage_timings = g.stage_timings
+        # הזמן שלא נמדד באף שלב (ניתוב, session, בניית תגובה) נספר כ-other
+        other_seconds = total_seconds - sum(stage_timings.values())
+        if other_seconds > 0:
+            stage_timings = {**stage_timings, 'other': other_seconds}
+        response.headers['Server-Timing'] = format_server_timing(stage_timings, total_seconds)
+
+        endpoint = request.endpoint or 'unmatched'
+        slow_stage = None
+        slow_threshold = app.config.get('SLOW_REQUEST_SECONDS')
+        if slow_threshold and total_seconds >= slow_threshold:
+            slow_stage = max(stage_timings, key=stage_timings.get) if stage_timings else 'other'
+            breakdown = ', '.join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in
+                                  sorted(stage_timings.items(), key=lambda item: -item[1]))
+            print(f"request_timing.py: Slow request {request.method} {request.full_path.rstrip('?')} "
+                  f"({response.status_code}) took {total_seconds * 1000:.0f}ms, mostly in '{slow_stage}': {breakdown}")
+        metrics.observe(endpoint, request.method, response.status_code, total_seconds, stage_timings, slow_stage)
+        return response
+
+    return metrics
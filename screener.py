@@ -0,0 +1,215 @@
+# screener.py
+import re
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import columnar_cache
+from derived_metrics import derived_metrics_store
+from valuation import valuation_engine
+
+# לשנות כשנוסחאות המדדים משתנות, כדי שטבלה שנשמרה בדיסק לא תשמש יותר
+SCREENER_METRICS_VERSION = 2
+SCREENER_TABLE_NAME = 'screener'
+SCREENER_MAX_RESULTS = 1000
+# אחרי כישלון בטעינת הערכות השווי, כמה שניות משתמשים באינדקס שנבנה בלעדיהן לפני שמנסים שוב
+VALUATIONS_RETRY_SECONDS = 60
+
+# מדד בסורק -> עמודה בטבלת המדדים הנגזרים הרבעונית (נלקחת השורה האחרונה של כל טיקר)
+DERIVED_METRICS = {
+    'revenue_ttm': 'revenue_ttm', 'revenue_growth_yoy': 'revenue_ttm_growth_yoy', 'revenue_growth_qoq': 'revenue_growth_qoq',
+    'gross_margin': 'gross_margin_ttm', 'operating_margin': 'operating_margin_ttm',
+    'net_income_ttm': 'net_income_ttm', 'net_income_growth_yoy': 'net_income_ttm_growth_yoy', 'net_margin': 'net_margin_ttm',
+    'positive_net_income_quarters': 'positive_net_income_periods', 'fcf_ttm': 'fcf_ttm', 'fcf_margin': 'fcf_margin_ttm'
+}
+
+# מדדי הערכת שווי שנלקחים מ-valuation_engine: שם המדד בסורק -> עמודה בטבלת ההערכות
+VALUATION_METRICS = {
+    'price': 'Price', 'market_cap': 'Market Cap', 'pe': 'P/E', 'ps': 'P/S',
+    'ev_ebitda': 'EV/EBITDA', 'dcf_upside': 'DCF Upside'
+}
+
+CONDITION_PATTERN = re.compile(r'^\s*([a-z0-9_]+)\s*(>=|<=|>|<|=)\s*(-?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)\s*$')
+
+#---------------------------------------------------------------------------------------------
+
+def compute_screener_metrics(latest_quarterly, valuations=None):
+    """
+    Builds the per-ticker metrics table the screener filters on.
+
+    Args:
+        latest_quarterly (pd.DataFrame): The latest derived-metrics row of every ticker
+            (derived_metrics_store.latest_by_ticker('quarterly')), indexed by Ticker.
+        valuations (pd.DataFrame, optional): valuation_engine's table, for the
+            VALUATION_METRICS columns.
+
+    Returns:
+        pd.DataFrame: One row per ticker (index 'Ticker'), numeric metric columns.
+    """
+    metrics = pd.DataFrame({metric: latest_quarterly[column] for metric, column in DERIVED_METRICS.items()},
+                           index=latest_quarterly.index)
+    if valuations is not None:
+        for metric, column in VALUATION_METRICS.items():
+            metrics[metric] = valuations[column].reindex(metrics.index) if column in valuations.columns else np.nan
+    metrics.index.name = 'Ticker'
+    return metrics.astype(float)
+
+#---------------------------------------------------------------------------------------------
+
+def parse_condition(text):
+    """
+    Parses a screen condition such as 'revenue_growth_yoy>0.1'.
+
+    Returns:
+        tuple: (metric, operator, value)
+
+    Raises:
+        ValueError: If the condition is malformed.
+    """
+    match = CONDITION_PATTERN.match(text)
+    if match is None:
+        raise ValueError(f"Invalid condition '{text}'. Expected e.g. 'revenue_growth_yoy>0.1'.")
+    metric, operator, value = match.groups()
+    return metric, operator, float(value)
+
+def screen_records(screened):
+    """JSON-ready list of dicts for screen() results (NaN -> None)."""
+    records = screened.reset_index()
+    return records.astype(object).where(records.notna(), None).to_dict(orient='records')
+
+
+class ScreenerIndex:
+    """
+    The screener metrics table plus, for every metric, the row positions sorted
+    by value (NaN left out). A range condition is then two binary searches
+    (np.searchsorted) instead of a scan, and top-K is a walk down the sorted order.
+    """
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self._sorted = {}
+        for column in metrics.columns:
+            values = metrics[column].to_numpy(dtype=float)
+            order = np.argsort(values, kind='stable')[:int(np.count_nonzero(~np.isnan(values)))]
+            self._sorted[column] = (values[order], order)
+
+    @property
+    def metric_names(self):
+        return list(self.metrics.columns)
+
+    def _check_metric(self, metric):
+        if metric not in self._sorted:
+            raise ValueError(f"Unknown metric '{metric}'. Available: {', '.join(self.metric_names)}")
+
+    def matching_rows(self, metric, operator, value):
+        """Row positions where `metric <operator> value` holds (NaN never matches)."""
+        self._check_metric(metric)
+        sorted_values, order = self._sorted[metric]
+        if operator == '>':
+            return order[np.searchsorted(sorted_values, value, side='right'):]
+        if operator == '>=':
+            return order[np.searchsorted(sorted_values, value, side='left'):]
+        if operator == '<':
+            return order[:np.searchsorted(sorted_values, value, side='left')]
+        if operator == '<=':
+            return order[:np.searchsorted(sorted_values, value, side='right')]
+        if operator == '=':
+            return order[np.searchsorted(sorted_values, value, side='left'):np.searchsorted(sorted_values, value, side='right')]
+        raise ValueError(f"Unsupported operator '{operator}'.")
+
+    def screen(self, conditions, sort_metric=None, descending=True, top=None):
+        """
+        Filters the market on all `conditions` and ranks the result.
+
+        Args:
+            conditions (list of tuple): (metric, operator, value) triples, all of which must hold.
+            sort_metric (str, optional): Metric to rank by; tickers without a value for it are left out.
+            descending (bool): Rank from the highest value.
+            top (int, optional): Keep only the first `top` tickers.
+
+        Returns:
+            tuple: (pd.DataFrame of the selected rows in rank order, number of tickers matching the conditions)
+        """
+        n_rows = len(self.metrics)
+        mask = np.ones(n_rows, dtype=bool)
+        for metric, operator, value in conditions:
+            condition_mask = np.zeros(n_rows, dtype=bool)
+            condition_mask[self.matching_rows(metric, operator, value)] = True
+            mask &= condition_mask
+        match_count = int(mask.sum())
+
+        if sort_metric is not None:
+            self._check_metric(sort_metric)
+            order = self._sorted[sort_metric][1]
+            if descending:
+                order = order[::-1]
+            positions = order[mask[order]]
+        else:
+            positions = np.flatnonzero(mask)
+        if top is not None:
+            positions = positions[:top]
+        return self.metrics.iloc[positions], match_count
+
+
+class ScreenerEngine:
+    """
+    Keeps one ScreenerIndex per market, rebuilt from the derived-metrics
+    pipeline only when the bulk datasets change. The metrics table is also persisted as a columnar file, so a
+    restarted process reads it instead of recomputing it.
+    """
+
+    def __init__(self):
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def metrics_version(self, market='us', with_valuations=True):
+        valuations_version = ([list(signature) if signature else None for signature in valuation_engine.dataset_version(market)]
+                              if with_valuations else None)
+        return [SCREENER_METRICS_VERSION, derived_metrics_store.version('quarterly', market), valuations_version]
+
+    def get_index(self, market='us'):
+        with self._lock:
+            version = self.metrics_version(market)
+            cached = self._indexes.get(market)
+            if cached is not None:
+                cached_version, index, built_at = cached
+                if cached_version == version:
+                    return index
+                # אינדקס שנבנה בלי הערכות שווי משמש עד הניסיון הבא לטעון אותן
+                if (cached_version[2] is None and cached_version[:2] == version[:2]
+                        and time.monotonic() - built_at < VALUATIONS_RETRY_SECONDS):
+                    return index
+
+            metrics = None
+            if columnar_cache.is_available():
+                metrics = columnar_cache.read_derived_table(SCREENER_TABLE_NAME, market, version)
+            if metrics is None:
+                latest_quarterly = derived_metrics_store.latest_by_ticker('quarterly', market)
+                if latest_quarterly is None:
+                    raise ValueError(f"Quarterly statements for market '{market}' are not available.")
+                try:
+                    valuations, _ = valuation_engine.get_valuations(market)
+                except Exception as e: # הסורק עובד גם בלי מדדי הערכת שווי
+                    print(f"screener.py: Valuations for {market} are not available, screening without them: {e}")
+                    valuations = None
+                metrics = compute_screener_metrics(latest_quarterly, valuations)
+                # בלי הערכות שווי הגרסה לא כוללת את חתימות הקבצים שלהן, והטבלה לא נשמרת בדיסק
+                version = self.metrics_version(market, with_valuations=valuations is not None)
+                if valuations is not None and columnar_cache.is_available():
+                    try:
+                        columnar_cache.write_derived_table(metrics, SCREENER_TABLE_NAME, market, version)
+                    except Exception as e:
+                        print(f"screener.py: Could not persist screener metrics for {market}: {e}")
+
+            index = ScreenerIndex(metrics)
+            self._indexes[market] = (version, index, time.monotonic())
+            return index
+
+    def invalidate(self):
+        with self._lock:
+            self._indexes.clear()
+
+
+screener_engine = ScreenerEngine()
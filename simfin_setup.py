@@ -0,0 +1,58 @@
+# simfin_setup.py
+import os
+import threading
+
+# --- הגדרות API ---
+API_KEY_FILE = 'simfin_api_key.txt' # נשאר כפי שהוא, לניהול מפתח SimFin
+
+SIMFIN_DATA_DIRECTORY = os.path.join(os.path.expanduser('~'), 'simfin_data')
+
+# האם configure_simfin כבר רץ בתהליך הזה (ישירות או דרך ensure_simfin_configured)
+_simfin_configured = False
+_configure_lock = threading.Lock()
+
+def load_simfin_api_key():
+    api_key = 'free'
+    if os.path.exists(API_KEY_FILE):
+        try:
+            with open(API_KEY_FILE, 'r') as f:
+                read_key = f.read().strip()
+            if read_key:
+                api_key = read_key
+        except IOError:
+            print(f"simfin_setup.py: Could not read API key file '{API_KEY_FILE}'. Using 'free'.")
+    return api_key
+
+def configure_simfin(data_directory=None):
+    """
+    Sets the SimFin API key (from API_KEY_FILE, or 'free') and the SimFin data
+    directory. Shared by the Flask app and the command-line tools.
+
+    Args:
+        data_directory (str, optional): Defaults to SIMFIN_DATA_DIRECTORY (~/simfin_data).
+
+    Returns:
+        str: The data directory that was set.
+    """
+    global _simfin_configured
+    import simfin as sf # ייבוא כבד (גורר את pandas) - רק כשבאמת מגדירים את SimFin
+
+    sf.set_api_key(load_simfin_api_key())
+
+    data_directory = data_directory or SIMFIN_DATA_DIRECTORY
+    os.makedirs(data_directory, exist_ok=True)
+    sf.set_data_dir(data_directory)
+    _simfin_configured = True
+    return data_directory
+
+def ensure_simfin_configured():
+    """
+    Runs configure_simfin() with the defaults unless it already ran in this
+    process. Called by the data modules right before they first touch SimFin,
+    so the web app configures SimFin on first use instead of at import.
+    """
+    if _simfin_configured:
+        return
+    with _configure_lock:
+        if not _simfin_configured:
+            configure_simfin()
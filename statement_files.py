@@ -0,0 +1,203 @@
+# statement_files.py
+"""
+Per-ticker statement files under Data/<ticker>/.
+
+All statements and variants of a ticker are kept in one typed Arrow IPC file,
+Data/<ticker>/<ticker>_statements.arrow, with native datetime indexes, compact
+dtypes and rows already sorted, so a load is a single memory-mapped read with
+no text parsing, date coercion, sorting or dtype conversion. The per-statement CSV files
+(<ticker>_<Statement>_<variant>.csv) are written only on request, or when
+pyarrow is not installed; files from older versions are still read.
+"""
+import json
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from frame_compaction import compact_frame
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError: # בלי pyarrow נשארים עם קובצי CSV
+    pa = None
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+PROCESSED_DATA_BASE_DIR = os.path.join(script_dir, 'Data')
+
+STATEMENT_FILE_NAMES = {
+    'income': 'Income_Statement', 'balance': 'Balance_Sheet', 'cashflow': 'Cash_Flow_Statement'
+}
+
+TICKER_STORE_FORMAT_VERSION = 1
+TICKER_STORE_METADATA_KEY = b'simfin_statements'
+FRAME_KEY_COLUMN = '__statement' # עמודה פנימית בקובץ: לאיזה דוח (income_annual וכו') שייכת השורה
+
+#---------------------------------------------------------------------------------------------
+
+def get_statement_file_path(ticker, statement_type_key, variant, base_dir=None):
+    file_statement_name = STATEMENT_FILE_NAMES.get(statement_type_key, f"Unknown_{statement_type_key}")
+    file_name = f"{ticker}_{file_statement_name}_{variant}.csv"
+    ticker_save_dir = os.path.join(base_dir or PROCESSED_DATA_BASE_DIR, ticker)
+    return os.path.join(ticker_save_dir, file_name)
+
+def get_ticker_store_path(ticker, base_dir=None):
+    """Path of the ticker's single binary file holding all of its statements."""
+    return os.path.join(base_dir or PROCESSED_DATA_BASE_DIR, ticker, f"{ticker}_statements.arrow")
+
+def save_statement_csv(df, ticker, statement_type_key, variant, base_dir=None):
+    """
+    Writes one ticker's statement to Data/<ticker>/<ticker>_<Statement>_<variant>.csv.
+
+    Returns:
+        str: The path that was written.
+    """
+    save_path = get_statement_file_path(ticker, statement_type_key, variant, base_dir)
+    os.makedirs(os.path.dirname(save_path), exist_ok=True)
+    if isinstance(df.index, pd.DatetimeIndex) and df.index.name is None:
+        df.index.name = 'Report Date'
+    df.to_csv(save_path, index=True)
+    return save_path
+
+def read_statement_csv(ticker, statement_type_key, variant, base_dir=None):
+    """
+    Reads a statement CSV back, with a datetime index sorted by date.
+    Returns None if the file does not exist; raises if it cannot be parsed.
+    """
+    file_path = get_statement_file_path(ticker, statement_type_key, variant, base_dir)
+    if not os.path.exists(file_path):
+        return None
+    df = pd.read_csv(file_path, index_col=0)
+    if not isinstance(df.index, pd.DatetimeIndex):
+        df.index = pd.to_datetime(df.index, errors='coerce')
+    return df[df.index.notna()].sort_index()
+
+#---------------------------------------------------------------------------------------------
+
+def save_ticker_statements(frames, ticker, base_dir=None, export_csv=False):
+    """
+    Writes all statements of a ticker to its binary store file (atomically
+    replacing the previous one), and optionally also as CSV files.
+
+    Args:
+        frames (dict): {(statement_type_key, variant): DataFrame}; empty frames are skipped.
+        ticker (str): The ticker.
+        base_dir (str, optional): Defaults to PROCESSED_DATA_BASE_DIR.
+        export_csv (bool): Also write the per-statement CSV files.
+
+    Returns:
+        dict: {(statement_type_key, variant): path the statement was saved to}
+    """
+    frames = {key: df for key, df in frames.items() if df is not None and not df.empty}
+    saved_paths = {}
+    if export_csv or pa is None:
+        for (statement_type_key, variant), df in frames.items():
+            saved_paths[(statement_type_key, variant)] = save_statement_csv(df, ticker, statement_type_key, variant, base_dir)
+    if pa is None or not frames:
+        return saved_paths
+
+    # כל הדוחות בטבלה אחת: כל דוח תופס טווח שורות רציף, ורשימת העמודות שלו נשמרת ב-metadata
+    parts = []
+    frames_meta = {}
+    row_count = 0
+    for (statement_type_key, variant), df in frames.items():
+        # dtypes חסכוניים נשמרים בקובץ עצמו, כך שהקריאה לא צריכה לדחוס שוב; קטגוריות נשמרות כמחרוזות ומקודדות כמילון בהמשך
+        df = compact_frame(df.sort_index(), sparse=False)
+        df = df.astype({column: str for column, dtype in df.dtypes.items() if isinstance(dtype, pd.CategoricalDtype)})
+        if isinstance(df.index, pd.DatetimeIndex) and df.index.name is None:
+            df = df.rename_axis('Report Date')
+        index_names = [name for name in df.index.names if name is not None]
+        flat_df = df.reset_index() if index_names else df.reset_index(drop=True)
+        result_key = f"{statement_type_key}_{variant}"
+        # עמודה שחסרה בדוח אחר מקבלת NaN בטבלה המשותפת ו-int הופך שם ל-float; ה-dtype של הדוח עצמו נשמר ומשוחזר בקריאה
+        numeric_dtypes = {str(column): str(dtype) for column, dtype in df.dtypes.items()
+                          if isinstance(dtype, np.dtype) and dtype.kind in 'iufb'}
+        frames_meta[result_key] = {'rows': [row_count, row_count + len(flat_df)], 'index_names': index_names,
+                                   'columns': [str(column) for column in df.columns], 'dtypes': numeric_dtypes}
+        flat_df.insert(0, FRAME_KEY_COLUMN, result_key)
+        parts.append(flat_df)
+        row_count += len(flat_df)
+
+    table = pa.Table.from_pandas(pd.concat(parts, ignore_index=True, sort=False), preserve_index=False)
+    # עמודות טקסט מקודדות כמילון (ב-pandas הן נקראות כ-category)
+    for i, field in enumerate(table.schema):
+        if pa.types.is_string(field.type) or pa.types.is_large_string(field.type):
+            table = table.set_column(i, field.name, pc.dictionary_encode(table.column(i)))
+    store_meta = {'format_version': TICKER_STORE_FORMAT_VERSION, 'ticker': ticker, 'frames': frames_meta}
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}),
+                                           TICKER_STORE_METADATA_KEY: json.dumps(store_meta).encode('utf-8')})
+
+    store_path = get_ticker_store_path(ticker, base_dir)
+    os.makedirs(os.path.dirname(store_path), exist_ok=True)
+    tmp_path = f"{store_path}.{os.getpid()}.tmp"
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, store_path)
+    for key in frames:
+        saved_paths[key] = store_path
+    return saved_paths
+
+def load_ticker_statements(ticker, base_dir=None, frame_keys=None):
+    """
+    Reads the statements of a ticker from its binary store file. The file is
+    memory-mapped, so only the requested statements are actually decoded.
+
+    Args:
+        ticker (str): The ticker.
+        base_dir (str, optional): Defaults to PROCESSED_DATA_BASE_DIR.
+        frame_keys (iterable, optional): (statement_type_key, variant) pairs to read. None = all.
+
+    Returns:
+        dict: {(statement_type_key, variant): DataFrame indexed by Report Date} for the
+              requested statements present in the file, or None if the ticker has no
+              (readable) store file.
+    """
+    store_path = get_ticker_store_path(ticker, base_dir)
+    if pa is None or not os.path.exists(store_path):
+        return None
+    try:
+        with pa.memory_map(store_path, 'r') as source:
+            table = pa.ipc.open_file(source).read_all()
+        store_meta = json.loads(table.schema.metadata[TICKER_STORE_METADATA_KEY])
+    except (IOError, KeyError, ValueError, pa.ArrowInvalid) as e:
+        print(f"statement_files.py: Could not read {store_path}: {e}")
+        return None
+    if store_meta.get('format_version') != TICKER_STORE_FORMAT_VERSION:
+        return None
+
+    wanted = {f"{statement_type_key}_{variant}" for statement_type_key, variant in frame_keys} if frame_keys is not None else None
+    frames = {}
+    for result_key, frame_meta in store_meta['frames'].items():
+        if wanted is not None and result_key not in wanted:
+            continue
+        start, stop = frame_meta['rows']
+        # בחירת העמודות של הדוח עוד ב-Arrow: עמודות של דוחות אחרים לא מומרות
+        frame_table = table.slice(start, stop - start).select(frame_meta['index_names'] + frame_meta['columns'])
+        df = frame_table.to_pandas(ignore_metadata=True) # ה-dtypes משוחזרים מה-metadata שלנו, לא מזה של pandas
+        changed_dtypes = {column: dtype for column, dtype in frame_meta.get('dtypes', {}).items()
+                          if column in df.columns and str(df[column].dtype) != dtype}
+        if changed_dtypes:
+            df = df.astype(changed_dtypes)
+        if frame_meta['index_names']:
+            df = df.set_index(frame_meta['index_names'])
+        statement_type_key, variant = result_key.rsplit('_', 1)
+        frames[(statement_type_key, variant)] = df
+    return frames
+
+def get_statement_file_version(ticker, statement_type_key, variant, base_dir=None):
+    """
+    Returns (version, last_modified) of the file a ticker's statement is read
+    from (its binary store file, else its CSV): the file's mtime in
+    nanoseconds and as a UTC datetime, or (None, None) if neither exists.
+    """
+    for path in (get_ticker_store_path(ticker, base_dir),
+                 get_statement_file_path(ticker, statement_type_key, variant, base_dir)):
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            continue
+        return str(mtime_ns), datetime.fromtimestamp(mtime_ns / 1e9, tz=timezone.utc)
+    return None, None
@@ -0,0 +1,312 @@
+# statement_store.py
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+import numpy as np
+import pandas as pd
+import simfin as sf
+
+import columnar_cache
+from frame_compaction import compact_frame, densify_frame, frame_memory_report
+from simfin_setup import ensure_simfin_configured
+
+#---------------------------------------------------------------------------------------------
+
+# כמו ברירת המחדל של sf.load_*: dataset שהקובץ שלו ישן מזה יורד מחדש בשימוש הבא, גם כשהוא כבר בזיכרון
+DEFAULT_REFRESH_DAYS = 30
+# אחרי ניסיון רענון (מוצלח או לא) של dataset ישן, כמה שניות עד הניסיון הבא
+REFRESH_RETRY_SECONDS = 3600
+
+STATEMENT_LOADERS = {
+    'income': sf.load_income,
+    'balance': sf.load_balance,
+    'cashflow': sf.load_cashflow,
+    'shareprices': sf.load_shareprices # variant 'latest' או 'daily', אינדקס [Ticker, Date]
+}
+
+def get_dataset_file_paths(stmt_key, variant, market='us'):
+    """
+    Returns the files SimFin keeps on disk for a bulk dataset.
+
+    Args:
+        stmt_key (str): 'income', 'balance', 'cashflow' or 'shareprices'.
+        variant (str): 'annual' or 'quarterly' ('latest' or 'daily' for shareprices).
+        market (str): The market (e.g., 'us').
+
+    Returns:
+        tuple: (path of the downloaded zip, path of the extracted CSV).
+    """
+    ensure_simfin_configured()
+    dataset_name = f"{market}-{stmt_key}-{variant}"
+    zip_path = os.path.join(sf.get_download_dir(), f"{dataset_name}.zip")
+    csv_path = os.path.join(sf.get_data_dir(), f"{dataset_name}.csv")
+    return zip_path, csv_path
+
+def get_dataset_signature(stmt_key, variant, market='us'):
+    """
+    Returns (mtime_ns, size) of the dataset's zip under simfin_data/download,
+    or of the extracted CSV if the zip is gone. None if neither exists.
+    """
+    for path in get_dataset_file_paths(stmt_key, variant, market):
+        try:
+            stat_result = os.stat(path)
+        except OSError:
+            continue
+        return (stat_result.st_mtime_ns, stat_result.st_size)
+    return None
+
+def get_dataset_age_days(stmt_key, variant, market='us'):
+    """Age in days of the dataset's extracted CSV (what SimFin's refresh_days compares), or None if it is missing."""
+    csv_path = get_dataset_file_paths(stmt_key, variant, market)[1]
+    try:
+        return (time.time() - os.path.getmtime(csv_path)) / 86400
+    except OSError:
+        return None
+
+#---------------------------------------------------------------------------------------------
+
+def build_ticker_index(ticker_values):
+    """
+    Maps every ticker to the rows it occupies. SimFin sorts its datasets by
+    Ticker, so each ticker is normally one contiguous slice; unsorted input
+    falls back to arrays of row positions.
+    """
+    ticker_values = np.asarray(ticker_values, dtype=object)
+    if len(ticker_values) == 0:
+        return {}
+
+    if pd.Index(ticker_values).is_monotonic_increasing:
+        boundaries = np.flatnonzero(ticker_values[1:] != ticker_values[:-1]) + 1
+        starts = np.concatenate(([0], boundaries))
+        stops = np.concatenate((boundaries, [len(ticker_values)]))
+        return {ticker_values[start]: slice(int(start), int(stop)) for start, stop in zip(starts, stops)}
+
+    return dict(pd.Series(ticker_values).groupby(ticker_values, sort=False).indices)
+
+
+class TickerIndexedDataset:
+    """
+    A whole-market statement dataset with a precomputed Ticker -> rows map,
+    so a single ticker's rows are found with one dict lookup.
+    """
+
+    def __init__(self, df_all):
+        self.df_all = df_all
+        self.ticker_in_index = 'Ticker' in df_all.index.names
+        self.ticker_in_columns = not self.ticker_in_index and 'Ticker' in df_all.columns
+
+        if self.ticker_in_index:
+            self.ticker_rows = build_ticker_index(df_all.index.get_level_values('Ticker'))
+        elif self.ticker_in_columns:
+            self.ticker_rows = build_ticker_index(df_all['Ticker'].to_numpy())
+        else:
+            self.ticker_rows = None
+
+    @property
+    def has_ticker_info(self):
+        return self.ticker_rows is not None
+
+    def tickers(self):
+        return list(self.ticker_rows.keys()) if self.has_ticker_info else []
+
+    def get_rows(self, positions):
+        """The rows at `positions` (list of row numbers) as a DataFrame."""
+        return densify_frame(self.df_all.iloc[positions])
+
+    def memory_report(self):
+        """Footprint of the in-memory frame (see frame_compaction.frame_memory_report)."""
+        return {'backing': 'pandas', **frame_memory_report(self.df_all)}
+
+    def get_ticker(self, ticker):
+        """
+        Returns the rows for one ticker, shaped like `df_all.loc[ticker]`
+        (Ticker level dropped from the index), or an empty DataFrame if the
+        ticker is not in the dataset. Returns None if the dataset has no
+        Ticker information at all. Sparse columns come back dense.
+        """
+        if not self.has_ticker_info:
+            return None
+
+        rows = self.ticker_rows.get(ticker)
+        if rows is None:
+            return pd.DataFrame()
+
+        ticker_df = densify_frame(self.df_all.iloc[rows])
+        if self.ticker_in_index and ticker_df.index.nlevels > 1:
+            ticker_df = ticker_df.droplevel('Ticker')
+        return ticker_df
+
+#---------------------------------------------------------------------------------------------
+
+class StatementStore:
+    """
+    Process-wide cache of the SimFin bulk statement datasets.
+
+    Each (statement, variant, market) dataset is loaded once and kept in
+    memory indexed by Ticker. It is reloaded when its file under
+    simfin_data/download changes on disk, and re-downloaded once its extracted
+    CSV is older than `refresh_days` (as sf.load_* does), so long-lived
+    processes do not keep serving a dataset that SimFin would have refreshed.
+
+    With `use_columnar_cache` (and pyarrow installed) every dataset is also
+    converted once to a memory-mapped Arrow file, so a cold process opens that
+    copy instead of parsing the full market CSV again. Only one process on the
+    machine loads and publishes a dataset at a time (see columnar_cache.publish_lock);
+    worker processes then share the mapped file instead of each keeping a copy.
+
+    With `compact` a dataset held as a pandas frame (no columnar cache) is kept
+    with compact dtypes: categorical text, downcast numbers and sparse
+    mostly-empty line items (see frame_compaction).
+    """
+
+    def __init__(self, loaders=None, use_columnar_cache=True, compact=True, refresh_days=DEFAULT_REFRESH_DAYS):
+        self.loaders = dict(loaders) if loaders else dict(STATEMENT_LOADERS)
+        self.refresh_days = refresh_days
+        self._refresh_attempts = {}
+        self.use_columnar_cache = use_columnar_cache
+        self.compact = compact
+        self._datasets = {}
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def _lock_for(self, key):
+        with self._locks_guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def is_fresh(self, stmt_key, variant, market='us'):
+        """True if the dataset is loaded and its file on disk has not changed since."""
+        cached = self._datasets.get((stmt_key, variant, market))
+        if cached is None:
+            return False
+        signature = get_dataset_signature(stmt_key, variant, market)
+        return signature is not None and signature == cached[0]
+
+    def is_stale(self, stmt_key, variant, market='us'):
+        """True if the dataset's extracted CSV exists but is older than `refresh_days`."""
+        age_days = get_dataset_age_days(stmt_key, variant, market)
+        return self.refresh_days is not None and age_days is not None and age_days >= self.refresh_days
+
+    def requires_download(self, stmt_key, variant, market='us'):
+        """
+        True if get_dataset() would have SimFin fetch the dataset from its server:
+        its extracted CSV is older than `refresh_days`, or it is missing and
+        nothing usable is in memory or in the columnar cache.
+        """
+        if self.is_stale(stmt_key, variant, market):
+            return True
+        if self.is_fresh(stmt_key, variant, market):
+            return False
+        if self.use_columnar_cache and columnar_cache.is_available():
+            signature = get_dataset_signature(stmt_key, variant, market)
+            if columnar_cache.is_columnar_dataset_fresh(stmt_key, variant, market, signature):
+                return False
+        return get_dataset_age_days(stmt_key, variant, market) is None
+
+    def get_dataset(self, stmt_key, variant, market='us'):
+        """
+        Returns the ticker-indexed dataset for a bulk dataset, loading it on
+        first use, after its file changed, or - re-downloading it - once its
+        file is older than `refresh_days`.
+
+        Returns:
+            ArrowTickerDataset or TickerIndexedDataset (same interface),
+            or None if SimFin returned no data.
+        """
+        key = (stmt_key, variant, market)
+        ensure_simfin_configured()
+        # הזיכרון והעותק העמודתי נבדקים רק מול חתימת הקובץ, ולכן הגיל נבדק כאן; ההורדה משנה את החתימה
+        if self.is_stale(stmt_key, variant, market) and time.time() - self._refresh_attempts.get(key, 0) >= REFRESH_RETRY_SECONDS:
+            self._refresh_attempts[key] = time.time()
+            try:
+                self.refresh_dataset(stmt_key, variant, market, self.refresh_days)
+            except Exception as e: # הורדה שנכשלה - ממשיכים עם העותק הקיים ומנסים שוב מאוחר יותר
+                print(f"statement_store.py: Could not refresh {market}-{stmt_key}-{variant}, using the existing copy: {e}")
+        with self._lock_for(key):
+            if self.is_fresh(stmt_key, variant, market):
+                return self._datasets[key][1]
+
+            if not (self.use_columnar_cache and columnar_cache.is_available()):
+                return self._load_from_simfin(stmt_key, variant, market, publish=False)
+
+            signature = get_dataset_signature(stmt_key, variant, market)
+            dataset = columnar_cache.open_columnar_dataset(stmt_key, variant, market, signature)
+            if dataset is None:
+                # תהליך אחד (worker או ingest) טוען ומפרסם; האחרים מחכים על הנעילה ואז ממפים את מה שפורסם
+                with columnar_cache.publish_lock(columnar_cache.get_dataset_name(stmt_key, variant, market)):
+                    signature = get_dataset_signature(stmt_key, variant, market)
+                    dataset = columnar_cache.open_columnar_dataset(stmt_key, variant, market, signature)
+                    if dataset is None:
+                        return self._load_from_simfin(stmt_key, variant, market, publish=True)
+            self._datasets[key] = (signature, dataset)
+            return dataset
+
+    def refresh_dataset(self, stmt_key, variant, market='us', refresh_days=1):
+        """
+        Re-pulls a bulk dataset from SimFin if its extracted CSV is older than
+        `refresh_days`, then republishes and keeps the new copy. Safe to call
+        from several processes: the staleness check is repeated under the
+        publish lock, so only the first one downloads.
+
+        Returns:
+            bool: True if the dataset was reloaded.
+        """
+        def is_stale():
+            age_days = get_dataset_age_days(stmt_key, variant, market)
+            return age_days is None or age_days >= refresh_days
+
+        if not is_stale():
+            return False
+        ensure_simfin_configured()
+        publish = self.use_columnar_cache and columnar_cache.is_available()
+        with self._lock_for((stmt_key, variant, market)):
+            lock = columnar_cache.publish_lock(columnar_cache.get_dataset_name(stmt_key, variant, market)) if publish else nullcontext()
+            with lock:
+                if not is_stale(): # תהליך אחר רענן בזמן שחיכינו לנעילה
+                    return False
+                return self._load_from_simfin(stmt_key, variant, market, publish, refresh_days=refresh_days) is not None
+
+    def _load_from_simfin(self, stmt_key, variant, market, publish, refresh_days=None):
+        """Loads a dataset with SimFin (downloading it if needed), publishes its columnar copy and keeps it."""
+        key = (stmt_key, variant, market)
+        # refresh_days מועבר רק ברענון יזום; אחרת נשארת ברירת המחדל של SimFin (30 יום)
+        load_options = {'refresh_days': refresh_days} if refresh_days is not None else {}
+        df_all = self.loaders[stmt_key](variant=variant, market=market, **load_options)
+        if df_all is None:
+            self._datasets.pop(key, None)
+            return None
+
+        signature = get_dataset_signature(stmt_key, variant, market)
+        dataset = None
+        if publish:
+            try:
+                columnar_cache.write_columnar_dataset(df_all, stmt_key, variant, market, signature)
+                dataset = columnar_cache.open_columnar_dataset(stmt_key, variant, market, signature)
+            except Exception as e:
+                print(f"statement_store.py: Could not build columnar cache for {market}-{stmt_key}-{variant}: {e}")
+        if dataset is None:
+            dataset = TickerIndexedDataset(compact_frame(df_all) if self.compact else df_all)
+        self._datasets[key] = (signature, dataset)
+        return dataset
+
+    def get_ticker_frame(self, stmt_key, variant, ticker, market='us'):
+        """Shortcut for get_dataset(...).get_ticker(ticker); None if the dataset failed to load."""
+        dataset = self.get_dataset(stmt_key, variant, market)
+        if dataset is None:
+            return None
+        return dataset.get_ticker(ticker.upper())
+
+    def memory_report(self):
+        """Footprint of every dataset this process holds, by dataset name."""
+        return {columnar_cache.get_dataset_name(stmt_key, variant, market): dataset.memory_report()
+                for (stmt_key, variant, market), (_, dataset) in list(self._datasets.items())}
+
+    def invalidate(self, stmt_key=None, variant=None, market=None):
+        """Drops cached datasets matching the given filters (all of them by default)."""
+        for key in list(self._datasets.keys()):
+            if (stmt_key in (None, key[0])) and (variant in (None, key[1])) and (market in (None, key[2])):
+                self._datasets.pop(key, None)
+
+
+statement_store = StatementStore()
@@ -0,0 +1,66 @@
+# tests/conftest.py
+import os
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.join(REPO_ROOT, 'benchmarks'))
+
+# ה-fixtures בונים נתונים סינתטיים (benchmarks/synthetic_data.py) - אף בדיקה לא ניגשת לרשת
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """A temporary Data/ directory for the per-ticker files, prices, valuation series and job statuses."""
+    import ingest
+    import ingest_jobs
+    import price_store
+    import statement_files
+    import valuation_history
+    data_dir = str(tmp_path / 'Data')
+    # התיקייה נלכדת בזמן הייבוא (ב-import של השם ובמופעים הגלובליים), אז מחליפים אותה בכל מקום
+    for module in (statement_files, ingest, price_store, valuation_history, ingest_jobs):
+        monkeypatch.setattr(module, 'PROCESSED_DATA_BASE_DIR', data_dir)
+    job_status_dir = os.path.join(data_dir, '.ingest_jobs')
+    monkeypatch.setattr(ingest_jobs, 'JOB_STATUS_DIR', job_status_dir)
+    monkeypatch.setattr(ingest_jobs.ingest_job_queue, 'status_dir', job_status_dir)
+    monkeypatch.setattr(price_store.price_store, 'base_dir', data_dir)
+    monkeypatch.setattr(valuation_history.valuation_history_store, 'base_dir', data_dir)
+    return data_dir
+
+
+@pytest.fixture(scope='session')
+def synthetic_market(tmp_path_factory):
+    """SimFin bulk files of a small synthetic market, with SimFin pointed at them; returns the tickers."""
+    import simfin_setup
+    from synthetic_data import write_simfin_bulk_files
+    simfin_dir = str(tmp_path_factory.mktemp('simfin_data'))
+    tickers = write_simfin_bulk_files(simfin_dir, 30)
+    simfin_setup.configure_simfin(simfin_dir)
+    return tickers
+
+
+@pytest.fixture
+def client(synthetic_market, data_dir):
+    """Test client of an app built by create_app() over the synthetic market."""
+    import SimFinFund
+    from chart_cache import chart_payload_cache
+    chart_payload_cache.invalidate()
+    app = SimFinFund.create_app({'TESTING': True})
+    return app.test_client()
+
+
+@pytest.fixture
+def price_source(synthetic_market, data_dir, monkeypatch):
+    """Serves synthetic daily bars of the synthetic market through the global price_store (no yfinance)."""
+    from collections import OrderedDict
+    import price_store
+    from synthetic_data import make_price_history
+    source = price_store.StaticPriceSource({ticker: make_price_history(2600, seed=i)
+                                            for i, ticker in enumerate(synthetic_market)})
+    monkeypatch.setattr(price_store.price_store, 'source', source)
+    monkeypatch.setattr(price_store.price_store, '_entries', OrderedDict())
+    monkeypatch.setattr(price_store.price_store, 'current_bytes', 0)
+    return source
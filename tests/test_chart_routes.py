@@ -0,0 +1,111 @@
+# tests/test_chart_routes.py
+import peer_comparison
+
+
+def count_calls(monkeypatch, module, name):
+    calls = []
+    original = getattr(module, name)
+
+    def counted(*args, **kwargs):
+        calls.append(args)
+        return original(*args, **kwargs)
+    monkeypatch.setattr(module, name, counted)
+    return calls
+
+
+def test_peer_chart_cache_hit_skips_the_data_load(client, synthetic_market, monkeypatch):
+    calls = count_calls(monkeypatch, peer_comparison, 'build_peer_comparison')
+    url = f"/charts/peers?tickers={','.join(synthetic_market[:5])},NOPE&metric=revenue&variant=quarterly"
+    first = client.get(url)
+    assert first.status_code == 200 and 'NOPE' in first.get_json()['layout']['title']['text']
+    second = client.get(url)
+    assert second.status_code == 200 and second.data == first.data
+    assert len(calls) == 1
+
+
+def test_peer_routes_with_an_all_nan_metric(client, synthetic_market, monkeypatch):
+    tickers = synthetic_market[:2]
+
+    class AllNanStore:
+        def get_tickers_metrics(self, tickers, variant, market='us'):
+            from derived_metrics import derived_metrics_store
+            metrics, missing = derived_metrics_store.get_tickers_metrics(tickers, variant, market)
+            metrics['gross_margin'] = float('nan')
+            return metrics, missing
+    original = peer_comparison.build_peer_comparison
+    monkeypatch.setattr(peer_comparison, 'build_peer_comparison',
+                        lambda t, m, v, market='us': original(t, m, v, market, metrics_store=AllNanStore()))
+
+    response = client.get(f"/api/peers?tickers={','.join(tickers)}&metric=gross_margin")
+    assert response.status_code == 200
+    assert response.get_json()['missing'] == tickers and response.get_json()['series'] == {}
+    assert client.get(f"/charts/peers?tickers={','.join(tickers)}&metric=gross_margin").status_code == 404
+
+
+def test_statement_chart_cache_hit_skips_the_data_load(client, synthetic_market, monkeypatch):
+    from derived_metrics import derived_metrics_store
+    calls = count_calls(monkeypatch, derived_metrics_store, 'get_ticker_metrics')
+    with client.session_transaction() as flask_session:
+        flask_session['current_ticker'] = synthetic_market[0]
+    first = client.get('/charts/annual_revenue')
+    assert first.status_code == 200
+    second = client.get('/charts/annual_revenue')
+    assert second.status_code == 200 and second.data == first.data
+    assert len(calls) == 1
+
+
+def test_metrics_report_the_loaded_datasets(client, synthetic_market):
+    from statement_store import statement_store
+    assert statement_store.get_dataset('income', 'annual') is not None
+    metrics = client.get('/metrics').get_data(as_text=True)
+    gauges = dict(line.rsplit(' ', 1) for line in metrics.splitlines() if line.startswith('simfin_dataset'))
+    assert float(gauges['simfin_dataset_bytes_us_income_annual']) > 0
+    assert float(gauges['simfin_datasets_bytes']) >= float(gauges['simfin_dataset_bytes_us_income_annual'])
+
+
+def test_metrics_report_the_frame_cache(client):
+    from frame_cache import frame_cache
+    metrics = client.get('/metrics').get_data(as_text=True)
+    for name, value in frame_cache.stats().items():
+        assert f'simfin_frame_cache_{name} {value}' in metrics
+
+
+def test_price_api_downsamples_the_requested_range(client, synthetic_market, price_source):
+    ticker = synthetic_market[0]
+    response = client.get(f"/api/prices?ticker={ticker}&period=5y&points=120&ma=20,200")
+    assert response.status_code == 200
+    payload = response.get_json()
+    assert payload['bucketed'] and payload['total_bars'] > 1000
+    assert len(payload['candles']['x']) <= 120
+    assert [line['name'] for line in payload['moving_averages']] == ['MA20', 'MA200']
+    assert all(len(line['x']) <= 120 for line in payload['moving_averages'])
+
+    # טווח צר מחזיר את הברים עצמם, בלי דילול
+    ranged = client.get(f"/api/prices?ticker={ticker}&period=5y&points=120&start=2025-04-01&end=2025-04-30").get_json()
+    assert not ranged['bucketed'] and len(ranged['candles']['x']) == ranged['total_bars'] <= 22
+    assert ranged['candles']['x'][0] >= '2025-04-01' and ranged['candles']['x'][-1] <= '2025-04-30'
+
+    again = client.get(f"/api/prices?ticker={ticker}&period=5y&points=120&ma=20,200",
+                       headers={'If-None-Match': response.headers['ETag']})
+    assert again.status_code == 304
+
+
+def test_price_api_rejects_bad_arguments(client, synthetic_market, price_source):
+    ticker = synthetic_market[0]
+    assert client.get(f"/api/prices?ticker={ticker}&points=many").status_code == 400
+    assert client.get(f"/api/prices?ticker={ticker}&period=7w").status_code == 400
+    assert client.get(f"/api/prices?ticker={ticker}&start=not-a-date").status_code == 400
+    assert client.get("/api/prices?ticker=NOPE").status_code == 404
+
+
+def test_graphs_page_shows_the_data_messages(client, synthetic_market, monkeypatch):
+    from derived_metrics import derived_metrics_store
+    with client.session_transaction() as flask_session:
+        flask_session['current_ticker'] = synthetic_market[0]
+    page = client.get('/graphs/annual').get_data(as_text=True)
+    assert 'id="debug_messages"' in page and 'שגיאת נתונים: No' not in page
+
+    # בלי נתוני השוק ובלי קבצים של הטיקר - השגיאה מוצגת כמו בדף המקורי
+    monkeypatch.setattr(derived_metrics_store, 'version', lambda variant, market='us': [0, None, None])
+    page = client.get('/graphs/annual').get_data(as_text=True)
+    assert 'שגיאת נתונים: No annual income data available to generate graphs.' in page
@@ -0,0 +1,102 @@
+# tests/test_derived_metrics.py
+import threading
+
+import numpy as np
+from pandas.testing import assert_frame_equal, assert_series_equal
+
+import columnar_cache
+import derived_metrics
+from derived_metrics import DerivedMetricsStore, _positive_streak, compute_derived_metrics
+from synthetic_data import make_statement_frame
+
+TICKERS = ['AAA', 'BBB', 'CCC']
+
+
+def quarterly_metrics(drop_rows=()):
+    income = make_statement_frame(TICKERS, 'income', 'quarterly').drop(index=list(drop_rows))
+    cashflow = make_statement_frame(TICKERS, 'cashflow', 'quarterly')
+    return income, compute_derived_metrics(income, cashflow, 'quarterly')
+
+
+def test_ttm_and_growth_match_a_per_ticker_rolling_reference():
+    income, metrics = quarterly_metrics()
+    net_income = income.set_index(['Ticker', 'Report Date'])['Net Income (Common)'].sort_index()
+    by_ticker = net_income.groupby(level='Ticker')
+    expected_ttm = by_ticker.rolling(4).sum().droplevel(0)
+    assert_series_equal(metrics['net_income_ttm'], expected_ttm, check_names=False, check_index_type=False)
+
+    previous_year = by_ticker.shift(4)
+    expected_yoy = (net_income / previous_year - 1).where(previous_year > 0)
+    assert_series_equal(metrics['net_income_growth_yoy'], expected_yoy, check_names=False, check_index_type=False)
+    # הרבעונים הראשונים של כל טיקר אינם נשענים על נתוני הטיקר הקודם
+    assert metrics.loc['BBB']['revenue_ttm'].iloc[:3].isna().all()
+
+
+def test_a_missing_quarter_breaks_ttm_and_qoq():
+    income, _ = quarterly_metrics()
+    gap_row = income.index[(income['Ticker'] == 'AAA')][20]
+    gap_date = income.loc[gap_row, 'Report Date']
+    _, metrics = quarterly_metrics(drop_rows=[gap_row])
+    after_gap = metrics.loc['AAA'].loc[gap_date:]
+    assert after_gap['revenue_ttm'].iloc[:3].isna().all() and after_gap['revenue_ttm'].iloc[3:].notna().all()
+    assert np.isnan(after_gap['revenue_growth_qoq'].iloc[0]) and not np.isnan(after_gap['revenue_growth_qoq'].iloc[1])
+
+
+def test_positive_streak_restarts_per_ticker_and_after_a_loss():
+    values = np.array([1.0, 2.0, -1.0, 3.0, 4.0, 5.0, 1.0, np.nan, 2.0])
+    tickers = np.array(['A'] * 6 + ['B'] * 3, dtype=object)
+    assert list(_positive_streak(values, tickers)) == [1, 2, 0, 1, 2, 3, 1, 0, 1]
+
+
+def test_annual_variant_has_no_quarterly_metrics():
+    income = make_statement_frame(TICKERS, 'income', 'annual')
+    metrics = compute_derived_metrics(income, None, 'annual')
+    assert 'revenue_ttm' not in metrics.columns and metrics['fcf'].isna().all()
+    expected_margin = (income['Gross Profit'] / income['Revenue']).to_numpy()
+    np.testing.assert_allclose(metrics['gross_margin'].to_numpy(), expected_margin)
+
+
+def test_market_table_is_built_once_and_shared(synthetic_market):
+    builder = DerivedMetricsStore()
+    table = builder.get_table('quarterly')
+    assert len(table.ticker_rows) == len(synthetic_market)
+    ticker = synthetic_market[3]
+    expected = builder.get_ticker_metrics(ticker, 'quarterly')
+    assert not expected.empty and builder.get_table('quarterly') is table
+
+    # מופע אחר (תהליך אחר) ממפה את הטבלה שפורסמה במקום לחשב אותה שוב
+    reader = DerivedMetricsStore()
+    assert_frame_equal(reader.get_ticker_metrics(ticker.lower(), 'quarterly'), expected)
+    if columnar_cache.is_available():
+        assert reader.last_build_seconds == {}
+
+    metrics, missing = reader.get_tickers_metrics([synthetic_market[0], 'NOPE', ticker], 'quarterly')
+    assert missing == ['NOPE']
+    assert list(metrics.index.get_level_values('Ticker').unique()) == [synthetic_market[0], ticker]
+    latest = reader.latest_by_ticker('quarterly')
+    assert_series_equal(latest.loc[ticker], expected.iloc[-1], check_names=False)
+
+
+def test_a_build_that_needs_a_download_runs_in_the_background(synthetic_market, monkeypatch):
+    from statement_store import statement_store
+    download_done = threading.Event()
+
+    class DownloadingStore:
+        def requires_download(self, stmt_key, variant, market='us'):
+            return True
+
+        def get_dataset(self, stmt_key, variant, market='us'):
+            download_done.wait(10) # "הורדה" שנמשכת עד שהבדיקה משחררת אותה
+            return statement_store.get_dataset(stmt_key, variant, market)
+    monkeypatch.setattr(derived_metrics.columnar_cache, 'is_available', lambda: False)
+    store = DerivedMetricsStore(DownloadingStore())
+
+    # הבקשה לא מחכה להורדה, ובקשה נוספת לא מתחילה בנייה שנייה
+    assert store.get_table('quarterly') is None
+    build_thread = store._background_builds[('quarterly', 'us')][0]
+    assert store.get_ticker_metrics(synthetic_market[0], 'quarterly') is None
+    assert store._background_builds[('quarterly', 'us')][0] is build_thread
+
+    download_done.set()
+    build_thread.join(10)
+    assert not store.get_ticker_metrics(synthetic_market[0], 'quarterly').empty
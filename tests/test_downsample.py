@@ -0,0 +1,47 @@
+# tests/test_downsample.py
+import numpy as np
+
+from downsample import aggregate_ohlc_buckets, downsample_prices, lttb_indices, lttb_series
+from moving_averages import compute_moving_averages
+from synthetic_data import make_price_history
+
+
+def test_ohlc_buckets_keep_the_real_extremes():
+    bars = make_price_history(1000)
+    candles = aggregate_ohlc_buckets(bars, 90)
+    assert len(candles) == 90 and candles.index[0] == bars.index[0]
+    assert candles['High'].max() == bars['High'].max() and candles['Low'].min() == bars['Low'].min()
+    assert candles['Open'].iloc[0] == bars['Open'].iloc[0] and candles['Close'].iloc[-1] == bars['Close'].iloc[-1]
+    assert candles['Volume'].sum() == bars['Volume'].sum()
+    # כל נר מכסה את הברים שמתאריך ההתחלה שלו ועד הנר הבא
+    positions = bars.index.get_indexer(candles.index)
+    second = bars.iloc[positions[1]:positions[2]]
+    assert candles['High'].iloc[1] == second['High'].max() and candles['Close'].iloc[1] == second['Close'].iloc[-1]
+
+
+def test_small_inputs_are_returned_as_is():
+    bars = make_price_history(50)
+    assert aggregate_ohlc_buckets(bars, 100).equals(bars[['Open', 'High', 'Low', 'Close', 'Volume']])
+    assert list(lttb_indices(np.arange(5.0), np.arange(5.0), 10)) == list(range(5))
+
+
+def test_lttb_keeps_the_ends_and_the_peaks():
+    x = np.arange(1000, dtype=float)
+    y = np.sin(x / 50)
+    y[437] = 10.0 # קפיצה חדה אחת חייבת להישאר בגרף
+    positions = lttb_indices(x, y, 100)
+    assert len(positions) == 100 and positions[0] == 0 and positions[-1] == 999
+    assert np.all(np.diff(positions) > 0) and 437 in positions
+
+
+def test_downsample_prices_cuts_the_range_and_skips_ma_warmup():
+    bars = make_price_history(2000)
+    bars = bars.join(compute_moving_averages(bars['Close'], sma_windows=[200]))
+    start, end = bars.index[300].strftime('%Y-%m-%d'), bars.index[1800].strftime('%Y-%m-%d')
+    payload = downsample_prices(bars, target_points=200, ma_columns=['MA200', 'MA50'], start=start, end=end)
+    assert payload['total_bars'] == 1501 and payload['bucketed'] and len(payload['candles']) == 200
+    assert list(payload['moving_averages']) == ['MA200']
+    assert len(payload['moving_averages']['MA200']) == 200
+
+    warmup = lttb_series(bars['MA200'].iloc[:400], 50)
+    assert len(warmup) == 50 and warmup.notna().all() and warmup.index[0] == bars.index[199]
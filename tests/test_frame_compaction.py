@@ -0,0 +1,32 @@
+# tests/test_frame_compaction.py
+import numpy as np
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+from frame_compaction import compact_frame, densify_frame
+from synthetic_data import make_statement_frame
+
+
+def test_compaction_round_trip_keeps_every_value():
+    df = make_statement_frame(['AAA', 'BBB', 'CCC'], 'income', 'quarterly')
+    compact = compact_frame(df)
+    assert str(compact['Ticker'].dtype) == 'category'
+    assert any(isinstance(dtype, pd.SparseDtype) for dtype in compact_frame(df, sparse_min_empty_fraction=0.0).dtypes)
+    restored = densify_frame(compact).astype(df.dtypes.to_dict())
+    assert_frame_equal(restored, df)
+
+
+def test_whole_number_floats_stay_floats():
+    # ערכים שלמים שנכנסים ב-int32 עדיין לא הופכים ל-int: סכום שלהם היה גולש בשקט
+    df = pd.DataFrame({'Revenue': np.full(4, 2e9), 'Shares': [1.0, 2.0, 3.0, 4.0]})
+    compact = compact_frame(df, sparse=False)
+    assert compact['Revenue'].dtype == np.float32 and compact['Shares'].dtype == np.float32
+    assert compact['Revenue'].sum() == 8e9
+
+
+def test_lossy_floats_and_small_ints():
+    df = pd.DataFrame({'Price': [0.1, 0.2, 0.3], 'Year': np.array([2022, 2023, 2024], dtype=np.int64)})
+    compact = compact_frame(df, sparse=False)
+    assert compact['Price'].dtype == np.float64 # 0.1 לא נשמר במדויק ב-float32
+    assert compact['Year'].dtype == np.int16
+    assert_frame_equal(compact.astype(df.dtypes.to_dict()), df)
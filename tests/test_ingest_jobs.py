@@ -0,0 +1,99 @@
+# tests/test_ingest_jobs.py
+import os
+import threading
+
+import columnar_cache
+import ingest_jobs
+
+
+def test_bulk_refresh_is_skipped_while_another_process_refreshes(synthetic_market):
+    with columnar_cache.try_exclusive_lock(ingest_jobs.BULK_REFRESH_LOCK_NAME) as acquired:
+        assert acquired
+        # flock חל על כל פתיחה של הקובץ, כך שגם באותו תהליך הנעילה תפוסה
+        assert ingest_jobs.refresh_bulk_datasets(refresh_days=1e9) is None
+    report = ingest_jobs.refresh_bulk_datasets(refresh_days=1e9)
+    assert report is not None and report['refreshed'] == []
+
+
+def test_bulk_refresh_runs_daily_by_default_but_not_under_testing(monkeypatch):
+    import SimFinFund
+    started = []
+    monkeypatch.delenv('BULK_REFRESH_INTERVAL_SECONDS', raising=False)
+    monkeypatch.setattr(SimFinFund, 'start_bulk_refresh', lambda *args: started.append(args))
+    SimFinFund.create_app({'TESTING': True})
+    SimFinFund.create_app({'BULK_REFRESH_INTERVAL_SECONDS': 0})
+    assert not started
+    SimFinFund.create_app()
+    assert started == [(24 * 3600, 1)]
+
+
+def test_requests_for_a_pending_ticker_share_one_job():
+    release = threading.Event()
+    runs = []
+
+    def run_job(ticker, market):
+        runs.append(ticker)
+        release.wait(5)
+        return {'income_annual': 'Saved'}, True
+    job_queue = ingest_jobs.IngestJobQueue(run_job=run_job, workers=1, status_dir=None)
+
+    job = job_queue.submit('aaa')
+    assert job_queue.submit(' AAA ') is job and job.requests == 2
+    other_job = job_queue.submit('BBB')
+    assert other_job is not job
+    assert job_queue.stats()['coalesced'] == 1 and job_queue.stats()['submitted'] == 2
+
+    release.set()
+    assert job.wait(5) and other_job.wait(5)
+    assert job.status == ingest_jobs.JOB_DONE and job_queue.get(job.job_id)['results'] == {'income_annual': 'Saved'}
+    # אחרי שהעבודה הסתיימה, בקשה חדשה פותחת עבודה חדשה
+    assert job_queue.submit('AAA') is not job
+    assert job_queue.get('unknown') is None
+
+
+def test_failed_save_keeps_the_cached_frames(synthetic_market, data_dir, monkeypatch):
+    from frame_cache import frame_cache, frame_cache_key
+    ticker = synthetic_market[0]
+    cache_key = frame_cache_key(ticker, 'income', 'annual')
+    frame_cache.invalidate(ticker)
+    cached_df = ingest_jobs.statement_store.get_ticker_frame('income', 'annual', ticker)
+    frame_cache.put(cache_key, cached_df)
+
+    save_ticker_statements = ingest_jobs.save_ticker_statements
+
+    def failing_save(*args, **kwargs):
+        raise IOError("disk full")
+    monkeypatch.setattr(ingest_jobs, 'save_ticker_statements', failing_save)
+    statuses, any_success = ingest_jobs.ingest_ticker(ticker)
+    assert not any_success and 'disk full' in statuses['income_annual']
+    assert frame_cache.get(cache_key) is cached_df
+
+    monkeypatch.setattr(ingest_jobs, 'save_ticker_statements', save_ticker_statements)
+    statuses, any_success = ingest_jobs.ingest_ticker(ticker)
+    assert any_success and frame_cache.get(cache_key) is not cached_df
+
+
+def test_bulk_refresh_includes_the_latest_share_prices(synthetic_market, monkeypatch):
+    refreshed = []
+    monkeypatch.setattr(ingest_jobs, 'get_dataset_age_days', lambda stmt_key, variant, market: 5.0)
+    monkeypatch.setattr(ingest_jobs.downloader.simfin_download_limiter, 'acquire', lambda: None)
+    monkeypatch.setattr(ingest_jobs.statement_store, 'refresh_dataset',
+                        lambda stmt_key, variant, market, refresh_days: refreshed.append((stmt_key, variant)) or True)
+    report = ingest_jobs.refresh_bulk_datasets(refresh_days=1)
+    assert ('shareprices', 'latest') in refreshed and len(refreshed) == 7
+    assert 'shareprices_latest' in report['refreshed']
+
+
+def test_valuations_follow_a_share_price_refresh(synthetic_market):
+    from statement_store import get_dataset_file_paths
+    from valuation import valuation_engine
+    first, _ = valuation_engine.get_valuations()
+    assert valuation_engine.get_valuations()[0] is first
+
+    csv_path = get_dataset_file_paths('shareprices', 'latest')[1]
+    stat_result = os.stat(csv_path)
+    try:
+        os.utime(csv_path, ns=(stat_result.st_atime_ns, stat_result.st_mtime_ns + 10 ** 9)) # כמו הורדה חדשה
+        assert valuation_engine.get_valuations()[0] is not first
+    finally:
+        os.utime(csv_path, ns=(stat_result.st_atime_ns, stat_result.st_mtime_ns))
@@ -0,0 +1,35 @@
+# tests/test_moving_averages.py
+import numpy as np
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+from moving_averages import compute_moving_averages, update_moving_averages
+from synthetic_data import make_price_history
+
+SMA_WINDOWS = [5, 20, 50]
+EMA_WINDOWS = [12, 26]
+
+
+def rolling_reference(close):
+    columns = {f'MA{w}': close.rolling(w).mean() for w in SMA_WINDOWS}
+    columns.update({f'EMA{w}': close.ewm(span=w, adjust=False).mean() for w in EMA_WINDOWS})
+    return pd.DataFrame(columns, index=close.index)
+
+
+def test_one_pass_matches_pandas_rolling_including_gaps():
+    close = make_price_history(300)['Close']
+    close.iloc[[10, 11, 150]] = np.nan
+    averages = compute_moving_averages(close, sma_windows=SMA_WINDOWS + [0, 500], ema_windows=EMA_WINDOWS)
+    assert list(averages.columns) == ['MA5', 'MA20', 'MA50', 'MA500'] + [f'EMA{w}' for w in EMA_WINDOWS]
+    assert averages['MA500'].isna().all()
+    assert_frame_equal(averages.drop(columns='MA500'), rolling_reference(close), check_exact=False, rtol=1e-9)
+
+
+def test_incremental_update_matches_a_full_recompute():
+    bars = make_price_history(400)
+    stored = bars.iloc[:350].join(compute_moving_averages(bars['Close'].iloc[:350], SMA_WINDOWS, EMA_WINDOWS))
+    # הבר האחרון שנשמר היה חלקי: גם הוא מוחלף
+    merged = pd.concat([stored.iloc[:349], bars.iloc[349:]])
+    update_moving_averages(merged, 349, sma_windows=SMA_WINDOWS, ema_windows=EMA_WINDOWS)
+    expected = rolling_reference(bars['Close'])
+    assert_frame_equal(merged[expected.columns], expected, check_exact=False, rtol=1e-9)
@@ -0,0 +1,83 @@
+# tests/test_peer_comparison.py
+import numpy as np
+import pandas as pd
+import pytest
+
+import peer_comparison
+
+
+def make_metrics(rows):
+    """Derived-metrics frame indexed by [Ticker, Report Date] from (ticker, report date, values dict) rows."""
+    index = pd.MultiIndex.from_arrays([[r[0] for r in rows], pd.to_datetime([r[1] for r in rows])],
+                                      names=['Ticker', 'Report Date'])
+    return pd.DataFrame([r[2] for r in rows], index=index)
+
+
+class StubMetricsStore:
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.calls = 0
+
+    def get_tickers_metrics(self, tickers, variant, market='us'):
+        self.calls += 1
+        present = set(self.metrics.index.get_level_values('Ticker'))
+        return self.metrics[self.metrics.index.get_level_values('Ticker').isin(tickers)], [t for t in tickers if t not in present]
+
+
+def test_calendar_periods_use_the_midpoint_of_the_fiscal_period():
+    periods = peer_comparison.calendar_periods(pd.to_datetime(['2023-01-31', '2023-03-31', '2023-04-30']), 'quarterly')
+    assert [str(p) for p in periods] == ['2022Q4', '2023Q1', '2023Q1']
+    years = peer_comparison.calendar_periods(pd.to_datetime(['2023-09-30', '2023-03-31']), 'annual')
+    assert [str(p) for p in years] == ['2023', '2022']
+
+
+def test_align_fiscal_periods_lines_up_different_fiscal_year_ends():
+    metrics = make_metrics([
+        ('A', '2023-01-31', {'revenue': 1.0}), ('A', '2023-04-30', {'revenue': 2.0}),
+        ('B', '2022-12-31', {'revenue': 3.0}), ('B', '2023-03-31', {'revenue': 4.0}),
+    ])
+    values, report_dates = peer_comparison.align_fiscal_periods(metrics, 'revenue', 'quarterly', ['B', 'A'])
+    assert list(values.columns) == ['B', 'A']
+    assert [str(p) for p in values.index] == ['2022Q4', '2023Q1']
+    assert values.dtypes.eq(np.float64).all()
+    assert values.loc[pd.Period('2022Q4'), 'A'] == 1.0 and values.loc[pd.Period('2023Q1'), 'B'] == 4.0
+    assert report_dates.loc[pd.Period('2023Q1'), 'A'] == pd.Timestamp('2023-04-30')
+
+
+def test_align_fiscal_periods_keeps_the_later_period_in_a_shared_calendar_period():
+    # שינוי סוף שנת הכספים: שני רבעונים פיסקליים נופלים באותו רבעון קלנדרי
+    metrics = make_metrics([('A', '2023-02-28', {'revenue': 1.0}), ('A', '2023-03-31', {'revenue': 2.0})])
+    values, _ = peer_comparison.align_fiscal_periods(metrics, 'revenue', 'quarterly')
+    assert values['A'].tolist() == [2.0]
+
+
+def test_all_nan_metric_reports_every_ticker_missing():
+    metrics = make_metrics([('BANK1', '2023-03-31', {'gross_margin': np.nan}),
+                            ('BANK2', '2023-03-31', {'gross_margin': np.nan})])
+    values, report_dates = peer_comparison.align_fiscal_periods(metrics, 'gross_margin', 'quarterly')
+    assert values.empty and report_dates.empty
+
+    values, report_dates, missing = peer_comparison.build_peer_comparison(
+        ['BANK1', 'BANK2'], 'gross_margin', 'quarterly', metrics_store=StubMetricsStore(metrics))
+    assert values.empty and missing == ['BANK1', 'BANK2']
+    assert peer_comparison.peer_comparison_payload(values, report_dates) == {'periods': [], 'series': {}}
+
+
+def test_build_peer_comparison_uses_one_lookup_and_lists_unknown_tickers():
+    store = StubMetricsStore(make_metrics([('A', '2023-03-31', {'revenue': 1.0}), ('B', '2023-03-31', {'revenue': 2.0})]))
+    values, _, missing = peer_comparison.build_peer_comparison(['A', 'B', 'NOPE'], 'revenue', 'quarterly',
+                                                               metrics_store=store)
+    assert store.calls == 1
+    assert list(values.columns) == ['A', 'B'] and missing == ['NOPE']
+
+
+def test_parse_and_validate_arguments():
+    assert peer_comparison.parse_peer_tickers('aapl, msft  aapl;goog') == ['AAPL', 'MSFT', 'GOOG']
+    with pytest.raises(ValueError):
+        peer_comparison.parse_peer_tickers(' , ')
+    with pytest.raises(ValueError):
+        peer_comparison.parse_peer_tickers(','.join(f'T{i}' for i in range(peer_comparison.MAX_PEER_TICKERS + 1)))
+    with pytest.raises(ValueError):
+        peer_comparison.validate_peer_metric('revenue_ttm', 'annual')
+    with pytest.raises(ValueError):
+        peer_comparison.validate_peer_metric('revenue', 'monthly')
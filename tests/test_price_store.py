@@ -0,0 +1,31 @@
+# tests/test_price_store.py
+from pandas.testing import assert_frame_equal
+
+from frame_cache import estimate_frame_bytes
+from price_store import PriceStore, StaticPriceSource
+from synthetic_data import make_price_history
+
+
+def make_store(tmp_path, tickers, max_bytes):
+    source = StaticPriceSource({ticker: make_price_history(300, seed=i) for i, ticker in enumerate(tickers)})
+    return PriceStore(source=source, base_dir=str(tmp_path), max_bytes=max_bytes), source
+
+
+def test_histories_in_memory_stay_within_the_byte_budget(tmp_path):
+    one_history_bytes = estimate_frame_bytes(make_price_history(300))
+    store, source = make_store(tmp_path, ['AAA', 'BBB', 'CCC'], max_bytes=int(one_history_bytes * 2.5))
+    first = {ticker: store.get_history(ticker, period='1y') for ticker in ('AAA', 'BBB', 'CCC')}
+    assert len(store._entries) == 2 and store.evictions == 1
+    assert store.current_bytes <= store.max_bytes
+    assert list(store._entries) == [('BBB', '1d'), ('CCC', '1d')]
+
+    # ההיסטוריה שנזרקה נקראת שוב מהדיסק, בלי הורדה נוספת
+    fetches = len(source.fetch_calls)
+    assert_frame_equal(store.get_history('AAA', period='1y'), first['AAA'])
+    assert len(source.fetch_calls) == fetches
+
+
+def test_history_larger_than_the_budget_is_not_kept_in_memory(tmp_path):
+    store, _ = make_store(tmp_path, ['AAA'], max_bytes=1024)
+    assert not store.get_history('AAA', period='1y', moving_averages=[20]).empty
+    assert not store._entries and store.current_bytes == 0
@@ -0,0 +1,89 @@
+# tests/test_screener.py
+import numpy as np
+import pandas as pd
+import pytest
+
+import screener
+from screener import ScreenerEngine, ScreenerIndex
+
+
+def test_index_without_valuations_when_they_fail_to_load(synthetic_market, monkeypatch):
+    get_valuations = screener.valuation_engine.get_valuations
+
+    def failing_get_valuations(market='us'):
+        raise IOError("share prices are not available")
+    written = []
+    monkeypatch.setattr(screener.valuation_engine, 'get_valuations', failing_get_valuations)
+    monkeypatch.setattr(screener.columnar_cache, 'read_derived_table', lambda *args: None)
+    monkeypatch.setattr(screener.columnar_cache, 'write_derived_table', lambda *args: written.append(args))
+
+    engine = ScreenerEngine()
+    index = engine.get_index()
+    assert 'revenue_ttm' in index.metric_names and 'pe' not in index.metric_names
+    assert engine._indexes['us'][0][2] is None
+    assert not [args for args in written if args[1] == screener.SCREENER_TABLE_NAME]
+    assert engine.get_index() is index # לא מנסים שוב בכל בקשה
+
+    monkeypatch.setattr(screener.valuation_engine, 'get_valuations', get_valuations)
+    monkeypatch.setattr(screener, 'VALUATIONS_RETRY_SECONDS', 0)
+    assert 'pe' in engine.get_index().metric_names
+    assert engine._indexes['us'][0][2] is not None
+
+
+def make_index(n_rows=500, seed=0):
+    rng = np.random.default_rng(seed)
+    metrics = pd.DataFrame({
+        'pe': rng.normal(20, 10, n_rows).round(1), # מעוגל, כך שיש ערכים שווים ל-=
+        'revenue_growth_yoy': rng.normal(0.05, 0.2, n_rows)
+    }, index=pd.Index([f'T{i:04d}' for i in range(n_rows)], name='Ticker'))
+    metrics.iloc[rng.choice(n_rows, 50, replace=False), 0] = np.nan
+    return metrics, ScreenerIndex(metrics)
+
+
+@pytest.mark.parametrize('operator', ['>', '>=', '<', '<=', '='])
+def test_searchsorted_conditions_match_a_scan(operator):
+    metrics, index = make_index()
+    value = metrics['pe'].dropna().iloc[7]
+    scan = {'>': metrics['pe'] > value, '>=': metrics['pe'] >= value, '<': metrics['pe'] < value,
+            '<=': metrics['pe'] <= value, '=': metrics['pe'] == value}[operator]
+    assert sorted(index.matching_rows('pe', operator, value)) == list(np.flatnonzero(scan))
+
+
+def test_screen_ranks_and_limits_like_pandas():
+    metrics, index = make_index()
+    conditions = [screener.parse_condition('pe>10'), screener.parse_condition('pe<=30'),
+                  screener.parse_condition('revenue_growth_yoy>=0')]
+    screened, match_count = index.screen(conditions, sort_metric='revenue_growth_yoy', top=20)
+    expected = metrics.query('pe > 10 and pe <= 30 and revenue_growth_yoy >= 0')
+    assert match_count == len(expected)
+    assert list(screened.index) == list(expected['revenue_growth_yoy'].sort_values(ascending=False).index[:20])
+
+    # מיון לפי מדד שחסר לחלק מהטיקרים משאיר אותם בחוץ
+    screened, _ = index.screen([], sort_metric='pe', descending=False)
+    assert len(screened) == metrics['pe'].notna().sum() and screened['pe'].is_monotonic_increasing
+
+
+def test_bad_conditions_are_rejected():
+    _, index = make_index()
+    with pytest.raises(ValueError):
+        screener.parse_condition('pe >> 3')
+    with pytest.raises(ValueError):
+        index.matching_rows('unknown', '>', 1)
+
+
+def test_screener_api_filters_and_ranks_the_market(client, synthetic_market):
+    response = client.get('/api/screener?where=revenue_growth_yoy>0&where=net_margin>=0.05&sort=net_margin&top=10')
+    assert response.status_code == 200
+    payload = response.get_json()
+    assert payload['market_size'] == len(synthetic_market)
+    results = payload['results']
+    assert len(results) == min(10, payload['match_count'])
+    assert all(row['revenue_growth_yoy'] > 0 and row['net_margin'] >= 0.05 for row in results)
+    margins = [row['net_margin'] for row in results]
+    assert margins == sorted(margins, reverse=True)
+
+
+def test_screener_api_rejects_bad_conditions(client):
+    assert client.get('/api/screener?where=revenue_growth_yoy~0').status_code == 400
+    assert client.get('/api/screener?where=no_such_metric>1').status_code == 400
+    assert client.get('/api/screener?sort=no_such_metric').status_code == 400
@@ -0,0 +1,49 @@
+# tests/test_statement_files.py
+import numpy as np
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+import statement_files
+from frame_compaction import compact_frame
+from synthetic_data import make_statement_frame
+
+
+def make_ticker_frames():
+    frames = {}
+    for stmt_key in ('income', 'balance'):
+        for variant in ('annual', 'quarterly'):
+            df = make_statement_frame(['AAA'], stmt_key, variant).set_index('Report Date')
+            frames[(stmt_key, variant)] = df
+    # עמודת int שקיימת רק בדוח אחד - בטבלה המשותפת היא מקבלת NaN בשאר הדוחות
+    frames[('income', 'annual')]['Employees'] = np.arange(len(frames[('income', 'annual')]), dtype=np.int64) * 1000
+    return frames
+
+
+def test_ticker_store_round_trip_keeps_each_statements_dtypes(data_dir):
+    frames = make_ticker_frames()
+    statement_files.save_ticker_statements(frames, 'AAA')
+    loaded = statement_files.load_ticker_statements('AAA')
+    assert set(loaded) == set(frames)
+    for key, df in frames.items():
+        expected = compact_frame(df.sort_index(), sparse=False)
+        assert loaded[key]['Fiscal Year'].dtype == expected['Fiscal Year'].dtype
+        assert str(loaded[key]['Ticker'].dtype) == 'category'
+        assert_frame_equal(loaded[key], expected, check_categorical=False, check_index_type=False, check_freq=False)
+    assert loaded[('income', 'annual')]['Employees'].dtype == np.int16
+
+
+def test_load_reads_only_the_requested_statements(data_dir):
+    statement_files.save_ticker_statements(make_ticker_frames(), 'AAA')
+    loaded = statement_files.load_ticker_statements('AAA', frame_keys=[('balance', 'quarterly')])
+    assert list(loaded) == [('balance', 'quarterly')]
+    assert 'Revenue' not in loaded[('balance', 'quarterly')].columns
+    assert statement_files.load_ticker_statements('NONE') is None
+
+
+def test_data_dir_fixture_redirects_every_store(data_dir):
+    import ingest_jobs
+    import price_store
+    import valuation_history
+    assert price_store.price_store.get_file_path('AAA', '1d').startswith(data_dir)
+    assert valuation_history.valuation_history_store.get_file_path('AAA').startswith(data_dir)
+    assert ingest_jobs.ingest_job_queue.status_dir.startswith(data_dir)
@@ -0,0 +1,60 @@
+# tests/test_statement_store.py
+import os
+import time
+
+import pytest
+import simfin as sf
+
+from statement_store import StatementStore, get_dataset_file_paths
+
+# refresh_days של SimFin שמבטיח קריאה מהדיסק בלבד - הבדיקות לא ניגשות לרשת
+LOCAL_ONLY_DAYS = 10 ** 6
+
+
+@pytest.fixture
+def income_csv(synthetic_market):
+    """The extracted income CSV of the synthetic market; its mtime is restored afterwards."""
+    csv_path = get_dataset_file_paths('income', 'annual')[1]
+    stat_result = os.stat(csv_path)
+    yield csv_path
+    os.utime(csv_path, ns=(stat_result.st_atime_ns, stat_result.st_mtime_ns))
+
+
+def test_an_aged_dataset_is_downloaded_again(income_csv):
+    calls = []
+
+    def load_income(variant, market, **load_options):
+        calls.append(load_options)
+        if 'refresh_days' in load_options: # מה ש-SimFin עושה: מוריד מחדש וכותב את הקובץ
+            os.utime(income_csv, None)
+        return sf.load_income(variant=variant, market=market, refresh_days=LOCAL_ONLY_DAYS)
+    store = StatementStore(loaders={'income': load_income}, use_columnar_cache=False)
+
+    first = store.get_dataset('income', 'annual')
+    assert store.get_dataset('income', 'annual') is first and calls == [{}]
+
+    aged = time.time() - 40 * 86400
+    os.utime(income_csv, (aged, aged))
+    assert store.requires_download('income', 'annual')
+    refreshed = store.get_dataset('income', 'annual')
+    assert refreshed is not first and calls == [{}, {'refresh_days': 30}]
+    assert not store.requires_download('income', 'annual')
+    assert store.get_dataset('income', 'annual') is refreshed and len(calls) == 2
+
+
+def test_a_failed_refresh_keeps_the_existing_copy(income_csv):
+    attempts = []
+
+    def load_income(variant, market, **load_options):
+        if 'refresh_days' in load_options:
+            attempts.append(load_options)
+            raise IOError("SimFin server unavailable")
+        return sf.load_income(variant=variant, market=market, refresh_days=LOCAL_ONLY_DAYS)
+    store = StatementStore(loaders={'income': load_income}, use_columnar_cache=False)
+
+    aged = time.time() - 40 * 86400
+    os.utime(income_csv, (aged, aged))
+    dataset = store.get_dataset('income', 'annual')
+    assert dataset is not None and len(attempts) == 1
+    # עד הניסיון הבא משתמשים בעותק הקיים, בלי לנסות להוריד בכל קריאה
+    assert store.get_dataset('income', 'annual') is dataset and len(attempts) == 1
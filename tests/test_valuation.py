@@ -0,0 +1,54 @@
+# tests/test_valuation.py
+import numpy as np
+import pandas as pd
+
+from valuation import compute_valuations, dcf_fcf_multiple
+
+
+def test_ttm_figures_come_from_the_derived_metrics_rows():
+    latest_metrics = pd.DataFrame({'revenue_ttm': [400.0, np.nan], 'net_income_ttm': [40.0, 10.0],
+                                   'ebitda_ttm': [80.0, 20.0], 'fcf_ttm': [50.0, 5.0]},
+                                  index=pd.Index(['AAA', 'BBB'], name='Ticker'))
+    report_date = pd.Timestamp('2024-03-31')
+    income_q = pd.DataFrame({'Ticker': ['AAA', 'BBB', 'CCC'], 'Report Date': report_date,
+                             'Currency': 'USD', 'Shares (Diluted)': [10.0, 10.0, 10.0]})
+    prices = pd.DataFrame({'Ticker': ['AAA', 'BBB', 'CCC'], 'Date': pd.Timestamp('2024-04-02'),
+                           'Close': [20.0, 5.0, 1.0], 'Shares Outstanding': [10.0, 10.0, 10.0]})
+    valuations = compute_valuations(latest_metrics, income_q, None, prices)
+    assert valuations.loc['AAA', 'Revenue TTM'] == 400.0
+    assert valuations.loc['AAA', 'P/S'] == 200.0 / 400.0
+    assert valuations.loc['AAA', 'P/E'] == 200.0 / 40.0
+    assert np.isnan(valuations.loc['BBB', 'P/S']) # TTM חסר בטבלה הנגזרת
+    assert valuations.loc[['CCC'], ['Revenue TTM', 'FCF TTM']].isna().all(axis=None) # טיקר בלי שורה נגזרת
+
+
+def test_dcf_multiple_is_a_two_stage_present_value():
+    multiple = dcf_fcf_multiple(discount_rate=0.1, growth_rate=0.0, terminal_growth_rate=0.0, years=5)
+    # בלי צמיחה - אנונה אינסופית של 1 ב-10%
+    assert np.isclose(multiple, 10.0)
+
+
+def test_valuation_api_sorts_the_market_and_looks_up_a_ticker(client, synthetic_market):
+    from derived_metrics import derived_metrics_store
+    response = client.get('/api/valuations?sort=P/S&order=asc&limit=5')
+    assert response.status_code == 200
+    payload = response.get_json()
+    assert payload['market_size'] == len(synthetic_market) and len(payload['valuations']) == 5
+    ratios = [row['P/S'] for row in payload['valuations'] if row['P/S'] is not None]
+    assert ratios == sorted(ratios)
+
+    ticker = synthetic_market[0]
+    row = client.get(f'/api/valuations?ticker={ticker.lower()}').get_json()
+    assert row['Ticker'] == ticker
+    latest_metrics = derived_metrics_store.latest_by_ticker('quarterly').loc[ticker]
+    assert np.isclose(row['Revenue TTM'], latest_metrics['revenue_ttm'])
+    assert client.get('/api/valuations?ticker=NOPE').status_code == 404
+    assert client.get('/api/valuations?sort=Volume').status_code == 400
+
+
+def test_valuations_page_shows_the_current_ticker(client, synthetic_market):
+    with client.session_transaction() as flask_session:
+        flask_session['current_ticker'] = synthetic_market[0]
+    response = client.get('/valuations?sort=DCF Upside')
+    assert response.status_code == 200
+    assert synthetic_market[0] in response.get_data(as_text=True)
@@ -0,0 +1,106 @@
+# tests/test_valuation_history.py
+import numpy as np
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+from valuation_history import ValuationHistoryStore, _published_filings, build_filings, compute_valuation_history
+from synthetic_data import make_price_history
+
+
+def make_filings(bars):
+    dates = bars.index.tz_localize(None).normalize()
+    report_dates = pd.date_range(end=dates[-1], periods=5, freq='QE')
+    # כל דוח מתפרסם ביום מסחר, 40 יום אחרי סוף הרבעון
+    publish_dates = [dates[dates.searchsorted(report_date + pd.Timedelta(days=40))] for report_date in report_dates[:-1]]
+    income_q = pd.DataFrame({'Publish Date': publish_dates, 'Shares (Diluted)': [100.0, 100, 100, 100],
+                             'Revenue': 1.0}, index=pd.DatetimeIndex(report_dates[:-1], name='Report Date'))
+    metrics_q = pd.DataFrame({'revenue_ttm': [400.0, 440, 480, 520], 'net_income_ttm': [40.0, -4, 48, 52]},
+                             index=income_q.index)
+    balance_q = pd.DataFrame({'Publish Date': publish_dates, 'Total Equity': [1000.0, 1000, 1100, 1200]},
+                             index=income_q.index)
+    return income_q, build_filings(income_q, metrics_q, balance_q)
+
+
+def test_each_bar_uses_only_filings_published_before_it():
+    bars = make_price_history(300)
+    income_q, (income_filings, balance_filings) = make_filings(bars)
+    history = compute_valuation_history(bars, income_filings, balance_filings)
+
+    for report_date, publish_date in income_q['Publish Date'].items():
+        # ביום הפרסום עצמו עדיין משתמשים בדוח הקודם; מהבר הבא - בדוח החדש
+        assert history.loc[publish_date, 'Report Date'] != report_date
+        next_bar = history.index[history.index.get_loc(publish_date) + 1]
+        assert history.loc[next_bar, 'Report Date'] == report_date
+    before_first = history.index <= income_q['Publish Date'].iloc[0]
+    assert history.loc[before_first, 'P/E'].isna().all()
+
+    used = history.dropna(subset=['Report Date'])
+    published = income_q['Publish Date'].reindex(used['Report Date']).to_numpy()
+    assert (published < used.index.to_numpy()).all()
+    # מכפיל רווח לא מוגדר כשהרווח השנתי שלילי
+    assert used.loc[used['Net Income TTM'] < 0, 'P/E'].isna().all()
+    expected_ps = used['Close'] * 100 / used['Revenue TTM']
+    np.testing.assert_allclose(used['P/S'].to_numpy(), expected_ps.to_numpy())
+
+
+def test_shares_are_scaled_by_later_splits():
+    bars = make_price_history(300)
+    _, (income_filings, balance_filings) = make_filings(bars)
+    bars['Stock Splits'] = 0.0
+    bars.iloc[-10, bars.columns.get_loc('Stock Splits')] = 2.0
+    history = compute_valuation_history(bars, income_filings, balance_filings).dropna(subset=['Shares'])
+    assert (history['Shares'] == 200.0).all() # כל הדוחות פורסמו לפני הפיצול
+
+
+def test_a_late_amendment_of_an_older_quarter_is_dropped():
+    filings = _published_filings(pd.to_datetime(['2024-02-10', '2024-05-10', '2024-06-01']),
+                                 pd.to_datetime(['2023-12-31', '2024-03-31', '2023-12-31']), {'Shares': [1.0, 2.0, 3.0]})
+    assert list(filings['Shares']) == [1.0, 2.0]
+
+
+def test_computing_from_a_later_bar_matches_the_full_computation():
+    bars = make_price_history(300)
+    _, (income_filings, balance_filings) = make_filings(bars)
+    full = compute_valuation_history(bars, income_filings, balance_filings)
+    tail = compute_valuation_history(bars, income_filings, balance_filings, start=200)
+    assert_frame_equal(tail, full.iloc[200:])
+
+
+def test_series_in_memory_are_bounded_by_bytes(tmp_path):
+    bars = make_price_history(300)
+    _, (income_filings, balance_filings) = make_filings(bars)
+    entry = {'format_version': 1, 'series': compute_valuation_history(bars, income_filings, balance_filings),
+             'income_filings': income_filings, 'balance_filings': balance_filings}
+    store = ValuationHistoryStore(prices=object(), store=object(), metrics=object(), base_dir=str(tmp_path))
+    store._write_entry('AAA', entry)
+    store.max_bytes = store.current_bytes * 2
+    store._write_entry('BBB', entry)
+    store._read_entry('AAA') # AAA הכי חדש בשימוש - BBB ייזרק
+    store._write_entry('CCC', entry)
+    assert list(store._entries) == ['AAA', 'CCC'] and store.evictions == 1
+    assert store.current_bytes <= store.max_bytes
+    # סדרה שנזרקה נקראת שוב מהקובץ
+    assert_frame_equal(store._read_entry('BBB')['series'], entry['series'])
+
+
+def test_valuation_history_api_extends_the_stored_series(client, synthetic_market, price_source, monkeypatch):
+    from collections import OrderedDict
+    from valuation_history import valuation_history_store
+    monkeypatch.setattr(valuation_history_store, '_entries', OrderedDict())
+    monkeypatch.setattr(valuation_history_store, 'current_bytes', 0)
+    ticker = synthetic_market[0]
+
+    response = client.get(f'/api/valuation_history?ticker={ticker}&period=5y')
+    assert response.status_code == 200
+    payload = response.get_json()
+    assert payload['ticker'] == ticker and len(payload['dates']) > 1000
+    assert any(value is not None for value in payload['P/S'])
+    first_update = valuation_history_store.last_update
+    assert first_update['computed_rows'] == first_update['bars']
+
+    # בבקשה הבאה רק הבר האחרון (שאולי היה חלקי) מחושב מחדש
+    assert client.get(f'/api/valuation_history?ticker={ticker}&period=1y').status_code == 200
+    assert valuation_history_store.last_update['computed_rows'] == 1
+
+    assert client.get(f'/api/valuation_history?ticker={ticker}&period=7w').status_code == 400
+    assert client.get('/api/valuation_history?ticker=NOPE').status_code == 404
@@ -0,0 +1,226 @@
+# valuation.py
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from derived_metrics import derived_metrics_store
+from statement_store import get_dataset_signature, statement_store
+
+DCF_DISCOUNT_RATE = 0.09
+DCF_GROWTH_RATE = 0.05
+DCF_TERMINAL_GROWTH_RATE = 0.025
+DCF_YEARS = 5
+
+# (statement, variant) של כל dataset שההערכה נשענת עליו - החתימות שלהם הן גרסת התוצאה
+VALUATION_DATASETS = [('income', 'quarterly'), ('balance', 'quarterly'), ('cashflow', 'quarterly'), ('shareprices', 'latest')]
+
+# סכומי TTM מטבלת המדדים הנגזרים (שורת הרבעון האחרון של כל טיקר) - חישוב TTM אחד לכל האפליקציה
+TTM_METRIC_COLUMNS = ['revenue_ttm', 'net_income_ttm', 'ebitda_ttm', 'fcf_ttm']
+INCOME_LATEST_COLUMNS = ['Currency', 'Shares (Diluted)']
+BALANCE_LATEST_COLUMNS = ['Cash, Cash Equivalents & Short Term Investments', 'Short Term Debt', 'Long Term Debt']
+PRICE_COLUMNS = ['Close', 'Shares Outstanding']
+
+VALUATION_COLUMNS = [
+    'Currency', 'Report Date', 'Price Date', 'Price', 'Shares', 'Market Cap',
+    'Revenue TTM', 'Net Income TTM', 'EBITDA TTM', 'FCF TTM', 'Net Debt', 'Enterprise Value',
+    'P/E', 'P/S', 'EV/EBITDA', 'DCF Value per Share', 'DCF Upside'
+]
+
+#---------------------------------------------------------------------------------------------
+
+def latest_rows(df, columns, date_column):
+    """The most recent row of every ticker (by `date_column`), indexed by Ticker."""
+    df = df.sort_values(['Ticker', date_column], kind='stable')
+    return df.groupby('Ticker', sort=False).tail(1).set_index('Ticker')[[date_column] + columns]
+
+def dcf_fcf_multiple(discount_rate=DCF_DISCOUNT_RATE, growth_rate=DCF_GROWTH_RATE,
+                     terminal_growth_rate=DCF_TERMINAL_GROWTH_RATE, years=DCF_YEARS):
+    """
+    Present value of one unit of current free cash flow under a two-stage DCF:
+    `years` of growth at `growth_rate`, then a Gordon terminal value growing at
+    `terminal_growth_rate`, all discounted at `discount_rate`.
+
+    The multiple is the same for every ticker, so the DCF of the whole market is
+    one array multiplication.
+    """
+    if discount_rate <= terminal_growth_rate:
+        raise ValueError("discount_rate must be greater than terminal_growth_rate.")
+    t = np.arange(1, years + 1)
+    growth_years = ((1 + growth_rate) / (1 + discount_rate)) ** t
+    terminal_value = (1 + growth_rate) ** years * (1 + terminal_growth_rate) / (discount_rate - terminal_growth_rate)
+    return float(growth_years.sum() + terminal_value / (1 + discount_rate) ** years)
+
+def _positive_ratio(numerator, denominator):
+    """numerator / denominator, NaN where the denominator is not positive (e.g. P/E with a loss)."""
+    return numerator / denominator.where(denominator > 0)
+
+def compute_valuations(latest_metrics, income_q, balance_q, prices_latest, discount_rate=DCF_DISCOUNT_RATE,
+                       growth_rate=DCF_GROWTH_RATE, terminal_growth_rate=DCF_TERMINAL_GROWTH_RATE, years=DCF_YEARS):
+    """
+    Values every ticker of the market at once with column-wise array operations.
+
+    Args:
+        latest_metrics (pd.DataFrame): The latest quarterly derived-metrics row of every ticker
+            (derived_metrics_store.latest_by_ticker('quarterly')), indexed by Ticker; the TTM
+            figures come from its TTM_METRIC_COLUMNS (None gives NaN).
+        income_q, balance_q (pd.DataFrame): Whole-market quarterly statements as flat
+            frames with 'Ticker' and 'Report Date' columns (None or missing columns give NaN).
+        prices_latest (pd.DataFrame): Latest share prices with 'Ticker', 'Date', 'Close'
+            and (optionally) 'Shares Outstanding' columns.
+        discount_rate, growth_rate, terminal_growth_rate, years: DCF assumptions.
+
+    Returns:
+        pd.DataFrame: One row per ticker (index 'Ticker') with VALUATION_COLUMNS.
+    """
+    income_q = _with_columns(income_q, ['Ticker', 'Report Date'] + INCOME_LATEST_COLUMNS)
+    balance_q = _with_columns(balance_q, ['Ticker', 'Report Date'] + BALANCE_LATEST_COLUMNS)
+    prices_latest = _with_columns(prices_latest, ['Ticker', 'Date'] + PRICE_COLUMNS)
+    if latest_metrics is None:
+        latest_metrics = pd.DataFrame(columns=TTM_METRIC_COLUMNS)
+
+    income_latest = latest_rows(income_q, INCOME_LATEST_COLUMNS, 'Report Date')
+    balance_latest = latest_rows(balance_q, BALANCE_LATEST_COLUMNS, 'Report Date')
+    price_latest = latest_rows(prices_latest, PRICE_COLUMNS, 'Date')
+
+    tickers = income_latest.index.union(price_latest.index)
+    ttm = latest_metrics.reindex(index=tickers, columns=TTM_METRIC_COLUMNS).astype(float)
+    income_latest, balance_latest, price_latest = (income_latest.reindex(tickers), balance_latest.reindex(tickers),
+                                                   price_latest.reindex(tickers))
+
+    price = price_latest['Close'].astype(float)
+    shares = price_latest['Shares Outstanding'].astype(float).fillna(income_latest['Shares (Diluted)'].astype(float))
+    market_cap = price * shares
+
+    revenue = ttm['revenue_ttm']
+    net_income = ttm['net_income_ttm']
+    ebitda = ttm['ebitda_ttm']
+    fcf = ttm['fcf_ttm']
+    net_debt = (balance_latest['Short Term Debt'].fillna(0.0) + balance_latest['Long Term Debt'].fillna(0.0)
+                - balance_latest['Cash, Cash Equivalents & Short Term Investments'].fillna(0.0))
+    enterprise_value = market_cap + net_debt
+
+    dcf_enterprise_value = fcf.where(fcf > 0) * dcf_fcf_multiple(discount_rate, growth_rate, terminal_growth_rate, years)
+    dcf_value_per_share = (dcf_enterprise_value - net_debt) / shares.where(shares > 0)
+
+    valuations = pd.DataFrame({
+        'Currency': income_latest['Currency'],
+        'Report Date': income_latest['Report Date'],
+        'Price Date': price_latest['Date'],
+        'Price': price,
+        'Shares': shares,
+        'Market Cap': market_cap,
+        'Revenue TTM': revenue,
+        'Net Income TTM': net_income,
+        'EBITDA TTM': ebitda,
+        'FCF TTM': fcf,
+        'Net Debt': net_debt,
+        'Enterprise Value': enterprise_value,
+        'P/E': _positive_ratio(market_cap, net_income),
+        'P/S': _positive_ratio(market_cap, revenue),
+        'EV/EBITDA': _positive_ratio(enterprise_value, ebitda),
+        'DCF Value per Share': dcf_value_per_share,
+        'DCF Upside': dcf_value_per_share / price.where(price > 0) - 1.0
+    }, index=tickers)
+    valuations.index.name = 'Ticker'
+    return valuations
+
+def _with_columns(df, columns):
+    """`df` restricted to `columns`, adding the missing ones as NaN (an empty frame if `df` is None)."""
+    if df is None:
+        return pd.DataFrame(columns=columns)
+    return df.reindex(columns=columns)
+
+#---------------------------------------------------------------------------------------------
+
+def load_market_frame(stmt_key, variant, market='us', store=None):
+    """
+    A whole-market dataset from the statement store as a flat frame
+    (Ticker and date as columns), or None if it could not be loaded.
+    """
+    dataset = (store or statement_store).get_dataset(stmt_key, variant, market)
+    if dataset is None or not dataset.has_ticker_info:
+        return None
+    df_all = dataset.df_all
+    return df_all.reset_index() if 'Ticker' in df_all.index.names else df_all
+
+
+class ValuationEngine:
+    """
+    Whole-market valuations, computed once per dataset version.
+
+    The result for a set of DCF assumptions is kept until one of the
+    VALUATION_DATASETS changes on disk; a single ticker is then one index lookup.
+    """
+
+    def __init__(self, store=None, metrics_store=None):
+        self.store = store or statement_store
+        self.metrics_store = metrics_store or derived_metrics_store
+        self._results = {}
+        self._lock = threading.Lock()
+        self.last_compute_seconds = None
+
+    def dataset_version(self, market='us'):
+        return tuple(get_dataset_signature(stmt_key, variant, market) for stmt_key, variant in VALUATION_DATASETS)
+
+    def get_valuations(self, market='us', discount_rate=DCF_DISCOUNT_RATE, growth_rate=DCF_GROWTH_RATE,
+                       terminal_growth_rate=DCF_TERMINAL_GROWTH_RATE, years=DCF_YEARS):
+        """
+        Returns the valuation table of the whole market (see compute_valuations),
+        recomputing it only if a source dataset changed.
+
+        Returns:
+            tuple: (pd.DataFrame indexed by Ticker, dataset version tuple)
+        """
+        key = (market, discount_rate, growth_rate, terminal_growth_rate, years)
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None and cached[0] == self.dataset_version(market):
+                return cached[1], cached[0]
+
+            # ה-TTM מטבלת המדדים הנגזרים (הכנסות ותזרים); שאר הנתונים משורות אחרונות של הדוחות והמחירים.
+            # הדוחות עצמם נטענים כאן גם אם צריך להוריד אותם, אז גם הטבלה הנגזרת נבנית במקום ולא ברקע
+            latest_metrics = self.metrics_store.latest_by_ticker('quarterly', market, download=True)
+            frames = {stmt_key: load_market_frame(stmt_key, variant, market, self.store)
+                      for stmt_key, variant in VALUATION_DATASETS if stmt_key != 'cashflow'}
+            started = time.perf_counter()
+            valuations = compute_valuations(latest_metrics, frames['income'], frames['balance'], frames['shareprices'],
+                                            discount_rate, growth_rate, terminal_growth_rate, years)
+            self.last_compute_seconds = time.perf_counter() - started
+
+            # הגרסה נקראת אחרי הטעינה, כי הטעינה עצמה עשויה להוריד קובץ חדש
+            version = self.dataset_version(market)
+            self._results[key] = (version, valuations)
+            return valuations, version
+
+    def get_ticker_valuation(self, ticker, market='us', **dcf_assumptions):
+        """The valuation row of one ticker as a Series, or None if the ticker is not in the market data."""
+        valuations, _ = self.get_valuations(market, **dcf_assumptions)
+        ticker = ticker.upper().strip()
+        if ticker not in valuations.index:
+            return None
+        return valuations.loc[ticker]
+
+    def invalidate(self):
+        with self._lock:
+            self._results.clear()
+
+#---------------------------------------------------------------------------------------------
+
+def sort_valuations(valuations, sort_column='Market Cap', ascending=False, limit=None):
+    """Rows sorted by one valuation column (NaN last), optionally cut to the first `limit`."""
+    if sort_column not in valuations.columns:
+        raise ValueError(f"Unknown valuation column '{sort_column}'.")
+    sorted_valuations = valuations.sort_values(sort_column, ascending=ascending, na_position='last', kind='stable')
+    return sorted_valuations.head(limit) if limit else sorted_valuations
+
+def valuation_records(valuations):
+    """JSON-ready list of dicts (one per ticker; NaN -> None, dates as YYYY-MM-DD)."""
+    records = valuations.reset_index()
+    for column in ('Report Date', 'Price Date'):
+        records[column] = pd.to_datetime(records[column]).dt.strftime('%Y-%m-%d')
+    return records.astype(object).where(records.notna(), None).to_dict(orient='records')
+
+
+valuation_engine = ValuationEngine()
@@ -0,0 +1,361 @@
+# valuation_history.py
+"""
+Point-in-time daily valuation ratios (P/E, P/S, P/B) of a ticker.
+
+Every daily bar of the stored price history is joined as-of (pd.merge_asof)
+to the last quarterly filing that was *published* before that day, so a
+ratio only uses figures the market already had - no look-ahead through the
+Report Date. A filing published on day D counts from the next bar on, since
+the publish time within the day is unknown.
+
+The series of a ticker is kept in memory and pickled next to its prices
+(Data/<ticker>/<ticker>_valuation_history.pkl) and updated incrementally:
+new bars are joined on their own, and a new or changed filing only
+recomputes the bars after its publish date.
+
+Close is yfinance's adjusted close. Shares are scaled by the splits after
+the filing, so market caps are continuous across splits; the dividend
+adjustment is not undone, which lowers the ratios of older bars slightly.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from derived_metrics import derived_metrics_store, resolve_column
+from frame_cache import estimate_frame_bytes
+from price_store import get_period_days, price_store
+from statement_files import PROCESSED_DATA_BASE_DIR
+from statement_store import get_dataset_signature, statement_store
+
+# לשנות כשהחישוב משתנה, כדי שסדרות שנשמרו בדיסק יחושבו מחדש
+VALUATION_HISTORY_VERSION = 1
+# ההיסטוריה שממנה הסדרה מחושבת; תקופות קצרות יותר נחתכות ממנה
+VALUATION_HISTORY_PERIOD = '10y'
+# תקציב הזיכרון של הסדרות שמוחזקות בזיכרון (בבתים); מה שנזרק נקרא שוב מהקובץ בדיסק
+DEFAULT_VALUATION_HISTORY_CACHE_MAX_BYTES = int(os.environ.get('VALUATION_HISTORY_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+SHARES_COLUMN_OPTIONS = ['Shares (Diluted)', 'Shares (Basic)']
+EQUITY_COLUMN_OPTIONS = ['Total Equity', 'Total Equity (Deficit)']
+
+VALUATION_HISTORY_COLUMNS = [
+    'Close', 'Report Date', 'Shares', 'Market Cap', 'Revenue TTM', 'Net Income TTM', 'Book Value',
+    'P/E', 'P/S', 'P/B'
+]
+VALUATION_RATIO_COLUMNS = ['P/E', 'P/S', 'P/B']
+
+#---------------------------------------------------------------------------------------------
+
+def _published_filings(publish_dates, report_dates, values):
+    """
+    One row per publish date, sorted by it: Publish Date, Report Date and `values`
+    (dict of name -> array). A filing of an older quarter published after a newer
+    one (e.g. a late amendment) is dropped - it does not replace the newer figures.
+    """
+    filings = pd.DataFrame({'Publish Date': pd.to_datetime(np.asarray(publish_dates)),
+                            'Report Date': pd.to_datetime(np.asarray(report_dates)), **values})
+    filings = filings.dropna(subset=['Publish Date', 'Report Date'])
+    filings = filings.sort_values(['Publish Date', 'Report Date'], kind='stable')
+    filings = filings[filings['Report Date'] >= filings['Report Date'].cummax()]
+    # כמה דוחות שפורסמו באותו יום: האחרון (לפי Report Date) קובע
+    return filings.drop_duplicates('Publish Date', keep='last').reset_index(drop=True)
+
+def build_filings(income_q, metrics_q, balance_q):
+    """
+    The quarterly filings of one ticker, keyed by their publish date.
+
+    Args:
+        income_q (pd.DataFrame): Quarterly income statements indexed by Report Date,
+            with 'Publish Date' and a shares column.
+        metrics_q (pd.DataFrame): Quarterly derived metrics indexed by Report Date
+            (revenue_ttm, net_income_ttm), or None.
+        balance_q (pd.DataFrame): Quarterly balance sheets indexed by Report Date, or None.
+
+    Returns:
+        tuple: (income filings, balance filings) - frames with 'Publish Date', 'Report Date'
+               and the figures the ratios use; None if the income statements have no publish dates.
+    """
+    if income_q is None or income_q.empty or 'Publish Date' not in income_q.columns:
+        return None
+    shares_column = resolve_column(income_q, SHARES_COLUMN_OPTIONS)
+    if metrics_q is None:
+        metrics_q = pd.DataFrame(index=income_q.index)
+    metrics_q = metrics_q.reindex(income_q.index)
+    income_filings = _published_filings(income_q['Publish Date'], income_q.index, {
+        'Shares': income_q[shares_column].to_numpy(dtype=float) if shares_column else np.nan,
+        'Revenue TTM': metrics_q.get('revenue_ttm', pd.Series(np.nan, index=income_q.index)).to_numpy(dtype=float),
+        'Net Income TTM': metrics_q.get('net_income_ttm', pd.Series(np.nan, index=income_q.index)).to_numpy(dtype=float)
+    })
+
+    equity_column = resolve_column(balance_q, EQUITY_COLUMN_OPTIONS) if balance_q is not None else None
+    if equity_column is None or 'Publish Date' not in balance_q.columns:
+        balance_filings = _published_filings([], [], {'Book Value': []})
+    else:
+        balance_filings = _published_filings(balance_q['Publish Date'], balance_q.index,
+                                             {'Book Value': balance_q[equity_column].to_numpy(dtype=float)})
+    return income_filings, balance_filings
+
+def _bar_dates(bars):
+    """The bar timestamps as timezone-free dates."""
+    dates = bars.index
+    if dates.tz is not None:
+        dates = dates.tz_localize(None)
+    return dates.normalize()
+
+def _later_split_factors(dates, bars, report_dates):
+    """
+    For every report date, the product of the stock splits in `bars` after it:
+    the factor that converts shares reported then into the units of the
+    (split-adjusted) closes.
+    """
+    if 'Stock Splits' not in bars.columns:
+        return np.ones(len(report_dates))
+    ratios = bars['Stock Splits'].to_numpy(dtype=float)
+    ratios = np.where(ratios > 0, ratios, 1.0)
+    # מכפלת הפיצולים מכל בר ועד הסוף; האיבר האחרון (1) לתאריכים אחרי הבר האחרון
+    suffix_products = np.append(np.cumprod(ratios[::-1])[::-1], 1.0)
+    positions = np.searchsorted(dates.to_numpy(), pd.to_datetime(report_dates).to_numpy(), side='right')
+    return suffix_products[positions]
+
+def compute_valuation_history(bars, income_filings, balance_filings, start=0):
+    """
+    Daily valuation ratios for the bars from position `start` on, in one pass of
+    array operations (the splits are looked up over all of `bars`).
+
+    Args:
+        bars (pd.DataFrame): Daily bars with 'Close' (and 'Stock Splits'), sorted by date.
+        income_filings, balance_filings (pd.DataFrame): From build_filings().
+        start (int): First bar to compute.
+
+    Returns:
+        pd.DataFrame: VALUATION_HISTORY_COLUMNS indexed by Date (one row per bar from `start`).
+    """
+    dates = _bar_dates(bars)
+    days = pd.DataFrame({'Date': dates[start:], 'Close': bars['Close'].to_numpy(dtype=float)[start:]})
+    # allow_exact_matches=False: דוח שפורסם ביום D נכנס רק מהבר שאחריו
+    joined = pd.merge_asof(days, income_filings.rename(columns={'Publish Date': '_published'}),
+                           left_on='Date', right_on='_published', direction='backward', allow_exact_matches=False)
+    joined = pd.merge_asof(joined.drop(columns='_published'),
+                           balance_filings[['Publish Date', 'Book Value']].rename(columns={'Publish Date': '_published'}),
+                           left_on='Date', right_on='_published', direction='backward', allow_exact_matches=False)
+
+    shares = joined['Shares'].to_numpy(dtype=float) * _later_split_factors(dates, bars, joined['Report Date'])
+    market_cap = joined['Close'].to_numpy() * shares
+
+    def ratio(denominator):
+        # מכפיל לא מוגדר כשהמכנה אינו חיובי (הפסד, הון עצמי שלילי)
+        denominator = denominator.to_numpy(dtype=float)
+        return np.where(denominator > 0, market_cap / np.where(denominator > 0, denominator, 1.0), np.nan)
+
+    history = pd.DataFrame({
+        'Close': joined['Close'].to_numpy(),
+        'Report Date': joined['Report Date'].to_numpy(),
+        'Shares': shares,
+        'Market Cap': market_cap,
+        'Revenue TTM': joined['Revenue TTM'].to_numpy(),
+        'Net Income TTM': joined['Net Income TTM'].to_numpy(),
+        'Book Value': joined['Book Value'].to_numpy(),
+        'P/E': ratio(joined['Net Income TTM']),
+        'P/S': ratio(joined['Revenue TTM']),
+        'P/B': ratio(joined['Book Value'])
+    }, index=pd.DatetimeIndex(joined['Date'], name='Date'))
+    return history
+
+def _first_changed_publish_date(old_filings, new_filings):
+    """Earliest publish date of a filing that was added, removed or changed (None if the filings are the same)."""
+    if old_filings is None:
+        return pd.Timestamp.min
+    changed = pd.concat([old_filings, new_filings], ignore_index=True).drop_duplicates(keep=False)
+    return changed['Publish Date'].min() if not changed.empty else None
+
+#---------------------------------------------------------------------------------------------
+
+class ValuationHistoryStore:
+    """
+    Per-ticker daily valuation series, computed once and then extended.
+
+    On each request the stored series is checked against the current bars and
+    filings: rows before the last stored bar (which may have been partial) and
+    before the first changed filing are kept, the rest is recomputed. A
+    re-adjusted price history (after a split or dividend yfinance rewrites all
+    closes) recomputes the whole series. The series in memory are kept in an
+    LRU bounded by `max_bytes`, like PriceStore.
+    """
+
+    def __init__(self, prices=None, store=None, metrics=None, base_dir=None,
+                 max_bytes=DEFAULT_VALUATION_HISTORY_CACHE_MAX_BYTES):
+        self.prices = prices or price_store
+        self.store = store or statement_store
+        self.metrics = metrics or derived_metrics_store
+        self.base_dir = base_dir or PROCESSED_DATA_BASE_DIR
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._entries_lock = threading.Lock()
+        self.current_bytes = 0
+        self.evictions = 0
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self.last_update = None
+
+    def _lock_for(self, key):
+        with self._locks_guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def get_file_path(self, ticker_symbol):
+        return os.path.join(self.base_dir, ticker_symbol, f"{ticker_symbol}_valuation_history.pkl")
+
+    def _get_cached_entry(self, ticker_symbol):
+        with self._entries_lock:
+            item = self._entries.get(ticker_symbol)
+            if item is None:
+                return None
+            self._entries.move_to_end(ticker_symbol)
+            return item[0]
+
+    def _cache_entry(self, ticker_symbol, entry):
+        """Keeps `entry` in memory, evicting the least recently used ones beyond `max_bytes`."""
+        entry_bytes = sum(estimate_frame_bytes(entry[name]) for name in ('series', 'income_filings', 'balance_filings'))
+        with self._entries_lock:
+            old_item = self._entries.pop(ticker_symbol, None)
+            if old_item is not None:
+                self.current_bytes -= old_item[1]
+            if entry_bytes > self.max_bytes:
+                return
+            while self._entries and self.current_bytes + entry_bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_bytes
+                self.evictions += 1
+            self._entries[ticker_symbol] = (entry, entry_bytes)
+            self.current_bytes += entry_bytes
+
+    def _read_entry(self, ticker_symbol):
+        entry = self._get_cached_entry(ticker_symbol)
+        if entry is not None:
+            return entry
+        file_path = self.get_file_path(ticker_symbol)
+        if os.path.exists(file_path):
+            try:
+                entry = pd.read_pickle(file_path)
+                self._cache_entry(ticker_symbol, entry)
+            except Exception as e:
+                print(f"valuation_history.py: Could not read cached valuation history {file_path}: {e}")
+                entry = None
+        return entry
+
+    def _write_entry(self, ticker_symbol, entry):
+        file_path = self.get_file_path(ticker_symbol)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        tmp_path = f"{file_path}.{os.getpid()}.tmp"
+        pd.to_pickle(entry, tmp_path)
+        os.replace(tmp_path, file_path)
+        self._cache_entry(ticker_symbol, entry)
+
+    def fundamentals_version(self, market='us'):
+        """Version of the statements the series are built from (the derived metrics and the balance sheets)."""
+        balance_signature = get_dataset_signature('balance', 'quarterly', market)
+        return self.metrics.version('quarterly', market) + [list(balance_signature) if balance_signature else None]
+
+    def load_filings(self, ticker_symbol, market='us'):
+        """The ticker's filings (see build_filings) from the whole-market quarterly datasets."""
+        return build_filings(self.store.get_ticker_frame('income', 'quarterly', ticker_symbol, market),
+                             self.metrics.get_ticker_metrics(ticker_symbol, 'quarterly', market),
+                             self.store.get_ticker_frame('balance', 'quarterly', ticker_symbol, market))
+
+    @staticmethod
+    def _reusable_rows(entry, dates, closes, income_filings, balance_filings):
+        """The leading rows of the stored series that are still valid for these bars and filings."""
+        if entry is None or entry.get('format_version') != VALUATION_HISTORY_VERSION:
+            return None
+        series = entry['series']
+        series = series[series.index >= dates[0]]
+        # הבר האחרון שנשמר אולי היה חלקי (יום מסחר שלא הסתיים), אז הוא תמיד מחושב מחדש
+        kept_count = min(len(series) - 1, len(dates))
+        if kept_count <= 0:
+            return None
+        if not (series.index[:kept_count] == dates[:kept_count]).all() or \
+                not np.array_equal(series['Close'].to_numpy()[:kept_count], closes[:kept_count], equal_nan=True):
+            return None # yfinance התאים מחדש את כל ההיסטוריה (פיצול או דיבידנד)
+
+        for old_filings, new_filings in ((entry['income_filings'], income_filings),
+                                         (entry['balance_filings'], balance_filings)):
+            changed_date = _first_changed_publish_date(old_filings, new_filings)
+            if changed_date is not None:
+                kept_count = min(kept_count, int(np.searchsorted(dates.to_numpy(), np.datetime64(changed_date), side='right')))
+        return series.iloc[:kept_count]
+
+    def get_history(self, ticker_symbol, period=VALUATION_HISTORY_PERIOD, market='us'):
+        """
+        Returns the daily valuation series of a ticker over the last `period`,
+        computing only the rows that are new or affected by a changed filing.
+
+        Args:
+            ticker_symbol (str): The stock ticker.
+            period (str): yfinance period (e.g., "1y", "10y"); at most VALUATION_HISTORY_PERIOD is computed.
+            market (str): SimFin market of the statements.
+
+        Returns:
+            pd.DataFrame: VALUATION_HISTORY_COLUMNS indexed by Date (a copy), empty if there are
+                          no prices; None if the ticker has no quarterly statements.
+        """
+        ticker_symbol = ticker_symbol.upper().strip()
+        with self._lock_for(ticker_symbol):
+            filings = self.load_filings(ticker_symbol, market)
+            if filings is None:
+                return None
+            income_filings, balance_filings = filings
+            bars = self.prices.get_history(ticker_symbol, period=VALUATION_HISTORY_PERIOD, interval="1d")
+            if bars is None or bars.empty:
+                return pd.DataFrame(columns=VALUATION_HISTORY_COLUMNS)
+
+            dates = _bar_dates(bars)
+            closes = bars['Close'].to_numpy(dtype=float)
+            entry = self._read_entry(ticker_symbol)
+            kept = self._reusable_rows(entry, dates, closes, income_filings, balance_filings)
+            kept_count = 0 if kept is None else len(kept)
+            new_rows = compute_valuation_history(bars, income_filings, balance_filings, start=kept_count)
+            series = pd.concat([kept, new_rows]) if kept_count else new_rows
+            # בדרך כלל רק הבר האחרון חושב מחדש ולא השתנה - אז אין מה לכתוב
+            unchanged = (kept is not None and series.equals(entry['series'])
+                         and income_filings.equals(entry['income_filings']) and balance_filings.equals(entry['balance_filings']))
+            if not unchanged:
+                self._write_entry(ticker_symbol, {
+                    'format_version': VALUATION_HISTORY_VERSION,
+                    'series': series,
+                    'income_filings': income_filings,
+                    'balance_filings': balance_filings
+                })
+            self.last_update = {'ticker': ticker_symbol, 'bars': len(dates), 'computed_rows': len(dates) - kept_count}
+
+            period_days = min(get_period_days(period), get_period_days(VALUATION_HISTORY_PERIOD))
+            if not series.empty:
+                series = series[series.index >= series.index[-1] - pd.Timedelta(days=period_days)]
+            return series.copy()
+
+    def invalidate(self, ticker_symbol=None):
+        """Drops in-memory series (the files stay; they are re-validated when read)."""
+        with self._entries_lock:
+            if ticker_symbol is None:
+                self._entries.clear()
+                self.current_bytes = 0
+            else:
+                item = self._entries.pop(ticker_symbol.upper().strip(), None)
+                if item is not None:
+                    self.current_bytes -= item[1]
+
+
+valuation_history_store = ValuationHistoryStore()
+
+#---------------------------------------------------------------------------------------------
+
+def valuation_history_payload(history, columns=None):
+    """JSON-ready column arrays of a valuation series: 'dates' plus one list per column (NaN -> None, dates as YYYY-MM-DD)."""
+    columns = columns or VALUATION_HISTORY_COLUMNS
+    payload = {'dates': history.index.strftime('%Y-%m-%d').tolist()}
+    for column in columns:
+        values = history[column]
+        if column == 'Report Date':
+            values = pd.to_datetime(values).dt.strftime('%Y-%m-%d')
+        payload[column] = values.astype(object).where(values.notna(), None).tolist()
+    return payload